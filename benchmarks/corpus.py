@@ -0,0 +1,122 @@
+"""Generate synthetic HC4-style collections for benchmarking
+
+The documents, topics, and qrels are in the formats of the HC4 collection.
+The text is random words from a Zipfian vocabulary so that it can be tokenized on whitespace.
+The topic titles are planted in the relevant documents so that retrieval returns something to score.
+"""
+
+import dataclasses
+import itertools
+import json
+import pathlib
+import random
+
+ALPHABETS = {
+    'eng': 'abcdefghijklmnopqrstuvwxyz',
+    'rus': 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя',
+    'fas': 'ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی',
+    'zho': ''.join(chr(code) for code in range(0x4e00, 0x4e00 + 2000)),
+}
+
+
+@dataclasses.dataclass
+class Collection:
+    lang: str
+    docs_path: pathlib.Path
+    topics_path: pathlib.Path
+    qrels_path: pathlib.Path
+    num_docs: int
+    num_topics: int
+
+
+class Vocabulary:
+    """Random words with Zipfian frequencies"""
+
+    def __init__(self, lang, size, rng):
+        if lang not in ALPHABETS:
+            raise ValueError(f"No alphabet for language {lang}")
+        alphabet = ALPHABETS[lang]
+        # Chinese words are 1 to 3 characters while the other languages have 2 to 10 letters
+        min_length, max_length = (1, 3) if lang == 'zho' else (2, 10)
+        words = set()
+        while len(words) < size:
+            words.add(''.join(rng.choices(alphabet, k=rng.randint(min_length, max_length))))
+        self.words = sorted(words)
+        rng.shuffle(self.words)
+        self.cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, size + 1)))
+        self.rng = rng
+
+    def sample(self, k):
+        return self.rng.choices(self.words, cum_weights=self.cum_weights, k=k)
+
+    def mid_frequency(self, k):
+        """Sample words that are neither stop words nor hapaxes so that they make reasonable query terms"""
+        start = len(self.words) // 100
+        return self.rng.sample(self.words[start:start + len(self.words) // 10], k)
+
+
+def generate(directory, lang='eng', num_docs=10000, num_topics=50, doc_length=300, vocab_size=50000,
+             relevant_per_topic=10, seed=0):
+    """Generate docs.jsonl, topics.jsonl, and qrels in a directory
+
+    Args:
+        directory (str or Path): Directory for the files.
+        lang (str): Language code (eng, rus, fas, or zho).
+        num_docs (int): Number of documents.
+        num_topics (int): Number of topics.
+        doc_length (int): Mean number of words in a document (lengths are log-normally distributed).
+        vocab_size (int): Number of words in the vocabulary.
+        relevant_per_topic (int): Number of relevant documents per topic.
+        seed (int): Random seed so that the same collection is generated each time.
+
+    Returns:
+        Collection
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    vocab = Vocabulary(lang, vocab_size, rng)
+
+    topics = [(f"{lang}-{i:03d}", vocab.mid_frequency(3)) for i in range(num_topics)]
+    relevant = {}
+    for topic_id, title in topics:
+        for doc_index in rng.sample(range(num_docs), min(relevant_per_topic, num_docs)):
+            relevant.setdefault(doc_index, []).append((topic_id, title))
+
+    collection = Collection(lang, directory / 'docs.jsonl', directory / 'topics.jsonl', directory / 'qrels',
+                            num_docs, num_topics)
+    with open(collection.docs_path, 'w', encoding='utf8') as docs_fp, \
+            open(collection.qrels_path, 'w', encoding='utf8') as qrels_fp:
+        for doc_index in range(num_docs):
+            doc_id = f"{lang}-doc-{doc_index:08d}"
+            length = max(10, int(rng.lognormvariate(0, 0.5) * doc_length))
+            words = vocab.sample(length)
+            for topic_id, title in relevant.get(doc_index, []):
+                for word in title:
+                    words.insert(rng.randrange(len(words)), word)
+                qrels_fp.write(f"{topic_id} 0 {doc_id} 1\n")
+            doc = {
+                'id': doc_id,
+                'cc_file': 'crawl-data/synthetic.gz',
+                'date': '2021-01-01',
+                'title': ' '.join(vocab.sample(8)),
+                'text': ' '.join(words),
+                'url': f"https://example.org/{doc_id}.html",
+            }
+            docs_fp.write(json.dumps(doc, ensure_ascii=False) + '\n')
+
+    with open(collection.topics_path, 'w', encoding='utf8') as fp:
+        for topic_id, title in topics:
+            topic = {
+                'topic_id': topic_id,
+                'languages_with_qrels': [lang],
+                'topics': [{
+                    'lang': lang,
+                    'source': 'original',
+                    'topic_title': ' '.join(title),
+                    'topic_description': ' '.join(title + vocab.sample(10)),
+                }],
+                'report': {'url': 'https://example.org', 'text': ' '.join(vocab.sample(50)), 'date': '2021-01-01'},
+            }
+            fp.write(json.dumps(topic, ensure_ascii=False) + '\n')
+    return collection
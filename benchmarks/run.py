@@ -0,0 +1,232 @@
+"""End-to-end benchmarks of patapsco on synthetic collections
+
+Each benchmark runs the patapsco runner in a subprocess so that every mode starts from a fresh process
+(with no warm workers or cached models) and the peak memory of the run and its workers can be measured.
+
+Example:
+    python -m benchmarks.run --docs 20000 --langs eng rus --output bench.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from patapsco import __version__
+from . import corpus
+
+MODES = ('streaming', 'batch', 'mp')
+
+# metrics where a higher value is better and those where lower is better
+HIGHER_IS_BETTER = ('docs_per_sec', 'queries_per_sec')
+LOWER_IS_BETTER = ('peak_rss', 'index_size')
+
+
+def create_config(collection, mode, run_path, num_jobs=2, batch_size=1000, retrieval=True):
+    """Create the configuration dictionary for a benchmark run"""
+    process = {
+        'normalize': {'lowercase': True},
+        'tokenize': 'whitespace',
+        'stem': False,
+    }
+    config = {
+        'run': {
+            'name': f"benchmark {collection.lang} {mode}",
+            'path': str(run_path),
+        },
+        'documents': {
+            'input': {'format': 'json', 'lang': collection.lang, 'path': str(collection.docs_path)},
+            'process': dict(process),
+        },
+    }
+    if retrieval:
+        config.update({
+            'index': {'name': 'lucene'},
+            'topics': {
+                'input': {'format': 'json', 'lang': collection.lang, 'source': 'original',
+                          'path': str(collection.topics_path)},
+                'fields': 'title',
+            },
+            'queries': {'process': dict(process)},
+            'retrieve': {'name': 'bm25', 'number': 100},
+            'score': {'input': {'path': str(collection.qrels_path)}},
+        })
+    else:
+        config['documents']['output'] = True
+    if mode == 'batch':
+        config['run']['stage1'] = {'mode': 'batch', 'batch_size': batch_size}
+        config['run']['stage2'] = {'mode': 'batch', 'batch_size': batch_size}
+    elif mode == 'mp':
+        config['run']['parallel'] = {'name': 'mp'}
+        config['run']['stage1'] = {'num_jobs': num_jobs}
+        config['run']['stage2'] = {'num_jobs': num_jobs}
+    elif mode != 'streaming':
+        raise ValueError(f"Unknown mode {mode}")
+    if not retrieval:
+        config['run']['stage2'] = False
+    return config
+
+
+def run_benchmark(config, directory, poll_interval=0.1):
+    """Run patapsco in a subprocess and measure it
+
+    Returns:
+        dict of metrics
+    """
+    directory = pathlib.Path(directory)
+    config_path = directory / 'config.json'
+    with open(config_path, 'w') as fp:
+        json.dump(config, fp, indent=4)
+    log_path = directory / 'benchmark.log'
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        process = psutil.Popen([sys.executable, '-m', 'patapsco.bin.main', str(config_path)],
+                               stdout=log, stderr=subprocess.STDOUT)
+        peak_rss = 0
+        while process.poll() is None:
+            peak_rss = max(peak_rss, _get_tree_rss(process))
+            time.sleep(poll_interval)
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark run failed. See {log_path}")
+
+    run_path = pathlib.Path(config['run']['path'])
+    with open(run_path / 'timing.json') as fp:
+        timing = json.load(fp)
+    stage1 = timing['stage1']
+    stage2 = timing['stage2']
+    return {
+        'docs': stage1['count'],
+        'docs_per_sec': stage1['throughput']['items_per_sec'],
+        'doc_bytes_per_sec': stage1['throughput']['bytes_per_sec'],
+        'stage1_time': stage1['time'],
+        'queries': stage2['count'],
+        'queries_per_sec': stage2['throughput']['items_per_sec'],
+        'stage2_time': stage2['time'],
+        'wall_time': wall_time,
+        'peak_rss': peak_rss,
+        'index_size': _get_dir_size(run_path / 'index'),
+    }
+
+
+def _get_tree_rss(process):
+    """Resident memory of a process and its children (the mp workers)"""
+    rss = 0
+    try:
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    for proc in processes:
+        try:
+            rss += proc.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+def _get_dir_size(path):
+    path = pathlib.Path(path)
+    if not path.exists():
+        return 0
+    return sum(item.stat().st_size for item in path.rglob('*') if item.is_file())
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare benchmark results to a baseline
+
+    Args:
+        results (dict): Benchmark results.
+        baseline (dict): Baseline results in the same format.
+        tolerance (float): Fraction that a metric can get worse before it is a regression.
+
+    Returns:
+        list of regressions as dicts with benchmark, metric, baseline, value, and change
+    """
+    regressions = []
+    for name, metrics in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        base = baseline['benchmarks'][name]
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            if not base.get(metric) or metric not in metrics:
+                continue
+            change = (metrics[metric] - base[metric]) / base[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append({'benchmark': name, 'metric': metric, 'baseline': base[metric],
+                                    'value': metrics[metric], 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patapsco end-to-end benchmarks on synthetic collections")
+    parser.add_argument("--docs", type=int, default=10000, help="Number of documents per language")
+    parser.add_argument("--topics", type=int, default=50, help="Number of topics per language")
+    parser.add_argument("--doc-length", type=int, default=300, help="Mean number of words per document")
+    parser.add_argument("--langs", nargs='+', default=['eng'], choices=sorted(corpus.ALPHABETS))
+    parser.add_argument("--modes", nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument("--jobs", type=int, default=2, help="Number of jobs for the mp mode")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Batch size for the batch mode")
+    parser.add_argument("--no-retrieval", action="store_true",
+                        help="Only run document processing (no index or queries so Java is not needed)")
+    parser.add_argument("--work-dir", help="Directory for the collections and runs (default is a temp dir)")
+    parser.add_argument("--output", help="Path to write the results json")
+    parser.add_argument("--baseline", help="Path to a results json to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed fraction of slowdown")
+    args = parser.parse_args()
+
+    work_dir = pathlib.Path(args.work_dir) if args.work_dir else pathlib.Path(tempfile.mkdtemp(prefix='patapsco-'))
+    results = {
+        'meta': {
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'docs': args.docs,
+            'topics': args.topics,
+            'doc_length': args.doc_length,
+            'retrieval': not args.no_retrieval,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'benchmarks': {},
+    }
+    for lang in args.langs:
+        collection = corpus.generate(work_dir / 'data' / lang, lang, args.docs, args.topics, args.doc_length)
+        for mode in args.modes:
+            name = f"{lang}/{mode}"
+            directory = work_dir / 'runs' / lang / mode
+            directory.mkdir(parents=True, exist_ok=True)
+            config = create_config(collection, mode, directory / 'run', args.jobs, args.batch_size,
+                                   not args.no_retrieval)
+            print(f"Running {name}", flush=True)
+            metrics = run_benchmark(config, directory)
+            results['benchmarks'][name] = metrics
+            print(f"  {metrics['docs_per_sec']:.1f} docs/sec  {metrics['queries_per_sec']:.1f} queries/sec  "
+                  f"peak rss {metrics['peak_rss'] / 2 ** 20:.0f} MB  index {metrics['index_size'] / 2 ** 20:.1f} MB",
+                  flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression {regression['benchmark']} {regression['metric']}: "
+                  f"{regression['baseline']:.1f} -> {regression['value']:.1f} ({100 * regression['change']:+.1f}%)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,13 +11,16 @@ def main():
     parser.add_argument("-d", "--debug", action="store_true", help="Include debug information in logging")
     parser.add_argument("-v", "--version", action="version", version=f"Patapsco {__version__}")
     parser.add_argument("--job", type=int, required=True, help="Job id starting from 0")
-    parser.add_argument("--increment", type=int, required=True, help="Size of a job increment")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--increment", type=int, help="Size of a job increment")
+    group.add_argument("--manifest", help="Shard manifest for stage 1 where the job id is the shard")
     parser.add_argument("--stage", type=int, required=True, choices={1, 2}, help="Pipeline stage")
     args = parser.parse_args()
 
     parallel_args = {
         'job': args.job,
         'increment': args.increment,
+        'manifest': args.manifest,
         'stage': args.stage
     }
     try:
@@ -11,10 +11,16 @@ def main():
     parser.add_argument("-d", "--debug", action="store_true", help="Include debug information in logging")
     parser.add_argument("-v", "--version", action="version", version=f"Patapsco {__version__}")
     parser.add_argument("--stage", type=int, required=True, choices={1, 2}, help="Pipeline stage")
+    parser.add_argument("--level", type=int, help="Level of a tree reduce (stage 1 only)")
+    parser.add_argument("--group", type=int, help="Zero-based group of parts for the level of a tree reduce")
     args = parser.parse_args()
+    if args.level is not None and (args.stage != 1 or args.group is None):
+        parser.error("--level requires --stage 1 and --group")
 
     parallel_args = {
-        'stage': args.stage
+        'stage': args.stage,
+        'level': args.level,
+        'group': args.group,
     }
     try:
         runner = Runner(args.config, debug=args.debug, job_type=JobType.REDUCE, **parallel_args)
@@ -77,6 +77,9 @@ class DocumentDatabaseFactory:
 class DatabaseWriter(Task):
     """Write documents to the database"""
 
+    sink = True
+    independent_reduce = True
+
     def __init__(self, run_path, config, artifact_config):
         """
         Args:
@@ -101,15 +104,19 @@ class DatabaseWriter(Task):
         del doc.original_text
         return doc
 
+    def checkpoint(self):
+        # writing a document again after resuming replaces it so only the commit is needed
+        self.db.commit()
+        return None
+
     def reduce(self, dirs):
         LOGGER.debug("Reducing to a sqlite db from %s", ', '.join(str(x) for x in dirs))
+        # the parts are attached one at a time so that sqlite copies the rows without decoding them
+        self.db.commit()
         for base in dirs:
-            path = base / 'docs.db'
-            kwargs = {
-                'encode': encode,
-                'decode': decode,
-                'tablename': 'patapsco'
-            }
-            db = sqlitedict.SqliteDict(str(path), **kwargs)
-            for doc_id in db:
-                self.db[doc_id] = db[doc_id]
+            path = pathlib.Path(base) / 'docs.db'
+            self.db.conn.execute('ATTACH DATABASE ? AS part', (str(path),))
+            self.db.conn.execute(f'INSERT OR REPLACE INTO "{self.db.tablename}" SELECT key, value FROM part.patapsco')
+            self.db.commit()
+            self.db.conn.execute('DETACH DATABASE part')
+        self.db.commit()
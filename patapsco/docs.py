@@ -1,18 +1,24 @@
+import ast
 import collections
 import csv
 import dataclasses
-import gzip
+import itertools
 import json
 import logging
 import pathlib
+import sqlite3
+import zlib
 from typing import Optional
 
-from .error import ParseError
+from .__version__ import __version__
+from .error import ConfigError, ParseError
 from .pipeline import Task
 from .schema import DocumentsInputConfig
 from .text import TextProcessor
-from .util import DataclassJSONEncoder, InputIterator, LangStandardizer, NoGlobSupport, ReaderFactory
-from .util.file import count_lines, count_lines_with, path_append
+from .util import DataclassJSONEncoder, InputIterator, LangStandardizer, NoGlobSupport, ReaderFactory, \
+    SeekableInput
+from .util.cache import ProcessedTextCache
+from .util.file import count_lines, count_lines_with, open_output, open_text_at, path_append, sync_output
 from .util.formats import parse_sgml_documents
 from .util.normalize import compare_strings
 
@@ -39,14 +45,24 @@ class DocumentReaderFactory(ReaderFactory):
     name = "input document type"
 
 
-class SgmlDocumentReader(InputIterator):
+class SgmlDocumentReader(InputIterator, SeekableInput):
     """Iterator that reads a TREC sgml document"""
 
-    def __init__(self, path, encoding, lang, **kwargs):
+    record_marker = '<DOC>'
+
+    def __init__(self, path, encoding, lang, offset=None, count=None, **kwargs):
+        """
+        Args:
+            path (str): Path to file to parse
+            encoding (str): Encoding of file
+            lang (str): Language of documents in file
+            offset (int): Optional byte offset of the first document to read
+            count (int): Optional number of documents to read
+        """
         self.path = path
         self.encoding = encoding
         self.lang = lang
-        self.docs_iter = iter(parse_sgml_documents(path, encoding))
+        self.docs_iter = iter(parse_sgml_documents(path, encoding, offset, count))
 
     def __iter__(self):
         return self
@@ -59,21 +75,23 @@ class SgmlDocumentReader(InputIterator):
         return count_lines_with('<DOC>', self.path, self.encoding)
 
 
-class Hc4JsonDocumentReader(InputIterator):
+class Hc4JsonDocumentReader(InputIterator, SeekableInput):
     """Read documents from a JSONL file to start a pipeline"""
 
-    def __init__(self, path, encoding, lang, **kwargs):
+    def __init__(self, path, encoding, lang, offset=None, count=None, **kwargs):
         """
         Args:
             path (str): Path to file to parse
             encoding (str): Encoding of file
             lang (str): Language of documents in file
+            offset (int): Optional byte offset of the first document to read
+            count (int): Optional number of documents to read
         """
         self.path = path
         self.encoding = encoding
         self.lang = lang
-        open_func = gzip.open if path.endswith('.gz') else open
-        self.fp = open_func(path, 'rt', encoding=encoding)
+        self.fp = open_text_at(path, encoding, offset)
+        self.limit = count
         self.count = 0
 
     def __iter__(self):
@@ -82,6 +100,9 @@ class Hc4JsonDocumentReader(InputIterator):
     def __next__(self):
         if self.fp.closed:
             raise StopIteration
+        if self.limit is not None and self.count >= self.limit:
+            self.fp.close()
+            raise StopIteration
         self.count += 1
         line = self.fp.readline()
         if not line:
@@ -99,16 +120,25 @@ class Hc4JsonDocumentReader(InputIterator):
         return count_lines(self.path, self.encoding)
 
 
-class TsvDocumentReader(InputIterator):
+class TsvDocumentReader(InputIterator, SeekableInput):
     """Iterator that reads TSV documents from MSMARCO Passages"""
 
-    def __init__(self, path, encoding, lang, **kwargs):
+    def __init__(self, path, encoding, lang, offset=None, count=None, **kwargs):
+        """
+        Args:
+            path (str): Path to file to parse
+            encoding (str): Encoding of file
+            lang (str): Language of documents in file
+            offset (int): Optional byte offset of the first document to read
+            count (int): Optional number of documents to read
+        """
         self.path = path
         self.encoding = encoding
         self.lang = lang
-        open_func = gzip.open if path.endswith('.gz') else open
-        self.fp = open_func(path, 'rt', encoding=encoding)
+        self.fp = open_text_at(path, encoding, offset)
         self.reader = csv.reader(self.fp, delimiter='\t')
+        if count is not None:
+            self.reader = itertools.islice(self.reader, count)
 
     def __iter__(self):
         return self
@@ -161,10 +191,23 @@ class IRDSDocumentReader(InputIterator, NoGlobSupport):
 class DocWriter(Task):
     """Write documents to a json file using internal format"""
 
+    sink = True
+    independent_reduce = True
+
     def __init__(self, run_path, config, artifact_config):
         super().__init__(run_path, artifact_config, config.output)
-        path = self.base / 'documents.jsonl'
-        self.file = open(path, 'w')
+        self.path = self.base / 'documents.jsonl'
+        self.file = None
+        self.offset = None
+
+    def begin(self):
+        self.file = open_output(self.path, self.offset)
+
+    def checkpoint(self):
+        return {'offset': sync_output(self.file)}
+
+    def restore(self, state):
+        self.offset = state['offset']
 
     def process(self, doc):
         """
@@ -192,14 +235,24 @@ class DocWriter(Task):
                     self.file.write(line)
 
 
-class DocReader(InputIterator):
+class DocReader(InputIterator, SeekableInput):
     """Iterator over documents written by DocWriter"""
 
-    def __init__(self, path):
+    encoding = 'utf8'
+
+    def __init__(self, path, offset=None, count=None):
+        """
+        Args:
+            path (str or Path): Path to the file or the directory that contains it
+            offset (int): Optional byte offset of the first document to read
+            count (int): Optional number of documents to read
+        """
         self.path = pathlib.Path(path)
         if self.path.is_dir():
             self.path = self.path / 'documents.jsonl'
-        self.file = open(self.path, 'r')
+        self.file = open_text_at(self.path, self.encoding, offset)
+        self.limit = count
+        self.count = 0
 
     def __iter__(self):
         return self
@@ -207,6 +260,10 @@ class DocReader(InputIterator):
     def __next__(self):
         if self.file.closed:
             raise StopIteration
+        if self.limit is not None and self.count >= self.limit:
+            self.file.close()
+            raise StopIteration
+        self.count += 1
         line = self.file.readline()
         if not line:
             self.file.close()
@@ -221,6 +278,17 @@ class DocReader(InputIterator):
 class DocumentProcessor(TextProcessor):
     """Document Preprocessing"""
     MAX_TEXT_LEN = 1000000  # throw out documents longer than a million characters
+    REPORT_MODES = {False: None, True: 'diff', 'diff': 'diff', 'counts': 'counts'}
+    # settings that do not change the processed text so they are not part of the cache key
+    CACHE_KEY_EXCLUDE = {
+        'comment': ...,
+        'batch_size': ...,
+        'n_process': ...,
+        'strict_check': ...,
+        'stem_cache': ...,
+        'normalize': {'report', 'report_sample', 'report_output'},
+        'stanza': {'threads', 'interop_threads'},
+    }
 
     def __init__(self, run_path, config, lang):
         """
@@ -230,8 +298,33 @@ class DocumentProcessor(TextProcessor):
             lang (str): Language code for the documents.
         """
         super().__init__(run_path, config.process, lang)
-        self.save_report = config.process.normalize.report
+        normalize = config.process.normalize
+        self.report_mode = self.REPORT_MODES.get(normalize.report, normalize.report)
+        if self.report_mode not in self.REPORT_MODES.values():
+            raise ConfigError(f"Unknown normalization report: {normalize.report}")
+        self.report_sample = normalize.report_sample
+        self.report_output = normalize.report_output
+        if self.report_mode:
+            # the reduce of the parts of a parallel job merges their reports
+            self.relative_path = str(pathlib.Path(self.report_output).parent)
         self.diffs = collections.Counter()
+        self.cache_config = config.cache
+        self.cache = None
+
+    def begin(self):
+        super().begin()
+        if self.cache_config:
+            if self.report_mode:
+                # the report needs every document to be normalized
+                LOGGER.info("Not using the document cache because the normalization report is on")
+                return
+            path = self.cache_config.path
+            namespace = f"{__version__} {self.lang} {self.processor_config.json(exclude=self.CACHE_KEY_EXCLUDE)}"
+            try:
+                self.cache = ProcessedTextCache(pathlib.Path(path) if path else None, self.cache_config.max_size,
+                                                namespace)
+            except (OSError, sqlite3.Error) as e:
+                LOGGER.warning(f"Unable to open the document cache so it is not used: {e}")
 
     def process(self, doc):
         """
@@ -241,29 +334,117 @@ class DocumentProcessor(TextProcessor):
         Returns
             Doc
         """
+        if self.cache:
+            return self.batch_process([doc])[0]
+        text = self._pre_process(doc)
+        if text is None:
+            return None
+        return self._post_process(doc, self.tokenize(text))
+
+    def batch_process(self, docs):
+        """Tokenize the batch at once so that spacy and stanza can batch their models
+
+        Args:
+            docs (list of Doc)
+
+        Returns
+            list of Doc with None for rejected documents
+        """
+        if self.cache:
+            return self._batch_process_with_cache(docs)
+        texts = [self._pre_process(doc) for doc in docs]
+        tokens = iter(self.tokenize_batch([text for text in texts if text is not None]))
+        return [self._post_process(doc, next(tokens)) if text is not None else None for doc, text in zip(docs, texts)]
+
+    def _batch_process_with_cache(self, docs):
+        """Only process the documents that are not in the cache and then add them to it"""
+        keys = [self.cache.get_key(doc.text) for doc in docs]
+        found = self.cache.get_many(keys)
+        results = [None] * len(docs)
+        pending = []
+        for index, (doc, key) in enumerate(zip(docs, keys)):
+            if key in found:
+                doc.original_text, doc.text = found[key]
+                results[index] = doc
+            else:
+                text = self._pre_process(doc)
+                if text is not None:
+                    pending.append((index, text))
+        if not pending:
+            return results
+        tokens = self.tokenize_batch([text for _, text in pending])
+        for (index, _), doc_tokens in zip(pending, tokens):
+            doc = self._post_process(docs[index], doc_tokens)
+            self.cache.put(keys[index], doc.original_text, doc.text)
+            results[index] = doc
+        return results
+
+    def _pre_process(self, doc):
+        """Normalize the text of the document or return None if it is rejected"""
         text = original_text = doc.text
         if len(text) > self.MAX_TEXT_LEN:
             LOGGER.warning(f"Rejecting {doc.id} because it exceeds the length limit with a length of {len(text)}")
             return None
-        text = self.pre_normalize(text)
+        sampled = self.report_mode and self._is_sampled(doc)
+        # the counts come from the normalization pass rather than from diffing the text
+        text = self.pre_normalize(text, self.diffs if sampled and self.report_mode == 'counts' else None)
         doc.original_text = text  # this for the database to use
-        if self.save_report:
-            self.diffs += compare_strings(original_text, text)
-
-        tokens = self.tokenize(text)
-        stopword_indices = self.identify_stop_words(tokens)
-        tokens = self.stem(tokens)
-        tokens = self.remove_stop_words(tokens, stopword_indices)
-        text = self.post_normalize(' '.join(tokens))
-        doc.text = text
+        if sampled and self.report_mode == 'diff':
+            self.diffs.update(compare_strings(original_text, text))
+        return text
+
+    def _is_sampled(self, doc):
+        """Sample by a hash of the id so that the same documents are sampled in every run"""
+        if self.report_sample >= 1:
+            return True
+        return zlib.crc32(doc.id.encode()) % 10000 < self.report_sample * 10000
+
+    def _post_process(self, doc, tokens):
+        doc.text = self.process_tokens(tokens)
         return doc
 
     def end(self):
-        if self.save_report:
+        super().end()
+        self._close_cache()
+        if self.report_mode:
             self._save_report()
 
+    def end_worker(self):
+        # the report counts are merged and written by the main process
+        super().end()
+        self._close_cache()
+        return self.diffs if self.report_mode else None
+
+    def merge_worker(self, state):
+        self.diffs.update(state)
+
+    def _close_cache(self):
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+
+    def reduce(self, dirs):
+        # end() may be called after this so the merged counts are kept
+        name = pathlib.Path(self.report_output).name
+        for base in dirs:
+            path = base / name
+            if path.exists():
+                self.diffs.update(self._read_report(path))
+        self._save_report()
+
     def _save_report(self):
-        with open(self.run_path / 'normalize_report.txt', 'w') as fp:
+        path = self.run_path / self.report_output
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as fp:
             for change, count in self.diffs.most_common(len(self.diffs)):
                 if "\n" not in change:  # skip newline removal
                     fp.write(f"{repr(change)}\t{count}\n")
+
+    @staticmethod
+    def _read_report(path):
+        diffs = collections.Counter()
+        with open(path) as fp:
+            for line in fp:
+                change, count = line.rstrip('\n').rsplit('\t', 1)
+                diffs[ast.literal_eval(change)] += int(count)
+        return diffs
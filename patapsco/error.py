@@ -14,3 +14,7 @@ class ParseError(PatapscoError):
 
 class BadDataError(PatapscoError):
     pass
+
+
+class JobStoppedError(PatapscoError):
+    pass
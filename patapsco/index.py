@@ -20,6 +20,9 @@ class IndexerFactory(TaskFactory):
 class LuceneIndexer(Task):
     """Lucene inverted index"""
 
+    sink = True
+    independent_reduce = True
+
     def __init__(self, run_path, index_config, artifact_config):
         """
         Args:
@@ -76,10 +79,25 @@ class LuceneIndexer(Task):
             LOGGER.warning(f"Failed to index doc {doc.id} due to {e}")
         return doc
 
+    def checkpoint(self):
+        # documents added after the last commit are dropped when the index is reopened
+        if self._writer:
+            try:
+                self._writer.commit()
+            except self.java.JavaException as e:
+                raise PatapscoError(f"Committing index failed with message: {e}")
+        # a resumed run may have no documents left to get the language from
+        return {'lang': self.lang}
+
+    def restore(self, state):
+        if state:
+            self.lang = state['lang']
+
     def end(self):
         """End a job"""
-        with open(self.base / '.lang', 'w') as fp:
-            fp.write(self.lang)
+        if self.lang:
+            with open(self.base / '.lang', 'w') as fp:
+                fp.write(self.lang)
         super().end()
         self._close()
 
@@ -1,14 +1,19 @@
+import collections
 import concurrent.futures
 import dataclasses
 import enum
 import functools
+import hashlib
+import itertools
 import json
 import logging
 import math
-import multiprocessing
+import os
 import pathlib
+import statistics
 import sys
 import subprocess
+import time
 
 import psutil
 
@@ -18,7 +23,7 @@ from .docs import DocumentProcessor, DocumentReaderFactory, DocReader, DocWriter
 from .error import ConfigError, PatapscoError
 from .helpers import ArtifactHelper
 from .index import IndexerFactory
-from .pipeline import BatchPipeline, StreamingPipeline
+from .pipeline import BatchPipeline, Checkpointer, ParallelPipeline, StreamingPipeline, _part_key
 from .rerank import RerankFactory
 from .results import JsonResultsWriter, JsonResultsReader, TrecResultsWriter
 from .retrieve import RetrieverFactory
@@ -26,8 +31,13 @@ from .schema import RunnerConfig, PipelineMode, Tasks
 from .score import Scorer
 from .topics import TopicProcessor, TopicReaderFactory, QueryProcessor, QueryReader, QueryWriter
 from .util import DataclassJSONEncoder, get_human_readable_size, ignore_exception, LangStandardizer, LoggingFilter,\
-    SlicedIterator, Timer
+    ShardIterator, ShardManifest, SlicedIterator, TaskMetrics, Timer
+from .util.cache import take_cache_report
 from .util.file import delete_dir, is_complete, is_dir_empty, path_append, touch_complete
+from .util.memory import MemoryMonitor
+from .util.pool import get_worker_pool, run_stoppable, shutdown_worker_pool, stop_job, take_startup_time, \
+    terminate_jobs
+from .util.profiler import get_profiler
 
 LOGGER = logging.getLogger(__name__)
 
@@ -36,6 +46,22 @@ LOGGER = logging.getLogger(__name__)
 class StageReport:
     count: int = 0
     timing: list = dataclasses.field(default_factory=list)
+    queues: list = dataclasses.field(default_factory=list)
+    workers: list = dataclasses.field(default_factory=list)
+    tasks: list = dataclasses.field(default_factory=list)
+    time: float = 0
+    batching: list = dataclasses.field(default_factory=list)
+    reduce: list = dataclasses.field(default_factory=list)
+    caches: list = dataclasses.field(default_factory=list)
+    throughput: dict = dataclasses.field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        # the input size comes from the iterator which is the first entry in the task metrics
+        size = self.tasks[0]['bytes'] if self.tasks else 0
+        self.throughput = {
+            'items_per_sec': self.count / self.time if self.time else 0,
+            'bytes_per_sec': size / self.time if self.time else 0,
+        }
 
     def __add__(self, other):
         if self.timing and not other.timing:
@@ -44,7 +70,94 @@ class StageReport:
             timing = other.timing
         else:
             timing = [(a[0], a[1] + b[1]) for a, b in zip(self.timing, other.timing)]
-        return StageReport(self.count + other.count, timing)
+        if self.queues and not other.queues:
+            queues = self.queues
+        elif not self.queues and other.queues:
+            queues = other.queues
+        else:
+            queues = [self._add_queues(a, b) for a, b in zip(self.queues, other.queues)]
+        if self.tasks and not other.tasks:
+            tasks = self.tasks
+        elif not self.tasks and other.tasks:
+            tasks = other.tasks
+        else:
+            tasks = [self._add_tasks(a, b) for a, b in zip(self.tasks, other.tasks)]
+        if self.batching and not other.batching:
+            batching = self.batching
+        elif not self.batching and other.batching:
+            batching = other.batching
+        else:
+            batching = [self._add_batching(a, b) for a, b in zip(self.batching, other.batching)]
+        if self.reduce and not other.reduce:
+            reduce = self.reduce
+        elif not self.reduce and other.reduce:
+            reduce = other.reduce
+        else:
+            reduce = [(a[0], a[1] + b[1]) for a, b in zip(self.reduce, other.reduce)]
+        return StageReport(self.count + other.count, timing, queues, self.workers + other.workers, tasks,
+                           self.time + other.time, batching, reduce, self._add_caches(self.caches, other.caches))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a stage report from its json"""
+        fields = [field.name for field in dataclasses.fields(cls) if field.init]
+        return cls(**{name: data[name] for name in fields if name in data})
+
+    @staticmethod
+    def _add_batching(a, b):
+        sizes = collections.Counter({int(size): count for size, count in a['sizes'].items()})
+        sizes.update({int(size): count for size, count in b['sizes'].items()})
+        batches = a['batches'] + b['batches']
+        items = a['items'] + b['items']
+        return {
+            'name': a['name'],
+            'batches': batches,
+            'items': items,
+            'chars': a['chars'] + b['chars'],
+            'min_items': min(sizes) if sizes else 0,
+            'max_items': max(sizes) if sizes else 0,
+            'mean_items': items / batches if batches else 0,
+            # each part adapts its own budget so this is the mean weighted by the number of batches
+            'budget': (a['budget'] * a['batches'] + b['budget'] * b['batches']) / batches if batches else a['budget'],
+            'sizes': {str(size): count for size, count in sorted(sizes.items())},
+        }
+
+    @staticmethod
+    def _add_caches(a, b):
+        caches = collections.OrderedDict((cache['name'], dict(cache)) for cache in a)
+        for cache in b:
+            if cache['name'] not in caches:
+                caches[cache['name']] = dict(cache)
+                continue
+            total = caches[cache['name']]
+            total['hits'] += cache['hits']
+            total['misses'] += cache['misses']
+            total['size'] = max(total['size'], cache['size'])
+        for cache in caches.values():
+            lookups = cache['hits'] + cache['misses']
+            cache['hit_rate'] = cache['hits'] / lookups if lookups else 0
+        return list(caches.values())
+
+    @staticmethod
+    def _add_tasks(a, b):
+        metrics = TaskMetrics.from_report(a)
+        metrics.merge(TaskMetrics.from_report(b))
+        return metrics.report
+
+    @staticmethod
+    def _add_queues(a, b):
+        gets = a['gets'] + b['gets']
+        # the mean is weighted by the number of gets so that folding many parts does not favor the last ones
+        total_depth = a['mean_depth'] * a['gets'] + b['mean_depth'] * b['gets']
+        return {
+            'name': a['name'],
+            'size': a['size'],
+            'max_depth': max(a['max_depth'], b['max_depth']),
+            'mean_depth': total_depth / gets if gets else 0,
+            'gets': gets,
+            'producer_wait': a['producer_wait'] + b['producer_wait'],
+            'consumer_wait': a['consumer_wait'] + b['consumer_wait'],
+        }
 
 
 @dataclasses.dataclass
@@ -63,6 +176,11 @@ class Report:
         else:
             return self.__add__(other)
 
+    @classmethod
+    def from_dict(cls, data):
+        """Create a report from its json"""
+        return cls(StageReport.from_dict(data['stage1']), StageReport.from_dict(data['stage2']))
+
 
 class Job:
     """A job is an executable component of a system run
@@ -84,19 +202,30 @@ class Job:
         self.run_path = conf.run.path
         self.stage1 = stage1
         self.stage2 = stage2
+        self.part = None  # part number of a parallel sub-job
+        self.monitor = None
 
     def run(self, sub_job=False):
         LOGGER.info("Starting run: %s", self.conf.run.name)
 
-        report = self._run()
+        memory_conf = self.conf.run.memory
+        self.monitor = MemoryMonitor(memory_conf.interval, memory_conf.budget, memory_conf.warning,
+                                     memory_conf.timeline)
+        for stage in (self.stage1, self.stage2):
+            if stage:
+                stage.monitor = self.monitor
+        with self.monitor:
+            report = self._run()
 
         if not sub_job:
             self.write_complete()
             self.write_config()
             self.write_report(report)
+            self.write_memory()
             self.write_scores()
         mem = psutil.Process().memory_info().rss
         LOGGER.info(f"Memory usage: {get_human_readable_size(mem)}")
+        LOGGER.info(f"Peak memory usage: {get_human_readable_size(self.monitor.peak)}")
         LOGGER.info("Run complete")
         return report
 
@@ -104,11 +233,30 @@ class Job:
         # Children of Job must implement this which is called by run()
         pass
 
+    def section(self, name):
+        """Get a context manager for a section of the run that profiles it if configured
+
+        This also labels the memory timeline with the name of the section.
+
+        Args:
+            name (str): Name of the section like stage1 or stage1_reduce.
+        """
+        if self.monitor:
+            self.monitor.set_stage(name)
+        if self.part is not None:
+            name = f"{name}.part_{self.part}"
+        return get_profiler(self.conf.run.profile, pathlib.Path(self.run_path) / 'profile' / name)
+
     def write_report(self, report):
         path = pathlib.Path(self.run_path) / 'timing.json'
         with open(path, 'w') as fp:
             json.dump(report, fp, indent=4, cls=DataclassJSONEncoder)
 
+    def write_memory(self):
+        path = pathlib.Path(self.run_path) / 'memory.json'
+        with open(path, 'w') as fp:
+            json.dump(self.monitor.report, fp, indent=4)
+
     def write_complete(self):
         # run is only complete if we have results
         results_path = pathlib.Path(self.run_path) / self.conf.run.results
@@ -140,47 +288,360 @@ class SerialJob(Job):
         if self.stage1:
             timer1 = Timer()
             LOGGER.info("Stage 1: Starting processing of documents")
-            with timer1:
+            with timer1, self.section('stage1'):
                 self.stage1.run()
-            report.stage1 = StageReport(self.stage1.count, self.stage1.report)
+            report.stage1 = StageReport(self.stage1.count, self.stage1.report, self.stage1.queue_report,
+                                        tasks=self.stage1.metrics_report, time=timer1.time,
+                                        batching=self.stage1.batch_report, caches=self._take_caches(self.stage1))
             LOGGER.info("Stage 1: Ingested %d documents", self.stage1.count)
             LOGGER.info("Stage 1 took %.1f secs", timer1.time)
 
         if self.stage2:
             timer2 = Timer()
             LOGGER.info("Stage 2: Starting processing of topics")
-            with timer2:
+            with timer2, self.section('stage2'):
                 self.stage2.run()
-            report.stage2 = StageReport(self.stage2.count, self.stage2.report)
+            report.stage2 = StageReport(self.stage2.count, self.stage2.report, self.stage2.queue_report,
+                                        tasks=self.stage2.metrics_report, time=timer2.time,
+                                        batching=self.stage2.batch_report, caches=self._take_caches(self.stage2))
             LOGGER.info("Stage 2: Processed %d topics", self.stage2.count)
             LOGGER.info("Stage 2 took %.1f secs", timer2.time)
 
         return report
 
+    @staticmethod
+    def _take_caches(pipeline):
+        """Get the cache stats of this process and of the worker processes of a parallel pipeline"""
+        caches = take_cache_report()
+        for worker_caches in pipeline.worker_caches:
+            caches = StageReport._add_caches(caches, worker_caches)
+        return caches
+
 
 @dataclasses.dataclass
 class MultiprocessingJobDef:
     """Describes a multiprocessing parallel sub-job"""
     id: int  # zero based id counter for sub-jobs
     conf: RunnerConfig
+    attempt: int = 0  # each attempt at a sub-job writes to its own directory
+    status_path: str = None  # file that the worker updates with the status of the attempt
+
+
+class MapScheduler:
+    """Runs the sub-jobs of a stage on the worker pool with retries and speculative duplicates
+
+    Each attempt at a sub-job writes to its own directory under attempts/
+    and records its state in status/<stage>/part_<id>.<attempt>.json.
+    The first attempt to finish is moved to part_<id> and the sub-job is recorded with its report
+    in status/<stage>/part_<id>.json so that a relaunched run does not run it again.
+    A failed sub-job is retried and a sub-job that runs much longer than the median gets a duplicate
+    once there is an idle worker.
+    An attempt that is no longer needed or that runs past the timeout is asked to stop between items
+    so that its worker can take the next job. The workers of attempts that do not stop are terminated.
+    """
+
+    POLL_INTERVAL = 1  # seconds between checks for slow sub-jobs
+    STOP_WAIT = 10  # seconds to wait for stopped attempts before terminating their workers
+
+    def __init__(self, run_path, stage, num_workers, parallel_conf, func, update_paths):
+        """
+        Args:
+            run_path (str or Path): Path of the run.
+            stage (str): stage1 or stage2.
+            num_workers (int): Number of worker processes.
+            parallel_conf (ParallelConfig): Config with the start method, retries, and speculation.
+            func (callable): Function that runs a MultiprocessingJobDef in a worker.
+            update_paths (callable): Function that puts the output paths of a config in a directory.
+        """
+        self.run_path = pathlib.Path(run_path)
+        self.stage = stage
+        self.status_dir = self.run_path / 'status' / stage
+        self.num_workers = num_workers
+        self.start_method = parallel_conf.start_method
+        self.retries = parallel_conf.retries
+        self.speculation = parallel_conf.speculation
+        self.timeout = parallel_conf.timeout
+        self.func = func
+        self.update_paths = update_paths
+        self.pool = None
+        self.futures = {}  # future -> (job, attempt)
+        self.timed_out = {}  # future -> (job, attempt) for attempts stopped after the timeout
+        self.attempts = collections.Counter()
+        self.failures = collections.Counter()
+        self.speculated = set()
+        self.finished = set()
+        self.durations = []
+        self.manifests = {}
+        self.report = Report()
+        self.workers = {}
+
+    def run(self, jobs):
+        """Run the jobs that are not complete from an earlier launch of the run
+
+        Returns:
+            Report
+        """
+        self.status_dir.mkdir(parents=True, exist_ok=True)
+        remaining = []
+        for job in jobs:
+            report = self._load_complete(job)
+            if report:
+                self.report += report
+                self.finished.add(job.id)
+            else:
+                remaining.append(job)
+        if len(remaining) < len(jobs):
+            LOGGER.info("Skipping %d %s jobs completed by an earlier launch of this run",
+                        len(jobs) - len(remaining), self.stage)
+        if not remaining:
+            return self.report
+
+        self.pool = get_worker_pool(self.num_workers, len(remaining), self.start_method)
+        try:
+            for job in remaining:
+                self._submit(job)
+            while len(self.finished) < len(jobs):
+                done, _ = concurrent.futures.wait(self.futures, timeout=self.POLL_INTERVAL,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    # a restart of the pool removes the other futures
+                    if future in self.futures:
+                        self._collect(future)
+                self._stop_timed_out()
+                self._speculate()
+        except Exception:
+            # the other jobs could be hung so this does not wait on them
+            self._terminate()
+            raise
+        self._stop_duplicates()
+        return self.report
+
+    def _submit(self, job):
+        attempt = self.attempts[job.id]
+        self.attempts[job.id] += 1
+        directory = self._get_attempt_dir(job.id, attempt)
+        if directory.exists():
+            delete_dir(directory)
+        conf = job.conf.copy(deep=True)
+        self.update_paths(conf, str(directory.relative_to(self.run_path)))
+        status_path = str(self._get_status_path(job.id, attempt))
+        future = self.pool.submit(run_stoppable, str(self._get_job_path(job.id, attempt)), self.func,
+                                  MultiprocessingJobDef(job.id, conf, attempt, status_path))
+        self.futures[future] = (job, attempt)
+
+    def _collect(self, future):
+        job, attempt = self.futures.pop(future)
+        if job.id in self.finished:
+            # a slower duplicate of a job that is already done
+            self._discard(job.id, attempt)
+            return
+        try:
+            pid, job_time, startup, report = future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            self._restart(job, e)
+        except Exception as e:
+            self._retry(job, attempt, e)
+        else:
+            self._complete(job, attempt, pid, job_time, startup, report)
+
+    def _complete(self, job, attempt, pid, job_time, startup, report):
+        self.finished.add(job.id)
+        part_dir = self.run_path / f"part_{job.id}"
+        if part_dir.exists():
+            delete_dir(part_dir)
+        attempt_dir = self._get_attempt_dir(job.id, attempt)
+        if attempt_dir.exists():
+            attempt_dir.rename(part_dir)
+        self.write_status(self._get_status_path(job.id), {
+            'state': 'complete',
+            'key': self._get_key(job),
+            'attempt': attempt,
+            'output': part_dir.exists(),
+            'report': json.loads(json.dumps(report, cls=DataclassJSONEncoder)),
+        })
+        self.report += report
+        self.durations.append(job_time)
+        worker = self.workers.setdefault(pid, {'pid': pid, 'jobs': 0, 'time': 0, 'startup': 0})
+        worker['jobs'] += 1
+        worker['time'] += job_time
+        worker['startup'] += startup
+
+    def _retry(self, job, attempt, error):
+        self.failures[job.id] += 1
+        self._discard(job.id, attempt)
+        if any(other.id == job.id for other, _ in self.futures.values()):
+            LOGGER.warning("Attempt %d of %s job %d failed from %s %s. Waiting on its duplicate.",
+                           attempt, self.stage, job.id, type(error).__name__, error)
+            return
+        if self.failures[job.id] > self.retries:
+            self.write_status(self._get_status_path(job.id), {'state': 'failed', 'error': str(error)})
+            raise PatapscoError(f"multiprocessing map failed from {type(error).__name__} {error}") from error
+        LOGGER.warning("Retrying %s job %d after it failed from %s %s",
+                       self.stage, job.id, type(error).__name__, error)
+        self._submit(job)
+
+    def _restart(self, job, error):
+        """A worker process died so all the running jobs are lost and the pool is replaced"""
+        jobs = {job.id: job}
+        jobs.update({other.id: other for other, _ in self.futures.values() if other.id not in self.finished})
+        self.futures.clear()
+        shutdown_worker_pool()
+        LOGGER.warning("A worker process died so restarting %d %s jobs", len(jobs), self.stage)
+        self.pool = get_worker_pool(self.num_workers, len(jobs), self.start_method)
+        for job in jobs.values():
+            self.failures[job.id] += 1
+            if self.failures[job.id] > self.retries:
+                raise PatapscoError(f"multiprocessing map failed from {type(error).__name__} {error}") from error
+            self._submit(job)
+
+    def _speculate(self):
+        """Start a duplicate of any job running much longer than the median when a worker is idle"""
+        if not self.speculation or not self.durations or len(self.futures) >= self.num_workers:
+            return
+        threshold = self.speculation * statistics.median(self.durations)
+        now = time.time()
+        for job, attempt in list(self.futures.values()):
+            if job.id in self.speculated or len(self.futures) >= self.num_workers:
+                continue
+            status = self.read_status(self._get_status_path(job.id, attempt))
+            if status and status['state'] == 'running' and now - status['start'] > threshold:
+                LOGGER.info("Starting a duplicate of %s job %d that has run for %.1f secs",
+                            self.stage, job.id, now - status['start'])
+                self.speculated.add(job.id)
+                self._submit(job)
+
+    def _stop_timed_out(self):
+        """Stop the attempts that have run longer than the timeout and count them as failed"""
+        if not self.timeout:
+            return
+        now = time.time()
+        for future, (job, attempt) in list(self.futures.items()):
+            status = self.read_status(self._get_status_path(job.id, attempt))
+            if status and status['state'] == 'running' and now - status['start'] > self.timeout:
+                del self.futures[future]
+                self.timed_out[future] = (job, attempt)
+                self._stop(future, job.id, attempt)
+                self._retry(job, attempt, TimeoutError(f"Attempt {attempt} ran longer than {self.timeout} secs"))
+
+    def _stop_duplicates(self):
+        """Stop the duplicates still running after their jobs finished
+
+        The attempts stop between items. If the duplicates or the attempts stopped after the timeout
+        are still running after STOP_WAIT, they are hung so their workers are terminated with the pool.
+        """
+        for future, (job, attempt) in self.futures.items():
+            self._stop(future, job.id, attempt)
+        self.timed_out.update(self.futures)
+        self.futures.clear()
+        if not self.timed_out:
+            return
+        _, not_done = concurrent.futures.wait(self.timed_out, timeout=self.STOP_WAIT)
+        if not_done:
+            LOGGER.warning("Terminating the workers of %d %s attempts that did not stop", len(not_done), self.stage)
+            self._terminate()
+        self.timed_out.clear()
+
+    def _stop(self, future, job_id, attempt):
+        """Stop an attempt whether it is running or waiting for a worker and discard its output when it is done"""
+        if not future.cancel():
+            stop_job(str(self._get_job_path(job_id, attempt)))
+        future.add_done_callback(lambda _: self._discard(job_id, attempt))
+
+    def _terminate(self):
+        """Stop the worker pool without waiting on the jobs that are running"""
+        terminate_jobs([(future, self._get_job_path(job.id, attempt))
+                        for future, (job, attempt) in itertools.chain(self.futures.items(), self.timed_out.items())])
+        self.pool = None
+        self.futures.clear()
+        self.timed_out.clear()
+
+    def _discard(self, job_id, attempt):
+        directory = self._get_attempt_dir(job_id, attempt)
+        if directory.exists():
+            delete_dir(directory)
+
+    def _load_complete(self, job):
+        """Get the report of a job that completed in an earlier launch of the run or None"""
+        status = self.read_status(self._get_status_path(job.id))
+        if not status or status['state'] != 'complete' or status['key'] != self._get_key(job):
+            return None
+        if status['output'] and not (self.run_path / f"part_{job.id}").exists():
+            return None
+        return Report.from_dict(status['report'])
+
+    def _get_key(self, job):
+        """Identifies the input and config of a job so that a changed job is not skipped on relaunch"""
+        # the number of jobs and memory budget do not change the output of a job
+        exclude = {'run': {'memory': ..., 'stage1': {'num_jobs'}, 'stage2': {'num_jobs'}}}
+        key = job.conf.json(exclude=exclude)
+        stage_conf = job.conf.run.stage1 if job.conf.run.stage1 else job.conf.run.stage2
+        if stage_conf.manifest:
+            if stage_conf.manifest not in self.manifests:
+                self.manifests[stage_conf.manifest] = ShardManifest.load(stage_conf.manifest)
+            key += json.dumps(self.manifests[stage_conf.manifest][stage_conf.shard], cls=DataclassJSONEncoder)
+        return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+    def _get_attempt_dir(self, job_id, attempt):
+        return self.run_path / 'attempts' / f"{self.stage}.part_{job_id}.{attempt}"
+
+    def _get_job_path(self, job_id, attempt):
+        # holds the process id of the worker while the attempt runs
+        return self.status_dir / f"part_{job_id}.{attempt}.pid"
+
+    def _get_status_path(self, job_id, attempt=None):
+        name = f"part_{job_id}.json" if attempt is None else f"part_{job_id}.{attempt}.json"
+        return self.status_dir / name
+
+    @staticmethod
+    def write_status(path, status):
+        # write and rename so that the status is never read partially written
+        path = pathlib.Path(path)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump(status, fp)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_status(path):
+        try:
+            with open(path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
 
 
 class MultiprocessingJob(Job):
     """Multiprocessing parallel job.
 
     This uses concurrent.futures to implement map/reduce over the input iterators.
+    If a shard size is configured for stage 1, the input is split into many small shards
+    that a pool of num_jobs workers pull from so that no single worker is left with a slow region of the input.
+    The workers are started once from a preloaded forkserver and are reused for stage 2
+    (and for later runs in this process if the parallel config is persistent).
     """
     def __init__(self, conf, record_conf, stage1, stage2, debug):
         super().__init__(conf, record_conf, stage1, stage2)
-        multiprocessing.set_start_method('spawn')  # so JVM doesn't get copied to child processes
         self.debug = debug
+        self.workers = []
+        self.map_time = 0
         self.stage1_jobs = self.stage2_jobs = None
         if stage1:
-            self.stage1_jobs = self._get_stage1_jobs(conf.run.stage1.num_jobs)
+            if conf.run.stage1.shard_size:
+                self.stage1_jobs = self._get_stage1_sharded_jobs(conf.run.stage1.shard_size)
+            else:
+                self.stage1_jobs = self._get_stage1_jobs(conf.run.stage1.num_jobs)
         if stage2:
             self.stage2_jobs = self._get_stage2_jobs(conf.run.stage2.num_jobs)
 
     def _run(self):
+        # the same pool of workers runs both stages
+        try:
+            return self._run_stages()
+        finally:
+            if not self.conf.run.parallel.persistent:
+                shutdown_worker_pool()
+
+    def _run_stages(self):
         report1 = Report()
         report2 = Report()
         if self.stage1_jobs:
@@ -188,8 +649,12 @@ class MultiprocessingJob(Job):
             timer1 = Timer()
             with timer1:
                 self.stage1.begin()
-                report1 = self.map(self.stage1_jobs, self.debug)
-                self.stage1.reduce()
+                self.monitor.set_stage('stage1')
+                report1 = self.map(self.stage1_jobs, self.conf.run.stage1.num_jobs, self.debug)
+                workers, map_time = self.workers, self.map_time
+                reduce_times = self._reduce_stage1()
+                report1.stage1 = dataclasses.replace(report1.stage1, workers=workers, time=map_time,
+                                                     reduce=reduce_times)
                 self.stage1.end()
                 self._del_reduce_directories()
             LOGGER.info("Stage 1: Ingested %d documents", report1.stage1.count)
@@ -200,8 +665,13 @@ class MultiprocessingJob(Job):
             timer2 = Timer()
             with timer2:
                 self.stage2.begin()
-                report2 = self.map(self.stage2_jobs, self.debug)
-                self.stage2.reduce()
+                self.monitor.set_stage('stage2')
+                report2 = self.map(self.stage2_jobs, self.conf.run.stage2.num_jobs, self.debug)
+                workers, map_time = self.workers, self.map_time
+                with self.section('stage2_reduce'):
+                    self.stage2.reduce()
+                report2.stage2 = dataclasses.replace(report2.stage2, workers=workers, time=map_time,
+                                                     reduce=self.stage2.reduce_report)
                 self.stage2.end()
                 self._del_reduce_directories()
             LOGGER.info("Stage 2: Processed %d queries", report2.stage2.count)
@@ -209,55 +679,201 @@ class MultiprocessingJob(Job):
 
         return report1 + report2
 
-    def map(self, jobs, debug):
+    def map(self, jobs, num_workers, debug):
         """
+        The jobs are submitted to a pool of workers that take the next job when they finish one.
+        The pool is kept for the next stage so the workers only start once.
+        Failed jobs are retried, slow jobs are duplicated, and jobs completed by an earlier launch are skipped.
+        The per-worker utilisation and startup time are stored in self.workers and the wall time in self.map_time.
+
         Args:
             jobs (list of MultiprocessingJobDef): Job definitions to be mapped over.
+            num_workers (int): Number of worker processes.
             debug (bool): Whether to run in debug mode.
         Returns:
             Report
         """
         func = functools.partial(self._fork, debug=debug)
-        with concurrent.futures.ProcessPoolExecutor(max_workers=len(jobs)) as executor:
-            # we loop in a try/except to catch errors from the jobs running in separate processes
-            try:
-                return sum(executor.map(func, jobs))
-            except Exception as e:
-                raise PatapscoError(f"multiprocessing map failed from {type(e).__name__} {e}") from e
+        num_workers = min(num_workers, len(jobs))
+        if self.conf.run.memory.budget:
+            # the workers run at the same time so each gets a share of the budget
+            for job in jobs:
+                job.conf.run.memory.budget = self.conf.run.memory.budget // num_workers
+        if jobs[0].conf.run.stage1:
+            scheduler = MapScheduler(self.run_path, 'stage1', num_workers, self.conf.run.parallel, func,
+                                     self._update_stage1_output_paths)
+        else:
+            scheduler = MapScheduler(self.run_path, 'stage2', num_workers, self.conf.run.parallel, func,
+                                     self._update_stage2_output_paths)
+        timer = Timer()
+        with timer:
+            report = scheduler.run(jobs)
+        workers = scheduler.workers
+        for worker in workers.values():
+            worker['utilization'] = worker['time'] / timer.time if timer.time else 0
+            LOGGER.debug("Worker %d ran %d jobs with %.1f%% utilization after starting in %.1f secs",
+                         worker['pid'], worker['jobs'], 100 * worker['utilization'], worker['startup'])
+        self.workers = list(workers.values())
+        self.map_time = timer.time
+        return report
 
     @staticmethod
     def _fork(job, debug):
-        # only log parallel jobs to their unique log file
+        """Run a sub-job in a worker process
+
+        Returns:
+            tuple of process id, time in secs, worker startup time in secs, and Report
+        """
+        stage = 'stage1' if job.conf.run.stage1 else 'stage2'
+        name = f"{job.id}.{job.attempt}" if job.attempt else f"{job.id}"
+        logger, file = MultiprocessingJob._add_log_file(job.conf.run.path, f"{stage}.{name}", debug)
+
+        # worker processes are reused across jobs so the log handler is removed when done
+        status = {'state': 'running', 'pid': os.getpid(), 'start': time.time()}
+        if job.status_path:
+            MapScheduler.write_status(job.status_path, status)
+        timer = Timer()
+        try:
+            with timer:
+                sub_job = JobBuilder(job.conf, JobType.NORMAL).build(debug)
+                sub_job.part = job.id
+                report = sub_job.run(sub_job=True)
+            status['state'] = 'complete'
+        except Exception as e:
+            status['state'] = 'failed'
+            status['error'] = f"{type(e).__name__} {e}"
+            raise
+        finally:
+            status['end'] = time.time()
+            if job.status_path:
+                MapScheduler.write_status(job.status_path, status)
+            logger.removeHandler(file)
+            file.close()
+        return os.getpid(), timer.time, take_startup_time(), report
+
+    @staticmethod
+    def _reduce_fork(group, conf, level, debug):
+        """Reduce a group of parts into an intermediate part in a worker process
+
+        Returns:
+            Report
+        """
+        logger, file = MultiprocessingJob._add_log_file(conf.run.path, f"stage1.reduce_{level}.{group}", debug)
+        try:
+            job = JobBuilder(conf, JobType.REDUCE, stage=1, level=level, group=group).build(debug)
+            return job.run()
+        finally:
+            logger.removeHandler(file)
+            file.close()
+
+    @staticmethod
+    def _add_log_file(run_path, name, debug):
+        """Log a job in a worker process to its own file
+
+        Returns:
+            tuple of the logger and the file handler to remove when the job is done
+        """
         log_level = logging.DEBUG if debug else logging.INFO
         logger = logging.getLogger('patapsco')
         logger.setLevel(log_level)
-        log_dir = pathlib.Path(job.conf.run.path) / 'logs'
+        log_dir = pathlib.Path(run_path) / 'logs'
         log_dir.mkdir(exist_ok=True)
-        stage = 'stage1' if job.conf.run.stage1 else 'stage2'
-        log_file = path_append(log_dir, f"patapsco.{stage}.{job.id}.log")
-        file = logging.FileHandler(log_file)
+        file = logging.FileHandler(path_append(log_dir, f"patapsco.{name}.log"))
         file.setLevel(logger.level)
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         file.setFormatter(formatter)
         file.addFilter(LoggingFilter())
         logger.addHandler(file)
+        return logger, file
+
+    def _reduce_stage1(self):
+        """Reduce the parts of stage 1 through the levels of a tree reduce and then into the output of the run
 
-        job = JobBuilder(job.conf, JobType.NORMAL).build(debug)
-        return job.run(sub_job=True)
+        The groups of a level are reduced in parallel by the workers.
+
+        Returns:
+            list of reduce times
+        """
+        base_dir = pathlib.Path(self.run_path)
+        # intermediate parts from an earlier launch of the run may be incomplete
+        [delete_dir(path) for path in base_dir.glob('reduce_*')]
+        times = []
+        fan_in = self.conf.run.parallel.fan_in
+        status_dir = base_dir / 'status' / 'stage1_reduce'
+        status_dir.mkdir(parents=True, exist_ok=True)
+        for level, num_groups in enumerate(get_reduce_levels(len(get_reduce_parts(base_dir, 1)), fan_in), 1):
+            LOGGER.info("Stage 1: Reducing level %d with %d groups of %d parts", level, num_groups, fan_in)
+            func = functools.partial(self._reduce_fork, conf=self.conf, level=level, debug=self.debug)
+            num_workers = min(self.conf.run.stage1.num_jobs, num_groups)
+            timer = Timer()
+            with timer:
+                pool = get_worker_pool(num_workers, num_groups, self.conf.run.parallel.start_method)
+                # the pid files are used to kill the running reducers if another group fails
+                paths = [str(status_dir / f"reduce_{level}.{group}.pid") for group in range(num_groups)]
+                futures = [pool.submit(run_stoppable, path, func, group) for group, path in enumerate(paths)]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                except Exception as e:
+                    # the other reducers could be hung so this does not wait on them
+                    terminate_jobs(list(zip(futures, paths)))
+                    raise PatapscoError(f"multiprocessing reduce failed from {type(e).__name__} {e}") from e
+            times.append((f"level_{level}", timer.time))
+        with self.section('stage1_reduce'):
+            self.stage1.reduce(get_reduce_parts(base_dir))
+        return times + self.stage1.reduce_report
 
     def _get_stage1_jobs(self, num_processes):
+        manifest = ShardManifest.from_iterator(self.stage1.iterator, num_shards=num_processes)
+        if manifest:
+            return self._create_stage1_manifest_jobs(manifest)
         num_items = len(self.stage1.iterator)
         job_size = int(math.ceil(num_items / num_processes))
         indices = [(i, i + job_size) for i in range(0, num_items, job_size)]
+        return self._create_stage1_jobs(indices)
+
+    def _get_stage1_sharded_jobs(self, shard_size):
+        manifest = ShardManifest.from_iterator(self.stage1.iterator, shard_size=shard_size)
+        if manifest:
+            LOGGER.info("Stage 1 has %d shards of about %s", len(manifest), get_human_readable_size(shard_size))
+            return self._create_stage1_manifest_jobs(manifest)
+        # a pass over the input to measure the documents so that each shard has about the same amount of text
+        indices = []
+        start = count = size = 0
+        for doc in self.stage1.iterator:
+            size += len(doc.text.encode('utf8'))
+            count += 1
+            if size >= shard_size:
+                indices.append((start, count))
+                start = count
+                size = 0
+        if count > start:
+            indices.append((start, count))
+        LOGGER.info("Stage 1 has %d shards of about %s of text", len(indices), get_human_readable_size(shard_size))
+        return self._create_stage1_jobs(indices)
+
+    def _create_stage1_jobs(self, indices):
+        # the output paths are set for each attempt at a job when it is submitted
         stage1_jobs = []
         for part, (start, stop) in enumerate(indices):
-            sub_directory = f"part_{part}"
             conf = self.conf.copy(deep=True)
             conf.run.stage1.start = start
             conf.run.stage1.stop = stop
             conf.run.parallel = None
             conf.run.stage2 = False
-            self._update_stage1_output_paths(conf, sub_directory)
+            stage1_jobs.append(MultiprocessingJobDef(part, conf))
+        return stage1_jobs
+
+    def _create_stage1_manifest_jobs(self, manifest):
+        path = pathlib.Path(self.run_path) / 'stage1_manifest.json'
+        manifest.save(path)
+        stage1_jobs = []
+        for part in range(len(manifest)):
+            conf = self.conf.copy(deep=True)
+            conf.run.stage1.manifest = str(path.absolute())
+            conf.run.stage1.shard = part
+            conf.run.parallel = None
+            conf.run.stage2 = False
             stage1_jobs.append(MultiprocessingJobDef(part, conf))
         return stage1_jobs
 
@@ -267,13 +883,11 @@ class MultiprocessingJob(Job):
         indices = [(i, i + job_size) for i in range(0, num_items, job_size)]
         stage2_jobs = []
         for part, (start, stop) in enumerate(indices):
-            sub_directory = f"part_{part}"
             conf = self.conf.copy(deep=True)
             conf.run.stage2.start = start
             conf.run.stage2.stop = stop
             conf.run.parallel = None
             conf.run.stage1 = False
-            self._update_stage2_output_paths(conf, sub_directory)
             stage2_jobs.append(MultiprocessingJobDef(part, conf))
         return stage2_jobs
 
@@ -286,6 +900,9 @@ class MultiprocessingJob(Job):
         with ignore_exception(AttributeError):
             if conf.documents.output:
                 conf.documents.output = path_append(part, conf.documents.output)
+        with ignore_exception(AttributeError):
+            normalize = conf.documents.process.normalize
+            normalize.report_output = path_append(part, normalize.report_output)
         with ignore_exception(AttributeError):
             if conf.index.output:
                 conf.index.output = path_append(part, conf.index.output)
@@ -310,6 +927,11 @@ class MultiprocessingJob(Job):
     def _del_reduce_directories(self):
         base_dir = pathlib.Path(self.run_path)
         [delete_dir(item) for item in base_dir.glob('part*')]
+        [delete_dir(item) for item in base_dir.glob('reduce_*')]
+        # the status of the jobs is only needed until their parts are reduced
+        for path in (base_dir / 'status', base_dir / 'attempts'):
+            if path.exists():
+                delete_dir(path)
 
 
 class ClusterJob(Job):
@@ -329,6 +951,7 @@ class ClusterJob(Job):
         self.stage1_map_path = self.base_dir / 'stage1_map.sh'
         self.stage2_map_path = self.base_dir / 'stage2_map.sh'
         self.stage1_reduce_path = self.base_dir / 'stage1_reduce.sh'
+        self.stage1_level_paths = []  # scripts for the levels of a tree reduce of stage 1
         self.stage2_reduce_path = self.base_dir / 'stage2_reduce.sh'
         self.config_path = self.base_dir / 'config.yml'
         self.log_path = self.base_dir / 'patapsco.log'
@@ -343,6 +966,9 @@ class ClusterJob(Job):
         if self.stage1:
             job_id = self._launch_job(self.stage1_map_path)
             LOGGER.info(f"Job {job_id} submitted - stage 1 mapper")
+            for level, path in enumerate(self.stage1_level_paths, 1):
+                job_id = self._launch_job(path, job_id)
+                LOGGER.info(f"Job {job_id} submitted - stage 1 reducer level {level}")
             job_id = self._launch_job(self.stage1_reduce_path, job_id)
             LOGGER.info(f"Job {job_id} submitted - stage 1 reducer")
         if self.stage2:
@@ -410,14 +1036,25 @@ class ClusterJob(Job):
         code = self.cluster_config.code if self.cluster_config.code else ''
         if self.stage1:
             num_jobs = self.conf.run.stage1.num_jobs
+            shard_size = self.conf.run.stage1.shard_size
+            manifest = ShardManifest.from_iterator(self.stage1.iterator, num_shards=None if shard_size else num_jobs,
+                                                   shard_size=shard_size)
+            if manifest:
+                # the map jobs seek directly to their shard
+                num_jobs = len(manifest)
+                manifest_path = self.base_dir / 'stage1_manifest.json'
+                manifest.save(manifest_path)
+                split = f"--manifest {manifest_path}"
+            else:
+                split = f"--increment {self._get_stage1_increment(num_jobs)}"
             LOGGER.debug(f"Stage 1 is using {num_jobs} jobs")
-            increment = self._get_stage1_increment(num_jobs)
+            self.stage1_num_jobs = num_jobs
             content = template.format(
                 base=str(self.base_dir),
                 code=code,
                 config=str(self.config_path),
                 debug=debug,
-                increment=increment,
+                split=split,
                 num_jobs=num_jobs,
                 resources=self._prepare_resources(),
                 stage=1
@@ -433,7 +1070,7 @@ class ClusterJob(Job):
                 code=code,
                 config=str(self.config_path),
                 debug=debug,
-                increment=increment,
+                split=f"--increment {increment}",
                 num_jobs=num_jobs,
                 resources=self._prepare_resources(),
                 stage=2
@@ -458,6 +1095,25 @@ class ClusterJob(Job):
             )
             self.stage1_reduce_path.write_text(content)
             self.stage1_reduce_path.chmod(0o755)
+            # with many parts, array jobs merge groups of parts before the final reduce
+            level_template_path = pathlib.Path(__file__).parent / 'resources' / self.scheduler / 'reduce_level.sh'
+            level_template = level_template_path.read_text()
+            levels = get_reduce_levels(self.stage1_num_jobs, self.cluster_config.fan_in)
+            for level, num_groups in enumerate(levels, 1):
+                content = level_template.format(
+                    base=str(self.base_dir),
+                    code=code,
+                    config=str(self.config_path),
+                    debug=debug,
+                    level=level,
+                    num_jobs=num_groups,
+                    resources=self._prepare_resources(),
+                    stage=1
+                )
+                path = self.base_dir / f"stage1_reduce_{level}.sh"
+                path.write_text(content)
+                path.chmod(0o755)
+                self.stage1_level_paths.append(path)
         if self.stage2:
             content = template.format(
                 base=str(self.base_dir),
@@ -481,6 +1137,44 @@ class ClusterJob(Job):
         return int(math.ceil(num_items / num_jobs))
 
 
+def get_reduce_levels(num_parts, fan_in):
+    """Get the number of groups at each intermediate level of a tree reduce
+
+    Each group merges up to fan_in parts of the level below into one part
+    so that a reducer only has fan_in parts open at once.
+    The final reduce merges the parts of the last level (or the map parts if there are no levels).
+
+    Args:
+        num_parts (int): Number of parts from the map jobs.
+        fan_in (int): Maximum number of parts merged by a reducer or None for no intermediate levels.
+
+    Returns:
+        list of the number of groups for levels 1 to n
+    """
+    levels = []
+    if not fan_in:
+        return levels
+    while num_parts > fan_in:
+        num_parts = int(math.ceil(num_parts / fan_in))
+        levels.append(num_parts)
+    return levels
+
+
+def get_reduce_parts(run_path, level=None):
+    """Get the part directories that are merged by a level of a tree reduce
+
+    Level 1 merges the part directories of the map jobs and level n merges the output of level n - 1
+    in reduce_<n-1>/part_*. Without a level, this gets the parts for the final reduce
+    which are the output of the last level that was run.
+    """
+    run_path = pathlib.Path(run_path)
+    if level is None:
+        levels = [path.name.split('_')[-1] for path in run_path.glob('reduce_*')]
+        level = max([int(level) for level in levels if level.isdigit()], default=0) + 1
+    base = run_path if level == 1 else run_path / f"reduce_{level - 1}"
+    return sorted(base.glob('part*'), key=_part_key)
+
+
 class ReduceJob(Job):
     """Reduce job run on cluster"""
 
@@ -491,15 +1185,19 @@ class ReduceJob(Job):
         self.job_dir = (pathlib.Path(self.run_path) / self.scheduler).absolute()
 
     def _run(self):
+        report = Report()
         if self.stage1:
             LOGGER.info("Stage 1: Running reduce")
             timer1 = Timer()
             with timer1:
                 self.stage1.begin()
-                self.stage1.reduce()
+                with self.section('stage1_reduce'):
+                    # the parts from the last level of the tree reduce if there was one
+                    self.stage1.reduce(get_reduce_parts(self.run_path))
                 self.stage1.end()
                 self._del_reduce_directories()
             LOGGER.info("Stage 1 reduce took %.1f secs", timer1.time)
+            report.stage1 = StageReport(reduce=self.stage1.reduce_report)
             self._collect_warnings()
             self._collect_memory_and_time()
 
@@ -508,18 +1206,39 @@ class ReduceJob(Job):
             timer2 = Timer()
             with timer2:
                 self.stage2.begin()
-                self.stage2.reduce()
+                with self.section('stage2_reduce'):
+                    self.stage2.reduce()
                 self.stage2.end()
                 self._del_reduce_directories()
             LOGGER.info("Stage 2 reduce took %.1f secs", timer2.time)
+            report.stage2 = StageReport(reduce=self.stage2.reduce_report)
             self._collect_warnings()
             self._collect_memory_and_time()
 
-        return Report()
+        return report
+
+    def write_report(self, report):
+        # the reduce jobs for the stages run separately so the timing of the other stage is kept
+        path = pathlib.Path(self.run_path) / 'timing.json'
+        if not path.exists():
+            super().write_report(report)
+            return
+        with open(path) as fp:
+            timing = json.load(fp)
+        for stage in ('stage1', 'stage2'):
+            if getattr(self, stage):
+                timing[stage] = getattr(report, stage)
+        with open(path, 'w') as fp:
+            json.dump(timing, fp, indent=4, cls=DataclassJSONEncoder)
 
     def _del_reduce_directories(self):
         base_dir = pathlib.Path(self.run_path)
         [delete_dir(item) for item in base_dir.glob('part*')]
+        [delete_dir(item) for item in base_dir.glob('reduce_*')]
+        # the status of the jobs is only needed until their parts are reduced
+        for path in (base_dir / 'status', base_dir / 'attempts'):
+            if path.exists():
+                delete_dir(path)
 
     def _collect_warnings(self):
         # only create the file if there are warnings or errors
@@ -541,6 +1260,46 @@ class ReduceJob(Job):
             pass
 
 
+class ReduceGroupJob(Job):
+    """Reduces a group of parts into an intermediate part of a tree reduce of stage 1
+
+    This runs for each group of a level in the mp workers or as a cluster array job.
+    The output is written to reduce_<level>/part_<group> with the same layout as the map parts.
+    """
+
+    def __init__(self, conf, record_conf, stage1, level, group):
+        super().__init__(conf, record_conf, stage1, None)
+        self.level = level
+        self.group = group
+        self.part = group
+        self.fan_in = conf.run.parallel.fan_in
+
+    def run(self, sub_job=True):
+        # an intermediate part does not get the report, config, and scores of a run
+        return super().run(sub_job=True)
+
+    def _run(self):
+        parts = get_reduce_parts(self.run_path, self.level)
+        parts = parts[self.group * self.fan_in:(self.group + 1) * self.fan_in]
+        if not parts:
+            LOGGER.info("Stage 1: No parts to reduce for group %d of level %d", self.group, self.level)
+            return Report()
+        LOGGER.info("Stage 1: Reducing %d parts for group %d of level %d", len(parts), self.group, self.level)
+        timer = Timer()
+        with timer:
+            self.stage1.begin()
+            with self.section(f"stage1_reduce_{self.level}"):
+                self.stage1.reduce(parts, get_reduce_directory(self.level, self.group))
+            self.stage1.end()
+        LOGGER.info("Stage 1 reduce of group %d took %.1f secs", self.group, timer.time)
+        return Report(StageReport(reduce=self.stage1.reduce_report, time=timer.time))
+
+
+def get_reduce_directory(level, group):
+    """Directory relative to the run path of the output of a group of a tree reduce"""
+    return f"reduce_{level}/part_{group}"
+
+
 class JobType(enum.Enum):
     """Patapsco supports map reduce for parallel cluster jobs or normal local runs"""
     NORMAL = enum.auto()
@@ -570,25 +1329,31 @@ class JobBuilder:
         self.doc_lang = None
         self.query_lang = None
         self.job_type = job_type
+        self.checkpoint = None  # checkpoint for the stage being built
         if job_type == JobType.MAP:
             self._update_config_for_grid_jobs()
+        elif job_type == JobType.REDUCE and kwargs.get('level'):
+            self._update_config_for_reduce_group()
+
+    def _update_config_for_reduce_group(self):
+        """Update config so that stage 1 writes to an intermediate part of a tree reduce"""
+        self.conf.run.stage2 = False
+        self.conf.run.stage1.checkpoint_interval = None
+        directory = get_reduce_directory(self.parallel_args['level'], self.parallel_args['group'])
+        MultiprocessingJob._update_stage1_output_paths(self.conf, directory)
 
     def _update_config_for_grid_jobs(self):
         """Update config based on parallel args"""
         if self.parallel_args['stage'] == 1:
             self.conf.run.stage2 = False
-            self.conf.run.stage1.start = self.parallel_args['increment'] * self.parallel_args['job']
-            self.conf.run.stage1.stop = self.parallel_args['increment'] * (self.parallel_args['job'] + 1)
+            if self.parallel_args.get('manifest'):
+                self.conf.run.stage1.manifest = self.parallel_args['manifest']
+                self.conf.run.stage1.shard = self.parallel_args['job']
+            else:
+                self.conf.run.stage1.start = self.parallel_args['increment'] * self.parallel_args['job']
+                self.conf.run.stage1.stop = self.parallel_args['increment'] * (self.parallel_args['job'] + 1)
             part = f"part_{self.parallel_args['job']}"
-            with ignore_exception(AttributeError):
-                if self.conf.database.output:
-                    self.conf.database.output = path_append(part, self.conf.database.output)
-            with ignore_exception(AttributeError):
-                if self.conf.documents.output:
-                    self.conf.documents.output = path_append(part, self.conf.documents.output)
-            with ignore_exception(AttributeError):
-                if self.conf.index.output:
-                    self.conf.index.output = path_append(part, self.conf.index.output)
+            MultiprocessingJob._update_stage1_output_paths(self.conf, part)
         else:
             self.conf.run.stage1 = False
             self.conf.run.stage2.start = self.parallel_args['increment'] * self.parallel_args['job']
@@ -624,10 +1389,18 @@ class JobBuilder:
 
         if self.conf.run.parallel:
             LOGGER.info(f'Parallel job selected of type {self.conf.run.parallel.name}.')
+            if self.conf.run.parallel.start_method not in ('forkserver', 'spawn'):
+                raise ConfigError(f"Unknown start method: {self.conf.run.parallel.start_method}")
+            if self.conf.run.parallel.fan_in is not None and self.conf.run.parallel.fan_in < 2:
+                raise ConfigError("The fan in of the reduce must be at least 2")
+
+        if self.conf.run.profile and self.conf.run.profile not in ('sampling', 'cprofile'):
+            raise ConfigError(f"Unknown profiler: {self.conf.run.profile}")
 
         if self.conf.run.stage1:
             stage1_plan = self._create_stage1_plan()
             if stage1_plan:
+                self.checkpoint = self._get_checkpoint(self.conf.run.stage1, 'stage1', stage1_plan)
                 stage1_iter = self._get_stage1_iterator(stage1_plan)
                 stage1_tasks = self._get_stage1_tasks(stage1_plan)
                 stage1 = self._build_stage1_pipeline(stage1_iter, stage1_tasks)
@@ -635,6 +1408,7 @@ class JobBuilder:
         if self.conf.run.stage2:
             stage2_plan = self._create_stage2_plan()
             if stage2_plan:
+                self.checkpoint = self._get_checkpoint(self.conf.run.stage2, 'stage2', stage2_plan)
                 stage2_iter = self._get_stage2_iterator(stage2_plan)
                 stage2_tasks = self._get_stage2_tasks(stage2_plan)
                 stage2 = self._build_stage2_pipeline(stage2_iter, stage2_tasks)
@@ -649,9 +1423,14 @@ class JobBuilder:
 
         if self.job_type == JobType.MAP:
             # Map jobs are always plain serial jobs
-            return SerialJob(self.conf, self.record_conf, stage1, stage2)
+            job = SerialJob(self.conf, self.record_conf, stage1, stage2)
+            job.part = self.parallel_args['job']
+            return job
         elif self.job_type == JobType.REDUCE:
             # Reduce jobs have their own type
+            if self.parallel_args.get('level'):
+                return ReduceGroupJob(self.conf, self.record_conf, stage1, self.parallel_args['level'],
+                                      self.parallel_args['group'])
             if self.parallel_args['stage'] == 1:
                 return ReduceJob(self.conf, self.record_conf, stage1, None, debug)
             else:
@@ -686,14 +1465,19 @@ class JobBuilder:
 
     def _get_stage1_iterator(self, plan):
         # Get the iterator for pipeline based on plan and configuration
+        stage_conf = self.conf.run.stage1
+        # a parallel sub-job with a manifest seeks to its shard of the input
+        segments = ShardManifest.load(stage_conf.manifest)[stage_conf.shard] if stage_conf.manifest else None
         if Tasks.DOCUMENTS in plan:
-            iterator = DocumentReaderFactory.create(self.conf.documents.input)
+            iterator = DocumentReaderFactory.create(self.conf.documents.input, segments=segments)
         else:
             # documents already processed so locate them to create the iterator and update config
-            iterator = self._setup_input(DocReader, 'index.input.documents.path',
+            reader = (lambda path: ShardIterator(segments, DocReader)) if segments else DocReader
+            iterator = self._setup_input(reader, 'index.input.documents.path',
                                          'documents.output', 'index not configured with documents')
-        stage_conf = self.conf.run.stage1
-        return SlicedIterator(iterator, stage_conf.start, stage_conf.stop)
+        if segments:
+            return iterator
+        return SlicedIterator(iterator, self._get_start(stage_conf), stage_conf.stop)
 
     def _get_stage1_tasks(self, plan):
         # Stage 1 is generally: read docs, process them, build index.
@@ -738,10 +1522,20 @@ class JobBuilder:
         elif stage_conf.mode == PipelineMode.BATCH:
             batch_size_char = str(stage_conf.batch_size) if stage_conf.batch_size else '∞'
             LOGGER.info("Stage 1 is a batch pipeline selected with batch size of %s.", batch_size_char)
-            pipeline_class = functools.partial(BatchPipeline, n=stage_conf.batch_size)
+            pipeline_class = functools.partial(BatchPipeline, n=stage_conf.batch_size,
+                                               batch_bytes=stage_conf.batch_bytes, batch_chars=stage_conf.batch_chars,
+                                               sort_window=stage_conf.sort_window,
+                                               target_latency=stage_conf.target_latency)
+        elif stage_conf.mode == PipelineMode.PARALLEL:
+            num_workers = stage_conf.num_workers if stage_conf.num_workers else os.cpu_count()
+            LOGGER.info("Stage 1 is a parallel pipeline with %d workers.", num_workers)
+            pipeline_class = functools.partial(ParallelPipeline, num_workers=num_workers,
+                                               chunk_size=stage_conf.batch_size)
         else:
             raise ConfigError(f"Unrecognized pipeline mode: {stage_conf.mode}")
-        pipeline = pipeline_class(iterator, tasks, progress_interval=stage_conf.progress_interval)
+        pipeline = pipeline_class(iterator, tasks, progress_interval=stage_conf.progress_interval,
+                                  prefetch=stage_conf.prefetch, write_queue=stage_conf.write_queue,
+                                  checkpoint=self.checkpoint, slow_threshold=stage_conf.slow_threshold)
         LOGGER.info("Stage 1 pipeline: %s", pipeline)
         return pipeline
 
@@ -794,7 +1588,7 @@ class JobBuilder:
             iterator = self._setup_input(JsonResultsReader, 'rerank.input.results.path', 'retrieve.output',
                                          'rerank not configured with retrieve results')
         stage_conf = self.conf.run.stage2
-        return SlicedIterator(iterator, stage_conf.start, stage_conf.stop)
+        return SlicedIterator(iterator, self._get_start(stage_conf), stage_conf.stop)
 
     def _get_stage2_tasks(self, plan):
         # Stage 2 is generally: read topics, extract query, process them, retrieve results, rerank them.
@@ -859,10 +1653,20 @@ class JobBuilder:
         elif stage_conf.mode == PipelineMode.BATCH:
             batch_size_char = str(stage_conf.batch_size) if stage_conf.batch_size else '∞'
             LOGGER.info("Stage 2 is a batch pipeline selected with batch size of %s.", batch_size_char)
-            pipeline_class = functools.partial(BatchPipeline, n=stage_conf.batch_size)
+            pipeline_class = functools.partial(BatchPipeline, n=stage_conf.batch_size,
+                                               batch_bytes=stage_conf.batch_bytes, batch_chars=stage_conf.batch_chars,
+                                               sort_window=stage_conf.sort_window,
+                                               target_latency=stage_conf.target_latency)
+        elif stage_conf.mode == PipelineMode.PARALLEL:
+            num_workers = stage_conf.num_workers if stage_conf.num_workers else os.cpu_count()
+            LOGGER.info("Stage 2 is a parallel pipeline with %d workers.", num_workers)
+            pipeline_class = functools.partial(ParallelPipeline, num_workers=num_workers,
+                                               chunk_size=stage_conf.batch_size)
         else:
             raise ConfigError(f"Unrecognized pipeline mode: {stage_conf.mode}")
-        pipeline = pipeline_class(iterator, tasks, progress_interval=stage_conf.progress_interval)
+        pipeline = pipeline_class(iterator, tasks, progress_interval=stage_conf.progress_interval,
+                                  prefetch=stage_conf.prefetch, write_queue=stage_conf.write_queue,
+                                  checkpoint=self.checkpoint, slow_threshold=stage_conf.slow_threshold)
         LOGGER.info("Stage 2 pipeline: %s", pipeline)
         return pipeline
 
@@ -907,12 +1711,37 @@ class JobBuilder:
         path = self.run_path / task_conf.output
         return is_complete(path)
 
+    def _get_checkpoint(self, stage_conf, name, plan):
+        """Get the checkpointer for a stage if checkpoints are configured
+
+        Checkpoints are only used when a single job processes all the input of the stage.
+        Parallel sub-jobs have a start or a manifest and map jobs are rerun from the beginning.
+        """
+        if not stage_conf.checkpoint_interval or self.conf.run.parallel or self.job_type != JobType.NORMAL:
+            return None
+        if stage_conf.start is not None or stage_conf.manifest is not None:
+            return None
+        checkpoint = Checkpointer(self.run_path / f".{name}_checkpoint.json", stage_conf.checkpoint_interval, plan)
+        if checkpoint.state:
+            LOGGER.info("Resuming %s from checkpoint after %d items", name, checkpoint.position)
+        return checkpoint
+
+    def _get_start(self, stage_conf):
+        """Start position in the input (after the last checkpoint if resuming)"""
+        if self.checkpoint and self.checkpoint.state:
+            return self.checkpoint.position
+        return stage_conf.start
+
     def clear_output(self, task_conf):
         """Delete the output directory if previous run did not complete
 
+        When resuming from a checkpoint, the partial output is kept.
+
         Args:
             task_conf (BaseConfig): Configuration for a task.
         """
+        if self.checkpoint and self.checkpoint.state:
+            return
         if task_conf.output:
             path = self.run_path / task_conf.output
             if path.exists() and not is_dir_empty(path):
@@ -1,22 +1,54 @@
 import abc
+import collections
+import concurrent.futures
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
 import pathlib
+import queue
+import threading
+import timeit
+import traceback
+
+import more_itertools
 
 from .config import ConfigService
-from .util import Timer, TimedIterator, ChunkedIterator
+from .error import JobStoppedError, PatapscoError
+from .util import Timer, TaskMetrics, TimedIterator, ChunkedIterator, MonitoredQueue, PrefetchIterator
+from .util.cache import take_cache_report
 from .util.file import touch_complete
+from .util.java import Java
+from .util.pool import get_worker_count, is_job_stopped, set_worker_count
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _part_key(path):
+    """Sort key so that part_10 comes after part_9 and the output stays in input order"""
+    number = path.name.split('_')[-1]
+    return (int(number), path.name) if number.isdigit() else (-1, path.name)
+
+
 class Task(abc.ABC):
     """A task in a pipeline
 
     Implementations must define a process() method.
     Any initialization or cleanup can be done in begin() or end().
     See Pipeline for how to construct a pipeline of tasks.
+    Tasks that only transform items (no output or shared state) can set parallel
+    to True so that ParallelPipeline can run them in worker processes.
+    Tasks that write output (files, database, index) set sink to True so that
+    a pipeline can run them in a writer thread.
+    Tasks whose reduce() only touches their own output set independent_reduce to True
+    so that a pipeline can run those reductions concurrently.
     """
 
+    parallel = False
+    sink = False
+    independent_reduce = False
+
     def __init__(self, run_path=None, artifact_config=None, base=None):
         """
         Args:
@@ -57,12 +89,50 @@ class Task(abc.ABC):
         """Optional begin method for initialization"""
         pass
 
+    def checkpoint(self):
+        """Optional method to make the output so far durable so that an interrupted run can resume
+
+        Returns:
+            json serializable state that is passed to restore() when resuming or None
+        """
+        return None
+
+    def restore(self, state):
+        """Optional method to restore the state from the last checkpoint
+
+        This is called before begin() when resuming a run.
+
+        Args:
+            state: State returned by checkpoint()
+        """
+        pass
+
     def end(self):
         """End method for cleaning up and marking as complete"""
         if self.base:
             ConfigService.write_config_file(self.base / 'config.yml', self.artifact_config)
             touch_complete(self.base)
 
+    def end_worker(self):
+        """End method for a task that ran in a worker process of ParallelPipeline
+
+        The copy of the task in the main process is passed the returned state with merge_worker()
+        and its end() is called once all the workers are done.
+
+        Returns:
+            picklable state of the worker or None
+        """
+        self.end()
+        return None
+
+    def merge_worker(self, state):
+        """Merge the state returned by end_worker() in a worker process into this task
+
+        Args:
+            state: State returned by end_worker()
+        """
+        pass
+
     def reduce(self, dirs):
         """Reduce output across parallel jobs
 
@@ -71,27 +141,35 @@ class Task(abc.ABC):
         """
         pass
 
-    def run_reduce(self):
-        """Method for pipeline to call to run reduce() for each task"""
+    def run_reduce(self, parts=None, directory=None):
+        """Method for pipeline to call to run reduce() for each task
+
+        Args:
+            parts (list): Part directories to reduce. Default is the part directories of the run.
+            directory (str): Directory of the pipeline's output relative to the run path
+                when it is an intermediate part of a tree reduce.
+        """
         if self.run_path and self.relative_path is not None:
-            dirs = sorted(list(self.run_path.glob('part*')))
-            dirs = [d / self.relative_path for d in dirs]
+            if parts is None:
+                parts = sorted(self.run_path.glob('part*'), key=_part_key)
+            relative_path = pathlib.Path(self.relative_path)
+            if directory is not None:
+                relative_path = relative_path.relative_to(directory)
+            dirs = [pathlib.Path(part) / relative_path for part in parts]
             self.reduce(dirs)
 
     def __str__(self):
         return self.__class__.__name__
 
 
-class TimedTask(Task):
-    """Task with a built in timer that wraps another task"""
+class TaskWrapper(Task):
+    """Task that wraps another task and delegates to it"""
     def __init__(self, task):
         super().__init__()
         self.task = task
-        self.timer = Timer()
 
     def process(self, item):
-        with self.timer:
-            return self.task.process(item)
+        return self.task.process(item)
 
     def batch_process(self, items):
         return self.task.batch_process(items)
@@ -99,53 +177,434 @@ class TimedTask(Task):
     def begin(self):
         self.task.begin()
 
+    def checkpoint(self):
+        return self.task.checkpoint()
+
+    def restore(self, state):
+        self.task.restore(state)
+
     def end(self):
         self.task.end()
 
+    def end_worker(self):
+        return self.task.end_worker()
+
+    def merge_worker(self, state):
+        self.task.merge_worker(state)
+
     def reduce(self, dirs):
         self.task.reduce(dirs)
 
-    def run_reduce(self):
-        self.task.run_reduce()
+    def run_reduce(self, parts=None, directory=None):
+        self.task.run_reduce(parts, directory)
 
     @property
-    def time(self):
-        return self.timer.time
+    def parallel(self):
+        return self.task.parallel
+
+    @property
+    def sink(self):
+        return self.task.sink
+
+    @property
+    def independent_reduce(self):
+        return self.task.independent_reduce
 
     def __str__(self):
         return str(self.task)
 
 
+class TimedTask(TaskWrapper):
+    """Task with a built in timer and per-item metrics that wraps another task"""
+    def __init__(self, task, slow_threshold=None):
+        super().__init__(task)
+        self.timer = Timer()
+        self.reduce_timer = Timer()
+        self.metrics = TaskMetrics(str(task), slow_threshold)
+
+    def process(self, item):
+        start = timeit.default_timer()
+        result = self.task.process(item)
+        elapsed = timeit.default_timer() - start
+        self.timer.time += elapsed
+        self.metrics.add(elapsed, item)
+        return result
+
+    def batch_process(self, items):
+        if type(self.task).batch_process is Task.batch_process:
+            # the task processes one item at a time so we can time each item
+            return Task.batch_process(self, items)
+        start = timeit.default_timer()
+        results = self.task.batch_process(items)
+        elapsed = timeit.default_timer() - start
+        self.timer.time += elapsed
+        self.metrics.add_batch(elapsed, items)
+        return results
+
+    def run_reduce(self, parts=None, directory=None):
+        with self.reduce_timer:
+            self.task.run_reduce(parts, directory)
+
+    @property
+    def time(self):
+        return self.timer.time
+
+
+class AdaptiveBatchTask(TaskWrapper):
+    """Splits the batches of a task into sub-batches with a budget of characters
+
+    Optionally, the items are sorted by length within a window so that items of similar length share a sub-batch
+    and the budget is adjusted after each sub-batch toward a target latency.
+    The output is in the same order as the input.
+    """
+
+    MIN_SCALE = 0.1  # the budget stays within this factor of the initial budget
+    MAX_SCALE = 10
+    SMOOTHING = 0.3  # weight of the latest sub-batch in the estimate of the seconds per character
+
+    def __init__(self, task, batch_chars, sort_window=None, target_latency=None):
+        """
+        Args:
+            task (Task): Task that implements batch_process().
+            batch_chars (int): Initial number of characters in a sub-batch.
+            sort_window (int): Number of items to sort by length or None to not sort.
+            target_latency (float): Target seconds per sub-batch or None for a fixed budget.
+        """
+        super().__init__(task)
+        self.initial_budget = batch_chars
+        self.budget = batch_chars
+        self.sort_window = sort_window
+        self.target_latency = target_latency
+        self.seconds_per_char = None
+        self.sizes = collections.Counter()
+        self.chars = 0
+
+    def batch_process(self, items):
+        sizes = [self._get_chars(item) for item in items]
+        if self.sort_window:
+            order = []
+            for start in range(0, len(items), self.sort_window):
+                window = range(start, min(start + self.sort_window, len(items)))
+                order.extend(sorted(window, key=lambda i: sizes[i]))
+        else:
+            order = range(len(items))
+        results = [None] * len(items)
+        batch = []
+        chars = 0
+        for index in order:
+            if batch and chars + sizes[index] > self.budget:
+                self._run_batch(items, batch, chars, results)
+                batch = []
+                chars = 0
+            batch.append(index)
+            chars += sizes[index]
+        if batch:
+            self._run_batch(items, batch, chars, results)
+        return results
+
+    def _run_batch(self, items, indices, chars, results):
+        start = timeit.default_timer()
+        output = self.task.batch_process([items[index] for index in indices])
+        elapsed = timeit.default_timer() - start
+        for index, item in zip(indices, output):
+            results[index] = item
+        self.sizes[len(indices)] += 1
+        self.chars += chars
+        if self.target_latency and chars:
+            rate = elapsed / chars
+            if self.seconds_per_char is None:
+                self.seconds_per_char = rate
+            else:
+                self.seconds_per_char = self.SMOOTHING * rate + (1 - self.SMOOTHING) * self.seconds_per_char
+            if self.seconds_per_char:
+                budget = self.target_latency / self.seconds_per_char
+                low = self.MIN_SCALE * self.initial_budget
+                high = self.MAX_SCALE * self.initial_budget
+                self.budget = int(min(max(budget, low), high))
+
+    @staticmethod
+    def _get_chars(item):
+        text = getattr(item, 'text', None)
+        if text is None:
+            text = getattr(item, 'title', None)
+        # items without text count as one character so that the budget limits their number
+        return max(1, len(text)) if isinstance(text, str) else 1
+
+    @property
+    def report(self):
+        num_batches = sum(self.sizes.values())
+        num_items = sum(size * count for size, count in self.sizes.items())
+        return {
+            'name': str(self.task),
+            'batches': num_batches,
+            'items': num_items,
+            'chars': self.chars,
+            'min_items': min(self.sizes) if self.sizes else 0,
+            'max_items': max(self.sizes) if self.sizes else 0,
+            'mean_items': num_items / num_batches if num_batches else 0,
+            'budget': self.budget,
+            'sizes': {str(size): count for size, count in sorted(self.sizes.items())},
+        }
+
+
+class Checkpointer:
+    """Records the progress of a pipeline so that an interrupted run can resume from the last checkpoint
+
+    A checkpoint has the number of input items consumed and the state returned by each task's checkpoint().
+    """
+
+    def __init__(self, path, interval, plan):
+        """
+        Args:
+            path (str or Path): Path to the checkpoint file.
+            interval (int): Number of input items between checkpoints.
+            plan (list): Tasks in the stage plan (a checkpoint from a different plan is ignored).
+        """
+        self.path = pathlib.Path(path)
+        self.interval = interval
+        self.plan = [str(item) for item in plan]
+        self.state = None
+        if self.path.exists():
+            try:
+                with open(self.path) as fp:
+                    state = json.load(fp)
+            except ValueError:
+                state = None
+            if state and state['plan'] == self.plan:
+                self.state = state
+            else:
+                LOGGER.warning("Ignoring checkpoint %s that does not match the current run", self.path)
+
+    @property
+    def position(self):
+        """Number of input items processed at the last checkpoint"""
+        return self.state['position'] if self.state else 0
+
+    def save(self, position, count, tasks):
+        state = {
+            'plan': self.plan,
+            'position': position,
+            'count': count,
+            'tasks': [task.checkpoint() for task in tasks]
+        }
+        # write and rename so that a crash does not leave a partial checkpoint
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump(state, fp)
+        os.replace(tmp_path, self.path)
+        self.state = state
+
+    def restore(self, tasks):
+        """Restore the tasks and return the count of processed items"""
+        for task, state in zip(tasks, self.state['tasks']):
+            task.restore(state)
+        return self.state['count']
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+class _CheckpointRequest:
+    """Passed through the writer queue so that a checkpoint is taken after the sinks process the earlier items"""
+
+    def __init__(self, position):
+        self.position = position
+
+
+class _FlushRequest:
+    """Passed through the writer queue so that the sinks flush their output to release memory"""
+
+
+class SinkThread:
+    """Runs the sink tasks of a pipeline in a thread fed by a bounded queue
+
+    This overlaps writing the output with processing the next items.
+    """
+
+    _STOP = object()
+
+    def __init__(self, func, size):
+        """
+        Args:
+            func (callable): Function called on each item in the writer thread.
+            size (int): Maximum number of items waiting to be written.
+        """
+        self.func = func
+        self.queue = MonitoredQueue('writer', size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        if self.error:
+            raise self.error
+        self.queue.put(item)
+
+    def join(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._STOP:
+                    break
+                # after an error, keep draining the queue so the producer does not block
+                if not self.error:
+                    try:
+                        self.func(item)
+                    except Exception as e:
+                        self.error = e
+                # so a batch is not held while waiting for the next one
+                del item
+        finally:
+            Java.detach()
+
+
 class Pipeline(abc.ABC):
     """Interface for a pipeline of tasks"""
 
-    def __init__(self, iterator, tasks, progress_interval=None):
+    def __init__(self, iterator, tasks, progress_interval=None, prefetch=None, write_queue=None, checkpoint=None,
+                 slow_threshold=None):
         """
         Args:
             iterator (iterator): Iterator over input for pipeline.
             tasks (list): List of tasks run in sequence.
+            progress_interval (int): How often to log progress.
+            prefetch (int): Size of queue filled by a reader thread or None to read in the pipeline thread.
+            write_queue (int): Size of queue for a thread running the sink tasks or None to not use a thread.
+            checkpoint (Checkpointer): Optional checkpointer for resuming an interrupted run.
+                The iterator should already be positioned after the items of the last checkpoint.
+            slow_threshold (float): Seconds above which a task records the id of an item in the slow item log.
         """
-        self.iterator = TimedIterator(iterator)
-        self.tasks = [TimedTask(task) for task in tasks]
+        self.iterator = TimedIterator(iterator, slow_threshold)
+        if prefetch:
+            self.iterator = PrefetchIterator(self.iterator, prefetch)
+        self.slow_threshold = slow_threshold
+        self.tasks = [TimedTask(task, slow_threshold) for task in tasks]
         self.progress_interval = progress_interval
+        self.write_queue = write_queue
+        self.writer = None
+        self.checkpoint = checkpoint
+        self.monitor = None  # optional MemoryMonitor set by the job
+        self.worker_caches = []  # cache stats sent by each worker process of a parallel pipeline
         self.count = 0
+        self.position = 0
 
     @abc.abstractmethod
     def run(self):
         pass
 
     def begin(self):
-        self.count = 0
+        self._resume()
         for task in self.tasks:
             task.begin()
 
+    def _resume(self):
+        """Restore the count, position, and tasks from the last checkpoint if resuming"""
+        self.count = 0
+        self.position = 0
+        if self.checkpoint and self.checkpoint.state:
+            self.count = self.checkpoint.restore(self.tasks)
+            self.position = self.checkpoint.position
+            LOGGER.info("Resuming from checkpoint after %d items", self.position)
+
     def end(self):
         for task in self.tasks:
             task.end()
+        if self.checkpoint:
+            self.checkpoint.remove()
+
+    def _advance(self, n):
+        """Record that n input items were consumed and checkpoint if an interval was crossed"""
+        self._check_stopped()
+        self._check_memory()
+        before = self.position
+        self.position += n
+        if self.checkpoint and self.position // self.checkpoint.interval > before // self.checkpoint.interval:
+            if self.writer:
+                self.writer.put(_CheckpointRequest(self.position))
+            else:
+                self.checkpoint.save(self.position, self.count, self.tasks)
+
+    def _write(self, item, tasks):
+        """Function run by the writer thread"""
+        if isinstance(item, _CheckpointRequest):
+            self.checkpoint.save(item.position, self.count, self.tasks)
+        elif isinstance(item, _FlushRequest):
+            self._flush(tasks)
+        else:
+            self._process(item, tasks)
+
+    def _check_stopped(self):
+        """Fail if the main process no longer needs this sub-job
+
+        This runs between items so the job never stops while writing its output.
+        The pending output is written and the tasks are ended so that the worker
+        does not carry open writers or connections into its next job.
+        """
+        if not is_job_stopped():
+            return
+        if self.writer:
+            self.writer.join()
+            self.writer = None
+        self.end()
+        raise JobStoppedError("Stopped by the main process")
+
+    def _check_memory(self):
+        """Fail if the memory budget was exceeded or try to release memory if close to it"""
+        if not self.monitor:
+            return
+        if self.monitor.error:
+            raise PatapscoError(self.monitor.error)
+        if self.monitor.take_pressure():
+            self._release_memory()
+
+    def _release_memory(self):
+        """Flush the output of the sink tasks (index buffer, database transaction, files)"""
+        LOGGER.warning("Flushing the output to release memory")
+        if self.writer:
+            self.writer.put(_FlushRequest())
+        else:
+            self._flush([task for task in self.tasks if task.sink])
+
+    @staticmethod
+    def _flush(tasks):
+        # the tasks commit their output when checkpointing
+        for task in tasks:
+            task.checkpoint()
+
+    def reduce(self, parts=None, directory=None):
+        """Run the reduce of each task
+
+        The tasks with independent reductions run concurrently in threads
+        while the others run in order in this thread.
 
-    def reduce(self):
-        for task in self.tasks:
-            task.run_reduce()
+        Args:
+            parts (list): Part directories to reduce. Default is the part directories of the run.
+            directory (str): Directory of this pipeline's output relative to the run path
+                when it is an intermediate part of a tree reduce.
+        """
+        independent = [task for task in self.tasks if task.independent_reduce]
+        if len(independent) < 2:
+            for task in self.tasks:
+                task.run_reduce(parts, directory)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(independent)) as executor:
+            futures = [executor.submit(_run_reduce_in_thread, task, parts, directory) for task in independent]
+            for task in self.tasks:
+                if not task.independent_reduce:
+                    task.run_reduce(parts, directory)
+            for future in futures:
+                future.result()
+
+    @property
+    def reduce_report(self):
+        return [(str(task), task.reduce_timer.time) for task in self.tasks]
 
     @property
     def report(self):
@@ -153,6 +612,39 @@ class Pipeline(abc.ABC):
         report.extend((str(task), task.time) for task in self.tasks)
         return report
 
+    @property
+    def batch_report(self):
+        """Sub-batch sizes of tasks with adaptive batching"""
+        return [task.task.report for task in self.tasks if isinstance(task.task, AdaptiveBatchTask)]
+
+    @property
+    def metrics_report(self):
+        """Per-item latency and throughput of the iterator and each task"""
+        report = [self.iterator.metrics.report]
+        # the input is only measured by the reader since the tasks change the text
+        for task in self.tasks:
+            task.metrics.bytes = self.iterator.metrics.bytes
+        report.extend(task.metrics.report for task in self.tasks)
+        return report
+
+    @property
+    def queue_report(self):
+        queues = []
+        if isinstance(self.iterator, PrefetchIterator):
+            queues.append(self.iterator.queue.report)
+        if self.writer:
+            queues.append(self.writer.queue.report)
+        return queues
+
+    def _split_sinks(self, tasks):
+        """Split the tasks into those run in the pipeline thread and the trailing sinks for the writer thread"""
+        if not self.write_queue:
+            return tasks, []
+        split = len(tasks)
+        while split > 0 and tasks[split - 1].sink:
+            split -= 1
+        return tasks[:split], tasks[split:]
+
     def __str__(self):
         task_names = [str(self.iterator)]
         task_names.extend(str(task) for task in self.tasks)
@@ -164,44 +656,294 @@ class StreamingPipeline(Pipeline):
 
     def run(self):
         self.begin()
+        tasks, sinks = self._split_sinks(self.tasks)
+        if sinks:
+            self.writer = SinkThread(lambda x: self._write(x, sinks), self.write_queue)
         for item in self.iterator:
-            for task in self.tasks:
-                item = task.process(item)
-                # tasks can reject an item by returning None (they should log a warning/error)
-                if not item:
-                    break
-            if item:
-                self.count += 1
-                if self.progress_interval and self.count % self.progress_interval == 0:
-                    LOGGER.info(f"{self.count} iterations completed...")
+            if self.writer:
+                item = self._process(item, tasks, count=False)
+                if item:
+                    self.writer.put(item)
+            else:
+                self._process(item, tasks)
+            self._advance(1)
+        if self.writer:
+            self.writer.join()
         self.end()
 
+    def _process(self, item, tasks, count=True):
+        for task in tasks:
+            item = task.process(item)
+            # tasks can reject an item by returning None (they should log a warning/error)
+            if not item:
+                break
+        if item and count:
+            self.count += 1
+            if self.progress_interval and self.count % self.progress_interval == 0:
+                LOGGER.info(f"{self.count} iterations completed...")
+        return item
+
 
 class BatchPipeline(Pipeline):
-    """Pipeline that pushes chunks of input through the tasks"""
+    """Pipeline that pushes chunks of input through the tasks
+
+    The memory use is bounded by the bytes of text in a batch times the number of batches in flight
+    (one being read, one being processed, and those waiting in the prefetch and write queues).
+    Each batch is released as soon as the last task is done with it.
+    """
 
-    def __init__(self, iterator, tasks, n, progress_interval=None):
+    MAX_BATCH_BYTES = 2 ** 28  # cap on the text in a batch if batch_bytes is not set
+
+    def __init__(self, iterator, tasks, n, progress_interval=None, prefetch=None, write_queue=None, checkpoint=None,
+                 slow_threshold=None, batch_bytes=None, batch_chars=None, sort_window=None, target_latency=None):
         """
         Args:
             iterator (iterator): Iterator that produces input for the pipeline.
             tasks (list): List of tasks.
-            n (int): Batch size or None to process all.
+            n (int): Batch size or None to process all (up to the byte budget).
+            progress_interval (int): How often to log progress.
+            prefetch (int): Number of batches to read ahead in a reader thread.
+            write_queue (int): Number of batches waiting for the sink tasks in a writer thread.
+            checkpoint (Checkpointer): Optional checkpointer for resuming an interrupted run.
+            slow_threshold (float): Seconds above which a task records the id of an item in the slow item log.
+            batch_bytes (int): Maximum bytes of text in a batch.
+            batch_chars (int): Characters in a sub-batch for tasks that implement batch_process() or None to not split.
+            sort_window (int): Number of items sorted by length when forming sub-batches.
+            target_latency (float): Seconds per sub-batch that the number of characters is adjusted toward.
         """
-        super().__init__(ChunkedIterator(iterator, n), tasks, progress_interval)
+        self.batch_bytes = batch_bytes if batch_bytes else self.MAX_BATCH_BYTES
+        if batch_chars:
+            tasks = [AdaptiveBatchTask(task, batch_chars, sort_window, target_latency)
+                     if type(task).batch_process is not Task.batch_process else task for task in tasks]
+        self.chunker = ChunkedIterator(iterator, n, self.batch_bytes)
+        super().__init__(self.chunker, tasks, progress_interval, prefetch, write_queue, checkpoint, slow_threshold)
         self.current_progress = self.progress_interval
 
     def run(self):
         self.begin()
+        tasks, sinks = self._split_sinks(self.tasks)
+        if sinks:
+            self.writer = SinkThread(lambda x: self._write(x, sinks), self.write_queue)
         for chunk in self.iterator:
-            for task in self.tasks:
-                chunk = task.batch_process(chunk)
-                # a task can reject an item by returning None
-                chunk = [item for item in chunk if item is not None]
+            size = len(chunk)
+            if self.writer:
+                chunk = self._process(chunk, tasks, count=False)
+                self.writer.put(chunk)
+            else:
+                self._process(chunk, tasks)
+            # release the batch before the next one is read
+            del chunk
+            self._advance(size)
+        if self.writer:
+            self.writer.join()
+        self.end()
+
+    def _process(self, chunk, tasks, count=True):
+        for task in tasks:
+            chunk = task.batch_process(chunk)
+            # a task can reject an item by returning None
+            chunk = [item for item in chunk if item is not None]
+        if count:
             self.count += len(chunk)
             self._update_progress()
-        self.end()
+        return chunk
+
+    def _release_memory(self):
+        super()._release_memory()
+        self.chunker.max_bytes = max(1, self.chunker.max_bytes // 2)
+        if self.chunker.n:
+            self.chunker.n = max(1, self.chunker.n // 2)
+        LOGGER.warning("Reduced the batches to %d bytes of text", self.chunker.max_bytes)
 
     def _update_progress(self):
         if self.progress_interval and self.count >= self.current_progress:
             LOGGER.info(f"{self.count} iterations completed...")
             self.current_progress += self.progress_interval
+
+
+class ParallelPipeline(Pipeline):
+    """Pipeline that runs the leading parallel tasks in worker processes
+
+    The items are sent to the workers in chunks that each task processes with batch_process()
+    and the processed items are passed to the remaining tasks (indexer, database, writers) in input order in this process.
+    """
+
+    def __init__(self, iterator, tasks, num_workers=None, chunk_size=None, progress_interval=None, prefetch=None,
+                 write_queue=None, checkpoint=None, slow_threshold=None):
+        """
+        Args:
+            iterator (iterator): Iterator that produces input for the pipeline.
+            tasks (list): List of tasks.
+            num_workers (int): Number of worker processes or None to use all cores.
+            chunk_size (int): Number of items sent to a worker at a time.
+            progress_interval (int): How often to log progress.
+            prefetch (int): Size of queue filled by a reader thread.
+            write_queue (int): Number of chunks waiting for the remaining tasks in a writer thread.
+            checkpoint (Checkpointer): Optional checkpointer for resuming an interrupted run.
+            slow_threshold (float): Seconds above which a task records the id of an item in the slow item log.
+        """
+        super().__init__(iterator, tasks, progress_interval, prefetch, write_queue, checkpoint, slow_threshold)
+        self.num_workers = num_workers if num_workers else os.cpu_count()
+        self.chunk_size = chunk_size if chunk_size else 100
+        split = 0
+        while split < len(self.tasks) and self.tasks[split].parallel:
+            split += 1
+        self.worker_tasks = self.tasks[:split]
+        self.sink_tasks = self.tasks[split:]
+        self.feed_error = None
+
+    def begin(self):
+        # the worker tasks are initialized in the worker processes
+        self._resume()
+        for task in self.sink_tasks:
+            task.begin()
+
+    def end(self):
+        # the worker tasks in this process have the merged state of the workers
+        for task in self.worker_tasks + self.sink_tasks:
+            task.end()
+        if self.checkpoint:
+            self.checkpoint.remove()
+
+    def run(self):
+        if not self.worker_tasks:
+            LOGGER.warning("No tasks can be run in parallel so running as a streaming pipeline")
+            return StreamingPipeline.run(self)
+        self.begin()
+        context = multiprocessing.get_context('spawn')  # so the JVM doesn't get copied to the workers
+        in_queue = context.Queue(2 * self.num_workers)
+        out_queue = context.Queue()
+        log_queue = context.Queue()
+        # limit the number of chunks in flight so a slow sink doesn't result in unbounded memory use
+        slots = threading.BoundedSemaphore(4 * self.num_workers)
+        logger = logging.getLogger('patapsco')
+        listener = logging.handlers.QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+        listener.start()
+        tasks = [task.task for task in self.worker_tasks]
+        worker_count = get_worker_count() * self.num_workers
+        args = (tasks, in_queue, out_queue, log_queue, logger.level, self.slow_threshold, worker_count)
+        workers = [context.Process(target=_parallel_worker, args=args) for _ in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+        feeder = threading.Thread(target=self._feed, args=(in_queue, slots), daemon=True)
+        feeder.start()
+        if self.write_queue:
+            self.writer = SinkThread(self._sink, self.write_queue)
+        try:
+            self._collect(workers, out_queue, slots)
+            if self.writer:
+                self.writer.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            listener.stop()
+        feeder.join()
+        if self.feed_error:
+            raise self.feed_error
+        self.end()
+
+    def _feed(self, in_queue, slots):
+        try:
+            for seq, chunk in enumerate(more_itertools.chunked(self.iterator, self.chunk_size)):
+                slots.acquire()
+                in_queue.put((seq, chunk))
+        except Exception as e:
+            self.feed_error = e
+        finally:
+            for _ in range(self.num_workers):
+                in_queue.put(None)
+
+    def _collect(self, workers, out_queue, slots):
+        pending = {}
+        next_seq = 0
+        num_done = 0
+        while num_done < len(workers):
+            try:
+                kind, seq, data = out_queue.get(timeout=1)
+            except queue.Empty:
+                if not all(worker.is_alive() or worker.exitcode == 0 for worker in workers):
+                    raise PatapscoError("A parallel pipeline worker died unexpectedly")
+                continue
+            if kind == 'error':
+                raise PatapscoError(f"Parallel pipeline worker failed with {data}")
+            elif kind == 'done':
+                num_done += 1
+                task_data, caches = data
+                self.worker_caches.append(caches)
+                for task, (metrics, state) in zip(self.worker_tasks, task_data):
+                    task.timer.time += metrics.histogram.total
+                    task.metrics.merge(metrics)
+                    if state is not None:
+                        task.merge_worker(state)
+            else:
+                pending[seq] = data
+                while next_seq in pending:
+                    chunk = pending.pop(next_seq)
+                    if self.writer:
+                        self.writer.put(chunk)
+                    else:
+                        self._sink(chunk)
+                    slots.release()
+                    next_seq += 1
+                    # rejected items are None in the chunk so this is the number of input items
+                    self._advance(len(chunk))
+
+    def _sink(self, items):
+        if isinstance(items, _CheckpointRequest):
+            self.checkpoint.save(items.position, self.count, self.tasks)
+            return
+        if isinstance(items, _FlushRequest):
+            self._flush(self.sink_tasks)
+            return
+        for item in items:
+            if not item:
+                continue
+            for task in self.sink_tasks:
+                item = task.process(item)
+                if not item:
+                    break
+            if item:
+                self.count += 1
+                if self.progress_interval and self.count % self.progress_interval == 0:
+                    LOGGER.info(f"{self.count} iterations completed...")
+
+
+def _run_reduce_in_thread(task, parts=None, directory=None):
+    try:
+        task.run_reduce(parts, directory)
+    finally:
+        Java.detach()
+
+
+def _parallel_worker(tasks, in_queue, out_queue, log_queue, log_level, slow_threshold=None, worker_count=1):
+    """Process chunks of items in a worker process of ParallelPipeline"""
+    set_worker_count(worker_count)
+    logger = logging.getLogger('patapsco')
+    logger.setLevel(log_level)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    tasks = [TimedTask(task, slow_threshold) for task in tasks]
+    try:
+        for task in tasks:
+            task.begin()
+        while True:
+            message = in_queue.get()
+            if message is None:
+                break
+            seq, chunk = message
+            # the chunk goes through batch_process() so that spacy and stanza can batch their models
+            results = list(chunk)
+            indices = range(len(results))
+            for task in tasks:
+                for index, item in zip(indices, task.batch_process([results[index] for index in indices])):
+                    results[index] = item
+                # tasks can reject an item by returning None and it is not passed to the later tasks
+                indices = [index for index in indices if results[index] is not None]
+            out_queue.put(('result', seq, results))
+        states = [task.end_worker() for task in tasks]
+        # the stem and document caches are used in this process so their stats are sent with the metrics
+        out_queue.put(('done', None, ([(task.metrics, state) for task, state in zip(tasks, states)],
+                                      take_cache_report())))
+    except Exception as e:
+        out_queue.put(('error', None, f"{type(e).__name__} {e}\n{traceback.format_exc()}"))
@@ -0,0 +1,24 @@
+#!/bin/bash
+
+#$ -N patapsco-reduce-stage-{stage}-level-{level}
+#$ -j y
+#$ -o {base}
+{resources}
+#$ -t 1-{num_jobs}
+
+{code}
+
+# we want zero-based group ids
+GROUP_ID=$(($SGE_TASK_ID-1))
+
+DATE=$(date '+%Y-%m-%d %H:%M:%S,%3N')
+PYTHON_VERSION=$(python --version)
+PYTHON_EXE=$(which python)
+echo "$DATE - patapsco-reduce - INFO - $PYTHON_VERSION"
+echo "$DATE - patapsco-reduce - INFO - $PYTHON_EXE"
+
+if [[ -n "$CUDA_VISIBLE_DEVICES" ]]; then
+  echo "$DATE - patapsco-reduce - INFO - Using gpus $CUDA_VISIBLE_DEVICES"
+fi
+
+patapsco-reduce {debug} --stage {stage} --level {level} --group $GROUP_ID {config}
@@ -18,4 +18,4 @@ if [[ -n "$CUDA_VISIBLE_DEVICES" ]]; then
   echo "$DATE - patapsco-map - INFO - Using gpus $CUDA_VISIBLE_DEVICES"
 fi
 
-patapsco-map {debug} --stage {stage} --job $JOB_ID --increment {increment} {config}
+patapsco-map {debug} --stage {stage} --job $JOB_ID {split} {config}
@@ -9,7 +9,7 @@ from typing import List, Union
 from .pipeline import Task
 from .topics import Query
 from .util import DataclassJSONEncoder
-from .util.file import count_lines, path_append
+from .util.file import count_lines, open_output, path_append, sync_output
 
 LOGGER = logging.getLogger(__name__)
 
@@ -37,6 +37,9 @@ class TrecResultsWriter(Task):
     This writes the .complete to the run directory to indicate that a job is complete.
     """
 
+    sink = True
+    independent_reduce = True
+
     def __init__(self, config):
         """
         Args:
@@ -50,10 +53,17 @@ class TrecResultsWriter(Task):
         self.filename = config.run.results
         self.path = self.run_path / self.filename
         self.file = None
+        self.offset = None
 
     def begin(self):
         self.path.parent.mkdir(parents=True, exist_ok=True)  # this is needed for rerank only pipelines
-        self.file = open(self.path, 'w')
+        self.file = open_output(self.path, self.offset)
+
+    def checkpoint(self):
+        return {'offset': sync_output(self.file)}
+
+    def restore(self, state):
+        self.offset = state['offset']
 
     def process(self, results):
         """
@@ -111,6 +121,9 @@ class TrecResultsReader:
 class JsonResultsWriter(Task):
     """Write results to a json file"""
 
+    sink = True
+    independent_reduce = True
+
     def __init__(self, run_path, config, artifact_config):
         """
         Args:
@@ -120,7 +133,17 @@ class JsonResultsWriter(Task):
         """
         super().__init__(run_path, artifact_config, config.output)
         self.path = self.base / 'results.jsonl'
-        self.file = open(self.path, 'w')
+        self.file = None
+        self.offset = None
+
+    def begin(self):
+        self.file = open_output(self.path, self.offset)
+
+    def checkpoint(self):
+        return {'offset': sync_output(self.file)}
+
+    def restore(self, state):
+        self.offset = state['offset']
 
     def process(self, results):
         """
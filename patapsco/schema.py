@@ -6,6 +6,7 @@ from .config import BaseConfig, SectionConfig, UncheckedSectionConfig, Optional,
 class PipelineMode(str, enum.Enum):
     STREAMING = 'streaming'
     BATCH = 'batch'
+    PARALLEL = 'parallel'
 
 
 class Tasks(str, enum.Enum):
@@ -30,10 +31,39 @@ class PathConfig(BaseConfig):
 
 
 class NormalizationConfig(BaseConfig):
-    report: bool = False  # save a report of normalization changes
+    report: Union[bool, str] = False  # save a report of normalization changes: true or diff, counts, or false
+    report_sample: float = 1.0  # fraction of the documents included in the report
+    report_output: str = "normalize_report.txt"  # path of the report relative to the run directory
     lowercase: bool = True
 
 
+class StanzaConfig(BaseConfig):
+    """Configuration for the stanza pipeline and the torch threads that it uses"""
+    package: str = "default"  # stanza model package
+    threads: Optional[int]  # torch intra-op threads (default is this process's share of the CPUs)
+    interop_threads: Optional[int]  # torch inter-op threads (default is torch's default)
+    tokenize_batch_size: Optional[int]  # characters per tokenizer batch (default is stanza's default)
+    lemma_batch_size: Optional[int]  # words per lemmatizer batch (default is stanza's default)
+    pretokenized: bool = False  # the text is already tokenized with spaces between tokens
+
+
+class SpacyConfig(BaseConfig):
+    """Configuration for the spaCy tokenizer"""
+    blank: bool = True  # when not stemming, tokenize with the language's rules rather than loading the model
+
+
+class StemCacheConfig(BaseConfig):
+    """Configuration for the cache of stems of token-level stemmers (porter, parsivar)"""
+    size: int = 100000  # maximum number of tokens in the cache (0 to not cache)
+    persist: bool = False  # save the cache in the patapsco cache directory so later runs start warm
+
+
+class NgramConfig(BaseConfig):
+    """Configuration for the character ngram tokenizer"""
+    n: Optional[int]  # characters per ngram (default is 2 for CJK and 5 otherwise)
+    split: str = "spacy"  # sentence splitting: spacy, punct (punctuation and newlines), or none
+
+
 class TextProcessorConfig(SectionConfig):
     """Configuration for the text processing"""
     model_path: Optional[str]  # path to spacy or stanza model directory
@@ -42,6 +72,12 @@ class TextProcessorConfig(SectionConfig):
     stopwords: Union[bool, str] = "lucene"
     stem: Union[bool, str] = False
     strict_check: bool = True  # check whether the processing is the same for documents and queries
+    batch_size: int = 64  # texts given to the spacy or stanza model at a time when processing a batch
+    n_process: int = 1  # processes used by spacy when processing a batch
+    spacy: SpacyConfig = SpacyConfig()
+    stanza: StanzaConfig = StanzaConfig()
+    stem_cache: Optional[StemCacheConfig] = StemCacheConfig()
+    ngram: NgramConfig = NgramConfig()
 
 
 # """""""""""""""""
@@ -57,10 +93,17 @@ class DocumentsInputConfig(BaseConfig):
     path: Union[str, list]
 
 
+class DocumentCacheConfig(BaseConfig):
+    """Configuration for the cache of processed documents that is shared across runs"""
+    path: Optional[str]  # sqlite file for the cache (default is documents.sqlite in the patapsco cache directory)
+    max_size: int = 10 * 2 ** 30  # bytes of text before the least recently used documents are evicted
+
+
 class DocumentsConfig(SectionConfig):
     """Document processing task configuration"""
     input: DocumentsInputConfig
     process: TextProcessorConfig
+    cache: Optional[DocumentCacheConfig] = None
     output: Union[bool, str] = False
 
 
@@ -223,13 +266,34 @@ class ScoreConfig(SectionConfig):
 
 class StageConfig(BaseConfig):
     """Configuration for one of the stages"""
-    mode: str = "streaming"  # streaming or batch
-    batch_size: Optional[int]  # for batch, the default is a single batch
+    mode: str = "streaming"  # streaming, batch, or parallel
+    batch_size: Optional[int]  # for batch, the default is a single batch. for parallel, items sent to a worker at a time
+    batch_bytes: Optional[int]  # for batch, maximum bytes of text in a batch (default is 256MB)
+    batch_chars: Optional[int]  # for batch, characters in a sub-batch for tasks that process whole batches
+    sort_window: Optional[int]  # for batch_chars, number of items sorted by length to form the sub-batches
+    target_latency: Optional[float]  # for batch_chars, seconds per sub-batch that the budget is adjusted toward
+    num_workers: Optional[int]  # for parallel, number of worker processes (default is number of cores)
     num_jobs: int = 1  # number of parallel jobs
+    shard_size: Optional[int]  # for mp stage 1, bytes of text per shard with num_jobs workers pulling shards
     progress_interval: Optional[int]  # how often should progress be logged
+    prefetch: Optional[int]  # size of queue filled by a reader thread (default is to read in the pipeline thread)
+    write_queue: Optional[int]  # size of queue feeding the writers in a separate thread (default is no thread)
+    checkpoint_interval: Optional[int]  # number of input items between checkpoints for resuming an interrupted run
+    slow_threshold: Optional[float] = 1.0  # seconds above which a task logs the id of an item in timing.json
     # start and stop are intended for parallel processing
     start: Optional[int]  # O-based index of start position in input (inclusive)
     stop: Optional[int]  # O-based index of stop position in input (exclusive)
+    # manifest and shard replace start and stop for inputs that support seeking
+    manifest: Optional[str]  # path to shard manifest
+    shard: Optional[int]  # 0-based index of the shard in the manifest
+
+
+class MemoryConfig(BaseConfig):
+    """Configuration for monitoring the memory of a run"""
+    interval: float = 1.0  # seconds between samples of the memory
+    budget: Optional[int]  # bytes of memory for the job including child processes (default is no budget)
+    warning: float = 0.9  # fraction of the budget at which the pipelines flush output and shrink batches
+    timeline: int = 600  # maximum samples in the timeline of memory.json (0 for no timeline)
 
 
 class ParallelConfig(BaseConfig):
@@ -238,6 +302,12 @@ class ParallelConfig(BaseConfig):
     email: Optional[str]  # email address for job completion notifications
     resources: str = "h_rt=12:00:00"  # default to 12 hours as an upper limit (this is qsub format)
     code: Optional[str]  # extra lines to add to bash scripts
+    start_method: str = "forkserver"  # mp start method for the workers: forkserver or spawn
+    persistent: bool = False  # keep the mp workers for later runs in the same process
+    retries: int = 1  # number of times mp runs a failed sub-job again
+    speculation: Optional[float] = 3.0  # mp duplicates sub-jobs running this many times longer than the median
+    timeout: Optional[float]  # seconds before mp stops an attempt of a sub-job and counts it as failed
+    fan_in: Optional[int] = 32  # max parts merged by a stage 1 reducer with more parts reduced in a tree
 
 
 class RunConfig(SectionConfig):
@@ -246,6 +316,8 @@ class RunConfig(SectionConfig):
     path: Optional[str]  # base path for run output by default created based on name
     results: str = "results.txt"  # default results filename
     parallel: Optional[ParallelConfig]  # configure for a parallel job
+    profile: Optional[str]  # sampling or cprofile to write a profile of each stage to the profile directory
+    memory: MemoryConfig = MemoryConfig()
     stage1: Union[bool, StageConfig] = StageConfig()
     stage2: Union[bool, StageConfig] = StageConfig()
 
@@ -1,15 +1,22 @@
+import collections
 import contextlib
 import functools
 import io
 import itertools
+import json
 import logging
+import os
 import pathlib
+import re
 
 from .error import ConfigError
 from .pipeline import Task
+from .schema import StanzaConfig
 from .util import LangStandardizer
-from .util.file import create_path
-from .util.normalize import NormalizerFactory
+from .util.cache import CacheStats, take_report
+from .util.file import create_path, get_cache_dir
+from .util.normalize import GenericNormalizer, NormalizerFactory
+from .util.pool import get_cpu_count, get_cpu_share
 
 LOGGER = logging.getLogger(__name__)
 
@@ -17,6 +24,8 @@ LOGGER = logging.getLogger(__name__)
 class Stemmer:
     """Stemmer interface"""
 
+    contextual = False  # whether the stem of a token depends on the tokens around it
+
     def __init__(self, lang):
         self.lang = lang
 
@@ -66,6 +75,146 @@ class FarsiStemmer(Stemmer):
         return [self.stemmer.convert_to_stem(token) for token in tokens]
 
 
+class StemCache(CacheStats):
+    """Bounded LRU cache of token to stem that is shared by the stemmers of a process
+
+    Words follow a Zipfian distribution so a few thousand tokens account for most occurrences.
+    There is one cache per stemmer and language that can be persisted so later runs start warm.
+    """
+
+    # key is name:lang
+    caches = {}
+
+    @classmethod
+    def get_cache(cls, name, lang, size=100000, persist=False):
+        """Get the cache for a stemmer and language, creating it if needed
+
+        Args:
+            name (str): Name of the stemmer.
+            lang (str): ISO 639-3 language code.
+            size (int): Maximum number of tokens in the cache.
+            persist (bool): Whether to load the cache from and save it to the patapsco cache directory.
+
+        Returns:
+            StemCache
+        """
+        key = f"{name}:{lang}"
+        if key not in cls.caches:
+            path = None
+            if persist:
+                cache_dir = get_cache_dir()
+                path = cache_dir / 'stems' / f"{name}_{lang}.json" if cache_dir else None
+            cls.caches[key] = StemCache(key, size, path)
+        return cls.caches[key]
+
+    @classmethod
+    def take_report(cls):
+        """Get the hits and misses of each cache since the last report"""
+        return take_report(cls.caches.values())
+
+    def __init__(self, name, size, path=None):
+        """
+        Args:
+            name (str): Name of the cache used in reports.
+            size (int): Maximum number of tokens in the cache.
+            path (Path): Optional json file that the cache is loaded from and saved to.
+        """
+        super().__init__()
+        self.name = name
+        self.size = size
+        self.path = path
+        self.stems = collections.OrderedDict()
+        if self.path:
+            self.stems.update(self._read())
+            self._trim()
+
+    def get(self, token):
+        """Get the stem of a token or None if not in the cache"""
+        stem = self.stems.get(token)
+        if stem is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.stems.move_to_end(token)
+        return stem
+
+    def put(self, token, stem):
+        self.stems[token] = stem
+        if len(self.stems) > self.size:
+            self.stems.popitem(last=False)
+
+    def save(self):
+        """Merge the cache into its file so that workers do not lose each other's stems"""
+        if not self.path:
+            return
+        stems = self._read()
+        stems.update(self.stems)
+        stems = dict(itertools.islice(stems.items(), max(0, len(stems) - self.size), None))
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}")
+            with open(tmp_path, 'w') as fp:
+                json.dump(stems, fp, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            LOGGER.warning(f"Unable to save the stem cache to {self.path}: {e}")
+
+    def get_size(self):
+        """Number of tokens in the cache"""
+        return len(self.stems)
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                return collections.OrderedDict(json.load(fp))
+        except (OSError, ValueError):
+            return collections.OrderedDict()
+
+    def _trim(self):
+        while len(self.stems) > self.size:
+            self.stems.popitem(last=False)
+
+
+class CachedStemmer(Stemmer):
+    """Stemmer that memoizes the stems of another stemmer"""
+
+    def __init__(self, stemmer, cache):
+        """
+        Args:
+            stemmer (Stemmer): Stemmer that stems each token independently of the others.
+            cache (StemCache)
+        """
+        super().__init__(stemmer.lang)
+        self.stemmer = stemmer
+        self.cache = cache
+
+    def stem(self, tokens):
+        stems = []
+        for token in tokens:
+            stem = self.cache.get(token)
+            if stem is None:
+                stem = self.stemmer.stem([token])[0]
+                self.cache.put(token, stem)
+            stems.append(stem)
+        return stems
+
+    def save(self):
+        self.cache.save()
+
+
+class Tokens(list):
+    """Tokens of a text with the lemmas from the same parse
+
+    Tokenizers that also lemmatize (spacy, stanza) return this so that stem() gets the lemmas
+    of the document that it is given rather than of the last document that was tokenized.
+    A slice is a plain list since its lemmas would no longer line up.
+    """
+
+    def __init__(self, tokens=(), lemmas=None):
+        super().__init__(tokens)
+        self.lemmas = lemmas
+
+
 class Tokenizer:
     """Tokenizer interface"""
 
@@ -89,6 +238,21 @@ class Tokenizer:
         """
         pass
 
+    def tokenize_batch(self, texts, batch_size=64, n_process=1):
+        """Tokenize a batch of texts
+
+        Tokenizers with a neural model override this to run the model on many texts at once.
+
+        Args:
+            texts (list of str)
+            batch_size (int): Number of texts given to the model at a time.
+            n_process (int): Number of processes for tokenizers that support it.
+
+        Returns:
+            list: A list of token lists in the same order as the texts
+        """
+        return [self.tokenize(text) for text in texts]
+
 
 class WhiteSpaceTokenizer(Tokenizer):
     def tokenize(self, text):
@@ -113,7 +277,12 @@ class MosesTokenizer(Tokenizer):
         self.nlp.enable_pipe("senter")
 
     def tokenize(self, text):
-        doc = self.nlp(text)
+        return self._get_tokens(self.nlp(text))
+
+    def tokenize_batch(self, texts, batch_size=64, n_process=1):
+        return [self._get_tokens(doc) for doc in self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)]
+
+    def _get_tokens(self, doc):
         tokens = itertools.chain.from_iterable(self.tokenizer.tokenize(sent, escape=False) for sent in doc.sents)
         return list(tokens)
 
@@ -136,33 +305,62 @@ class JiebaTokenizer(Tokenizer):
 class NgramTokenizer(Tokenizer):
     """Character ngram tokenizer
 
-    TODO: make the number of characters configurable
+    The ngrams do not cross sentences which are found with the spaCy sentence segmenter (spacy),
+    a rule-based splitter on sentence-ending punctuation and newlines (punct), or not at all (none).
     """
 
     # character ngram size by language
     cjk_codes = {'zho', 'jpn', 'kor'}
+    splits = {'spacy', 'punct', 'none'}
 
-    def __init__(self, lang, model_path):
+    # split after sentence-ending punctuation followed by spaces (not needed after CJK punctuation) and at newlines
+    SENTENCE_PATTERN = re.compile(r"(?<=[.!?\u061f\u06d4\u0964\u0965])[^\S\n]+|(?<=[\u3002\uff01\uff1f])[^\S\n]*|\s*\n\s*")
+
+    def __init__(self, lang, model_path, n=None, split='spacy'):
+        """
+        Args:
+            lang (str): ISO 639-3 language code
+            model_path (str|None): Path to model directory or None if default
+            n (int): Number of characters in an ngram. Default is 2 for CJK and 5 for other languages.
+            split (str): How the text is split into sentences: spacy, punct, or none.
+        """
         super().__init__(lang, model_path)
-        self.n = 2 if self.lang in self.cjk_codes else 5
-        # segment sentences with spaCy before create ngrams
-        self.nlp = SpacyModelLoader.get_loader(model_path).load('xx')
-        self.nlp.enable_pipe("senter")
+        if split not in self.splits:
+            raise ConfigError(f"Unknown ngram split: {split}")
+        self.n = n if n else 2 if self.lang in self.cjk_codes else 5
+        self.split = split
+        self.nlp = None
+        if split == 'spacy':
+            # segment sentences with spaCy before create ngrams
+            self.nlp = SpacyModelLoader.get_loader(model_path).load('xx')
+            self.nlp.enable_pipe("senter")
 
     def tokenize(self, text):
-        doc = self.nlp(text)
-        ngrams = itertools.chain.from_iterable(self._get_ngrams(sent) for sent in doc.sents)
-        return [''.join(x) for x in ngrams]
+        if self.nlp:
+            return self._get_tokens(str(sent) for sent in self.nlp(text).sents)
+        return self._get_tokens(self._split(text))
 
-    def _get_ngrams(self, text):
-        # create iterators over characters with an increasing offset and then zip to create ngrams
-        text = str(text)
-        return zip(*(itertools.islice(chars, offset, None) for offset, chars in enumerate(itertools.tee(text, self.n))))
+    def tokenize_batch(self, texts, batch_size=64, n_process=1):
+        if self.nlp:
+            docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+            return [self._get_tokens(str(sent) for sent in doc.sents) for doc in docs]
+        return [self._get_tokens(self._split(text)) for text in texts]
+
+    def _split(self, text):
+        if self.split == 'none':
+            return [text]
+        return self.SENTENCE_PATTERN.split(text.strip())
+
+    def _get_tokens(self, sentences):
+        n = self.n
+        return [sent[i:i + n] for sent in sentences for i in range(len(sent) - n + 1)]
 
 
 class StanzaNLP(Tokenizer, Stemmer):
     """Tokenizer that uses Stanford's stanza library"""
 
+    contextual = True
+
     lang_map = {
         'ara': 'ar',
         'eng': 'en',
@@ -171,19 +369,22 @@ class StanzaNLP(Tokenizer, Stemmer):
         'zho': 'zh-hans',
     }
 
-    def __init__(self, lang, model_path, stem):
+    def __init__(self, lang, model_path, stem, config=None):
         """
         Args:
             lang (str): ISO 639-3 language code.
             model_path (str): Path to stanza model directory.
             stem (bool): Whether to stem the tokens.
+            config (StanzaConfig): Optional package, threading, and batch settings.
         """
         Stemmer.__init__(self, lang)
         Tokenizer.__init__(self, lang, model_path)
         import stanza  # lazy load stanza when needed
-        import torch
-        torch.set_num_threads(1)  # TODO make this configurable
+        config = config if config else StanzaConfig()
+        self._set_threads(config)
         self.lang = self.lang_map[self.lang]
+        self.stanza = stanza
+        self.lemmatize = stem and self.lang != 'zh-hans'
         self._setup_logging()
         buffer = io.StringIO()
         with contextlib.redirect_stderr(buffer):
@@ -195,43 +396,78 @@ class StanzaNLP(Tokenizer, Stemmer):
                     raise ConfigError(msg)
             if self.lang == 'zh-hans':
                 processors = 'tokenize'
-                package = 'default'
             elif stem:
                 processors = 'tokenize,lemma'
-                package = 'default'
             else:
                 processors = 'tokenize'
-                package = 'default'
+            options = {'tokenize_pretokenized': config.pretokenized}
+            if config.tokenize_batch_size:
+                options['tokenize_batch_size'] = config.tokenize_batch_size
+            if config.lemma_batch_size:
+                options['lemma_batch_size'] = config.lemma_batch_size
             # self.nlp = stanza.Pipeline(self.lang, processors=processors, package=package, dir=str(self.model_path))
-            self.nlp = stanza.Pipeline(self.lang, processors=processors, package=package)
-            self.cache = None
+            self.nlp = stanza.Pipeline(self.lang, processors=processors, package=config.package, **options)
         LOGGER.debug(buffer.getvalue())
 
     def tokenize(self, text):
-        doc = self.nlp(text)
-        self.cache = doc  # cache the document for the stem method to pick up
-        tokens = []
-        for sentence in doc.sentences:
-            for word in sentence.words:
-                tokens.append(word.text)
-        return tokens
+        return self._get_tokens(self.nlp(text))
+
+    def tokenize_batch(self, texts, batch_size=64, n_process=1):
+        # stanza batches the sentences of all the documents that it is given together
+        results = []
+        for start in range(0, len(texts), batch_size):
+            docs = [self.stanza.Document([], text=text) for text in texts[start:start + batch_size]]
+            results.extend(self._get_tokens(doc) for doc in self.nlp(docs))
+        return results
 
     ARABIC_DIACRITICS = {'\u064b', '\u064c', '\u064d', '\u064e', '\u064f', '\u0650', '\u0651', '\u0652'}
     diacritic_remove = str.maketrans('', '', ''.join(ARABIC_DIACRITICS))
 
     def stem(self, tokens):
-        tokens = []
-        for sentence in self.cache.sentences:
-            for token in sentence.words:
-                if token.lemma:
-                    # TODO Persian lemmas sometimes have # characters in them
-                    if self.lang == 'ar':
-                        # Arabic lemmas have full diacritization
-                        token.lemma = token.lemma.translate(self.diacritic_remove)
-                    tokens.append(token.lemma)
-                else:
-                    tokens.append(token.text)
-        return tokens
+        if not self.lemmatize:
+            return list(tokens)
+        lemmas = getattr(tokens, 'lemmas', None)
+        if lemmas is None:
+            # tokens that did not come from tokenize() are lemmatized as they are so there is a lemma per token
+            if not tokens:
+                return []
+            doc = self.stanza.Document([[{'id': index + 1, 'text': token} for index, token in enumerate(tokens)]])
+            doc = self.nlp.processors['lemma'].process(doc)
+            lemmas = [self._get_lemma(word) for sentence in doc.sentences for word in sentence.words]
+        return list(lemmas)
+
+    def _get_tokens(self, doc):
+        words = [word for sentence in doc.sentences for word in sentence.words]
+        lemmas = [self._get_lemma(word) for word in words] if self.lemmatize else None
+        return Tokens((word.text for word in words), lemmas)
+
+    def _get_lemma(self, word):
+        if not word.lemma:
+            return word.text
+        # TODO Persian lemmas sometimes have # characters in them
+        if self.lang == 'ar':
+            # Arabic lemmas have full diacritization
+            return word.lemma.translate(self.diacritic_remove)
+        return word.lemma
+
+    @staticmethod
+    def _set_threads(config):
+        """Set the torch threads without oversubscribing the CPUs shared with other workers"""
+        import torch
+        share = get_cpu_share()
+        threads = config.threads if config.threads else share
+        if threads > share:
+            LOGGER.warning(f"Reducing the torch threads from {threads} to {share} so the workers do not "
+                           f"oversubscribe the {get_cpu_count()} CPUs")
+            threads = share
+        torch.set_num_threads(threads)
+        if config.interop_threads:
+            try:
+                torch.set_num_interop_threads(min(config.interop_threads, share))
+            except RuntimeError:
+                # torch only allows this to be set once and before any parallel work has started
+                LOGGER.debug("The torch inter-op threads were already set")
+        LOGGER.debug(f"Using {threads} torch threads")
 
     @staticmethod
     def _setup_logging():
@@ -276,6 +512,8 @@ class SpacyModelLoader:
 
     exclude = ['ner', 'parser']
     disable = ['tok2vec', 'tagger', 'attribute_ruler', 'lemmatizer', 'morphologizer']
+    # the models of these languages configure segmenters that need extra packages
+    model_tokenizers = {'ja', 'zh'}
 
     loaders = {}
 
@@ -301,6 +539,7 @@ class SpacyModelLoader:
             model_path (Path|None): Path to spacy model directory or None for default.
         """
         self.models = {}
+        self.blanks = {}
         self.model_path = model_path
 
     def load(self, lang):
@@ -308,13 +547,7 @@ class SpacyModelLoader:
         if lang in self.models:
             return self.models[lang]
 
-        if lang == 'xx':
-            # multi-language model
-            iso_639_1 = 'xx'
-        else:
-            iso_639_1 = LangStandardizer.iso_639_1(lang)
-        if iso_639_1 not in self.model_map:
-            iso_639_1 = 'xx'  # fallback to multi-language model
+        iso_639_1 = self._get_model_lang(lang)
         import spacy  # lazy load spacy when needed
         if self.model_path:
             raise NotImplementedError("Spacy model loading from a directory is not available yet")
@@ -329,6 +562,33 @@ class SpacyModelLoader:
         self.models[lang] = nlp
         return nlp
 
+    def load_blank(self, lang):
+        """Load a pipeline with only the tokenizer rules of the language's model (or return cached pipeline)
+
+        This loads in milliseconds without the memory of the model's components.
+        For the languages whose model configures its own segmenter, this returns the model.
+        """
+        if lang in self.blanks:
+            return self.blanks[lang]
+
+        iso_639_1 = self._get_model_lang(lang)
+        if iso_639_1 in self.model_tokenizers:
+            return self.load(lang)
+        import spacy  # lazy load spacy when needed
+        # languages without a model use the multi-language rules like the multi-language model
+        nlp = spacy.blank(iso_639_1)
+        self.blanks[lang] = nlp
+        return nlp
+
+    def _get_model_lang(self, lang):
+        if lang == 'xx':
+            # multi-language model
+            return 'xx'
+        iso_639_1 = LangStandardizer.iso_639_1(lang)
+        if iso_639_1 not in self.model_map:
+            iso_639_1 = 'xx'  # fallback to multi-language model
+        return iso_639_1
+
 
 def handle_unnamed(function):
     # if unnamed unicode character is passed, return False rather throw exception
@@ -343,19 +603,22 @@ def handle_unnamed(function):
 
 class SpacyNLP(Tokenizer, Stemmer):
     """Tokenizer and optional stemmer that uses the spaCy package"""
+    contextual = True
     _pymorphy_updated = False
 
-    def __init__(self, lang, model_path, stem):
+    def __init__(self, lang, model_path, stem, blank=False):
         """
         Args:
             lang (str): Language code.
             model_path (str|None): Path to stored models.
             stem (bool): Whether to stem the tokens.
+            blank (bool): Whether to only load the tokenizer when not stemming.
         """
         Stemmer.__init__(self, lang)
         Tokenizer.__init__(self, lang, model_path)
-        self.nlp = SpacyModelLoader.get_loader(self.model_path).load(self.lang)
-        self.cache = None
+        loader = SpacyModelLoader.get_loader(self.model_path)
+        self.nlp = loader.load_blank(self.lang) if blank and not stem else loader.load(self.lang)
+        self.lemmatize = stem
         if stem:
             # to do - figure out why this is commented out
             # if self.lang in ['ar', 'fa', 'zh']:
@@ -371,13 +634,33 @@ class SpacyNLP(Tokenizer, Stemmer):
             self._fix_pymorphy2()
 
     def tokenize(self, text):
-        tokens = self.nlp(text)
-        self.cache = tokens
-        return [str(token) for token in tokens]
+        if not self.lemmatize:
+            # the other components are disabled so this skips the overhead of the pipeline
+            return self._get_tokens(self.nlp.tokenizer(text))
+        return self._get_tokens(self.nlp(text))
+
+    def tokenize_batch(self, texts, batch_size=64, n_process=1):
+        if not self.lemmatize and n_process == 1:
+            docs = self.nlp.tokenizer.pipe(texts, batch_size=batch_size)
+        else:
+            docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        return [self._get_tokens(doc) for doc in docs]
 
     def stem(self, tokens):
-        tokens = self.cache
-        return [token.lemma_ if token.lemma_ else token.text for token in tokens]
+        lemmas = getattr(tokens, 'lemmas', None)
+        if lemmas is None:
+            # tokens that did not come from tokenize() are lemmatized as they are
+            import spacy.tokens
+            lemmas = self._get_lemmas(self.nlp(spacy.tokens.Doc(self.nlp.vocab, words=list(tokens))))
+        return list(lemmas)
+
+    def _get_tokens(self, doc):
+        lemmas = self._get_lemmas(doc) if self.lemmatize else None
+        return Tokens((token.text for token in doc), lemmas)
+
+    @staticmethod
+    def _get_lemmas(doc):
+        return [token.lemma_ if token.lemma_ else token.text for token in doc]
 
     def _fix_pymorphy2(self):
         import pymorphy2.shapes
@@ -424,6 +707,7 @@ class StopWordsRemover:
         Returns
             list of str
         """
+        indices = set(indices)
         return [token for index, token in enumerate(tokens) if index not in indices]
 
 
@@ -452,6 +736,11 @@ class TokenizerStemmerFactory:
             raise ConfigError(f"Unknown tokenizer {config.tokenize}")
         if config.stem and config.stem not in cls.stemmers:
             raise ConfigError(f"Unknown stemmer {config.stem}")
+        if config.tokenize == 'ngram':
+            if config.ngram.split not in NgramTokenizer.splits:
+                raise ConfigError(f"Unknown ngram split: {config.ngram.split}")
+            if config.ngram.n is not None and config.ngram.n < 1:
+                raise ConfigError("ngram n must be at least 1")
         if config.stem:
             if config.tokenize == 'ngram':
                 raise ConfigError("ngram tokenizer not compatible with stemming")
@@ -471,21 +760,29 @@ class TokenizerStemmerFactory:
             Tokenizer
         """
         key = f"{config.tokenize}:{lang}"
+        if config.tokenize == 'stanza':
+            # stanza pipelines with different settings are not interchangeable
+            key += f":{config.stanza.json()}"
+        elif config.tokenize == 'spacy':
+            # a blank pipeline cannot lemmatize
+            key += f":{config.stem == 'spacy'}:{config.spacy.json()}"
+        elif config.tokenize == 'ngram':
+            key += f":{config.ngram.json()}"
         if key in cls.tokenizer_cache:
             return cls.tokenizer_cache[key]
 
         if config.tokenize in ['spacy', 'stanza']:
             also_stemmer = config.stem == config.tokenize
             if config.tokenize == 'spacy':
-                tokenizer = SpacyNLP(lang, config.model_path, stem=also_stemmer)
+                tokenizer = SpacyNLP(lang, config.model_path, stem=also_stemmer, blank=config.spacy.blank)
             else:
-                tokenizer = StanzaNLP(lang, config.model_path, stem=also_stemmer)
+                tokenizer = StanzaNLP(lang, config.model_path, stem=also_stemmer, config=config.stanza)
         elif config.tokenize == 'jieba':
             tokenizer = JiebaTokenizer(lang, config.model_path)
         elif config.tokenize == 'moses':
             tokenizer = MosesTokenizer(lang, config.model_path)
         elif config.tokenize == 'ngram':
-            tokenizer = NgramTokenizer(lang, config.model_path)
+            tokenizer = NgramTokenizer(lang, config.model_path, config.ngram.n, config.ngram.split)
         elif config.tokenize == 'whitespace':
             tokenizer = WhiteSpaceTokenizer(lang, config.model_path)
         else:
@@ -519,6 +816,9 @@ class TokenizerStemmerFactory:
             stemmer = PorterStemmer(lang)
         elif stemmer_name == 'parsivar':
             stemmer = FarsiStemmer(lang)
+        if stemmer and config.stem_cache and config.stem_cache.size:
+            cache = StemCache.get_cache(stemmer_name, lang, config.stem_cache.size, config.stem_cache.persist)
+            stemmer = CachedStemmer(stemmer, cache)
 
         cls.stemmer_cache[key] = stemmer
         return stemmer
@@ -529,6 +829,8 @@ class TextProcessor(Task):
 
     Used on both documents and queries.
     """
+    parallel = True
+
     def __init__(self, run_path, config, lang):
         """
         Args:
@@ -544,6 +846,7 @@ class TextProcessor(Task):
         self.tokenizer = None
         self.stemmer = None
         self.stopword_remover = None
+        self.fused = False
 
     def begin(self):
         self.normalizer = NormalizerFactory.create(self.lang, self.processor_config.normalize)
@@ -551,13 +854,57 @@ class TextProcessor(Task):
         self.stemmer = TokenizerStemmerFactory.create_stemmer(self.processor_config, self.lang)
         if self.processor_config.stopwords:
             self.stopword_remover = StopWordsRemover(self.processor_config.stopwords, self.lang)
+        # the fused pass lowercases each token which is only the same as post_normalize() for the generic version
+        self.fused = type(self.normalizer).post_normalize is GenericNormalizer.post_normalize and \
+            type(self.stopword_remover) in (StopWordsRemover, type(None))
 
     def process(self, item):
         """Child classes will override this"""
         return item
 
-    def pre_normalize(self, text):
-        return self.normalizer.pre_normalize(text)
+    def end(self):
+        super().end()
+        if isinstance(self.stemmer, CachedStemmer):
+            self.stemmer.save()
+
+    def process_tokens(self, tokens):
+        """Remove stop words, stem, and post-normalize the tokens
+
+        This is done in a single pass over the tokens with the stop words checked against a set.
+        Token-level stemmers only stem the tokens that are not stop words.
+
+        Args:
+            tokens (list of str)
+
+        Returns:
+            str: The processed tokens joined by spaces.
+        """
+        if not self.fused:
+            return self._process_tokens_in_steps(tokens)
+        lowercase = self.normalizer.config.lowercase
+        contextual = self.stemmer is not None and self.stemmer.contextual
+        # lemmas depend on the surrounding tokens so all the tokens are lemmatized
+        words = self.stemmer.stem(tokens) if contextual else tokens
+        if self.stopword_remover:
+            stop_words = self.stopword_remover.stop_words
+            if self.stemmer is None and lowercase:
+                # the lowercased tokens of the stop word check are the output
+                return ' '.join(token for token in map(str.lower, tokens) if token not in stop_words)
+            words = [word for token, word in zip(tokens, words) if token.lower() not in stop_words]
+        if self.stemmer is not None and not contextual:
+            words = self.stemmer.stem(words)
+        if lowercase:
+            return ' '.join(word.lower() for word in words)
+        return ' '.join(words)
+
+    def _process_tokens_in_steps(self, tokens):
+        stopword_indices = self.identify_stop_words(tokens)
+        tokens = self.stem(tokens)
+        tokens = self.remove_stop_words(tokens, stopword_indices)
+        return self.post_normalize(' '.join(tokens))
+
+    def pre_normalize(self, text, changes=None):
+        return self.normalizer.pre_normalize(text, changes)
 
     def post_normalize(self, text):
         return self.normalizer.post_normalize(text)
@@ -565,6 +912,11 @@ class TextProcessor(Task):
     def tokenize(self, text):
         return self.tokenizer.tokenize(text)
 
+    def tokenize_batch(self, texts):
+        # spacy's processes share the CPUs with any other workers
+        n_process = min(self.processor_config.n_process, get_cpu_share())
+        return self.tokenizer.tokenize_batch(texts, self.processor_config.batch_size, n_process)
+
     def identify_stop_words(self, tokens, is_lower=False):
         if self.stopword_remover:
             return self.stopword_remover.identify(tokens, is_lower)
@@ -14,7 +14,7 @@ from .pipeline import Task
 from .schema import TextProcessorConfig, TopicsInputConfig
 from .text import TextProcessor
 from .util import DataclassJSONEncoder, InputIterator, LangStandardizer, NoGlobSupport, ReaderFactory
-from .util.file import count_lines, count_lines_with, path_append
+from .util.file import count_lines, count_lines_with, open_output, path_append, sync_output
 from .util.formats import parse_xml_topics, parse_sgml_topics, parse_psq_table
 from .util.java import Java
 
@@ -55,6 +55,8 @@ class TopicReaderFactory(ReaderFactory):
 class TopicProcessor(Task):
     """Topic Preprocessing"""
 
+    parallel = True
+
     FIELD_MAP = {
         'title': 'title',
         'name': 'title',
@@ -275,6 +277,9 @@ class IRDSTopicReader(InputIterator, NoGlobSupport):
 class QueryWriter(Task):
     """Write queries to a jsonl file using internal format"""
 
+    sink = True
+    independent_reduce = True
+
     def __init__(self, run_path, config, artifact_config):
         """
         Args:
@@ -283,8 +288,18 @@ class QueryWriter(Task):
             artifact_config (BaseConfig or None): Config that resulted in this artifact
         """
         super().__init__(run_path, artifact_config, base=config.output)
-        path = self.base / 'queries.jsonl'
-        self.file = open(path, 'w')
+        self.path = self.base / 'queries.jsonl'
+        self.file = None
+        self.offset = None
+
+    def begin(self):
+        self.file = open_output(self.path, self.offset)
+
+    def checkpoint(self):
+        return {'offset': sync_output(self.file)}
+
+    def restore(self, state):
+        self.offset = state['offset']
 
     def process(self, query):
         """
@@ -352,10 +367,7 @@ class QueryGenerator:
         Returns:
             Query object
         """
-        stopword_indices = self.processor.identify_stop_words(tokens)
-        tokens = self.processor.stem(tokens)
-        tokens = self.processor.remove_stop_words(tokens, stopword_indices)
-        query_syntax = self.processor.post_normalize(' '.join(tokens))
+        query_syntax = self.processor.process_tokens(tokens)
         return Query(query.id, query.lang, query_syntax, text, query.report)
 
 
@@ -372,11 +384,7 @@ class LuceneTransformer(luqum.visitor.TreeTransformer):
         if isinstance(node.expr, luqum.tree.Phrase):
             value = value.strip('"')
         # this handles single terms and phrases
-        tokens = value.split()
-        stopword_indices = self.processor.identify_stop_words(tokens)
-        tokens = self.processor.stem(tokens)
-        tokens = self.processor.remove_stop_words(tokens, stopword_indices)
-        new_value = self.processor.post_normalize(' '.join(tokens))
+        new_value = self.processor.process_tokens(value.split())
         if isinstance(node.expr, luqum.tree.Phrase):
             new_value = f'"{new_value}"'
         new_node.expr = node.expr.clone_item(value=new_value)
@@ -423,10 +431,16 @@ class PSQToken:
 class PSQGenerator(QueryGenerator):
     """Generate a PSQ"""
 
+    # parsed tables are kept for the later jobs run by a worker process
+    table_cache = {}
+
     def __init__(self, processor, psq_path, threshold):
         super().__init__(processor)
         try:
-            self.psq_table = parse_psq_table(psq_path, threshold)
+            key = (str(psq_path), threshold, pathlib.Path(psq_path).stat().st_mtime)
+            if key not in self.table_cache:
+                self.table_cache[key] = parse_psq_table(psq_path, threshold)
+            self.psq_table = self.table_cache[key]
         except OSError as e:
             raise ConfigError(f"Unable to load PSQ translation table: {e}")
 
@@ -546,3 +560,16 @@ class QueryProcessor(TextProcessor):
         text = self.pre_normalize(text)
         tokens = self.tokenize(text)
         return self.generator.generate(query, text, tokens)
+
+    def batch_process(self, queries):
+        """Tokenize the batch at once so that spacy and stanza can batch their models
+
+        Args:
+            queries (list of Query)
+
+        Returns
+            list of Query
+        """
+        texts = [self.pre_normalize(query.text) for query in queries]
+        tokens = self.tokenize_batch(texts)
+        return [self.generator.generate(*args) for args in zip(queries, texts, tokens)]
@@ -3,17 +3,20 @@ import collections.abc
 import contextlib
 import dataclasses
 import glob
+import heapq
 import itertools
 import json
 import logging
+import math
+import queue
 import sys
+import threading
 import timeit
 
-import more_itertools
 import pycountry
 
 from ..error import BadDataError, ConfigError
-from .file import validate_encoding
+from .file import get_record_index, validate_encoding
 
 
 def get_logger(name):
@@ -78,15 +81,20 @@ class ComponentFactory:
 class ReaderFactory(ComponentFactory):
     """Same as ComponentFactory but wrapped in a GlobIterator"""
     @classmethod
-    def create(cls, config, *args, **kwargs):
+    def create(cls, config, *args, segments=None, **kwargs):
         """
         Args:
             config (DocumentsInputConfig or TopicsInputConfig)
+            segments (list): Optional list of Segment objects from a ShardManifest to read instead of the paths.
         """
         validate_encoding(config.encoding)
         reader_cls = cls._get_class(config)
         # support passing additional args to reader constructors
         args = {key: value for key, value in config.dict().items() if key not in ['format', 'path', 'encoding', 'lang']}
+        if segments is not None:
+            if not issubclass(reader_cls, SeekableInput):
+                raise ConfigError(f"{reader_cls.__name__} does not support shard manifests")
+            return ShardIterator(segments, reader_cls, config.encoding, config.lang, **args)
         if issubclass(reader_cls, NoGlobSupport):
             return reader_cls(config.path, config.encoding, config.lang, **args)
         return GlobIterator(config.path, reader_cls, config.encoding, config.lang, **args)
@@ -131,9 +139,11 @@ class InputIterator(abc.ABC, collections.abc.Iterator, collections.abc.Sized):
 
 
 class TimedIterator(collections.abc.Iterator):
-    def __init__(self, iterator):
+    """Iterator that records the time and per-item metrics of reading from another iterator"""
+    def __init__(self, iterator, slow_threshold=None):
         self.iterator = iterator
         self.timer = Timer()
+        self.metrics = TaskMetrics(str(iterator), slow_threshold)
 
     @property
     def time(self):
@@ -143,39 +153,342 @@ class TimedIterator(collections.abc.Iterator):
         return str(self.iterator)
 
     def __next__(self):
-        with self.timer:
-            return next(self.iterator)
+        start = timeit.default_timer()
+        item = next(self.iterator)
+        elapsed = timeit.default_timer() - start
+        self.timer.time += elapsed
+        # the input is measured once here and the tasks downstream reuse the figure
+        if isinstance(item, list):
+            # chunked input for a batch pipeline
+            size = getattr(self.iterator, 'size', None)
+            if size is None:
+                size = sum(get_item_size(x) for x in item)
+            self.metrics.add_batch(elapsed, item, size)
+        else:
+            self.metrics.add(elapsed, item, get_item_size(item))
+        return item
 
     def __len__(self):
         return len(self.iterator)
 
 
+class LatencyHistogram:
+    """Histogram of latencies with logarithmic buckets that can be merged across processes
+
+    Each bucket covers about 19% of its lower bound so percentiles are approximate,
+    but the memory use is constant and merging is adding the bucket counts.
+    """
+
+    BASE = 2 ** 0.25
+    MIN = 1e-7  # latencies below 100 nanoseconds go into the first bucket
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds, n=1):
+        """Record n items that each took this many seconds"""
+        index = math.floor(math.log(max(seconds, self.MIN), self.BASE))
+        self.buckets[index] += n
+        self.count += n
+        self.total += n * seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """Get the upper bound of the bucket containing the pth percentile (0 <= p <= 100)"""
+        if not self.count:
+            return 0
+        rank = math.ceil(p / 100 * self.count)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.BASE ** (index + 1), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {str(index): count for index, count in sorted(self.buckets.items())}
+
+    @classmethod
+    def from_dict(cls, data, total=0, max_time=0):
+        histogram = cls()
+        histogram.buckets.update({int(index): count for index, count in data.items()})
+        histogram.count = sum(histogram.buckets.values())
+        histogram.total = total
+        histogram.max = max_time
+        return histogram
+
+
+class SlowItemLog:
+    """Keeps the ids of the slowest items that took longer than a threshold"""
+
+    def __init__(self, threshold, size=100):
+        """
+        Args:
+            threshold (float): Items that take longer than this many seconds are logged.
+            size (int): Maximum number of items to keep.
+        """
+        self.threshold = threshold
+        self.size = size
+        self.heap = []
+
+    def add(self, seconds, item_id):
+        if self.threshold is None or seconds < self.threshold:
+            return
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (seconds, str(item_id)))
+        else:
+            heapq.heappushpop(self.heap, (seconds, str(item_id)))
+
+    def merge(self, other):
+        for seconds, item_id in other.heap:
+            self.add(seconds, item_id)
+
+    @property
+    def items(self):
+        """List of (id, seconds) with the slowest first"""
+        return [(item_id, seconds) for seconds, item_id in sorted(self.heap, reverse=True)]
+
+
+def get_item_id(item):
+    """Get the doc or query id of an item passing through a pipeline or None"""
+    if hasattr(item, 'id'):
+        return item.id
+    query = getattr(item, 'query', None)
+    return getattr(query, 'id', None)
+
+
+def get_item_size(item):
+    """Get the size in bytes of the text of an item passing through a pipeline"""
+    text = getattr(item, 'text', None)
+    if text is None:
+        text = getattr(item, 'title', None)
+    return len(text.encode('utf8')) if isinstance(text, str) else 0
+
+
+class TaskMetrics:
+    """Per-item latency histogram, throughput, and slow items for a task or iterator"""
+
+    def __init__(self, name, slow_threshold=None):
+        """
+        Args:
+            name (str): Name of the task.
+            slow_threshold (float): Seconds above which an item is recorded in the slow item log.
+        """
+        self.name = name
+        self.count = 0
+        self.bytes = 0
+        self.histogram = LatencyHistogram()
+        self.slow = SlowItemLog(slow_threshold)
+
+    def add(self, seconds, item, size=0):
+        """Record the time to process an item and the bytes of its text if measured by the caller"""
+        self.count += 1
+        self.bytes += size
+        self.histogram.add(seconds)
+        self.slow.add(seconds, get_item_id(item))
+
+    def add_batch(self, seconds, items, size=0):
+        """Record the time to process a batch with the time split evenly over the items"""
+        if not items:
+            return
+        self.count += len(items)
+        self.bytes += size
+        self.histogram.add(seconds / len(items), len(items))
+        # a single item cannot be blamed for a slow batch
+        if len(items) == 1:
+            self.slow.add(seconds, get_item_id(items[0]))
+
+    def merge(self, other):
+        self.count += other.count
+        self.bytes += other.bytes
+        self.histogram.merge(other.histogram)
+        self.slow.merge(other.slow)
+
+    @property
+    def report(self):
+        time = self.histogram.total
+        return {
+            'name': self.name,
+            'count': self.count,
+            'time': time,
+            'items_per_sec': self.count / time if time else 0,
+            'bytes': self.bytes,
+            'bytes_per_sec': self.bytes / time if time else 0,
+            'latency': {
+                'mean': time / self.count if self.count else 0,
+                'p50': self.histogram.percentile(50),
+                'p90': self.histogram.percentile(90),
+                'p99': self.histogram.percentile(99),
+                'max': self.histogram.max,
+            },
+            'histogram': self.histogram.to_dict(),
+            'slow_items': self.slow.items,
+        }
+
+    @classmethod
+    def from_report(cls, report, slow_size=100):
+        """Rebuild metrics from a report so that reports from separate processes can be merged"""
+        metrics = cls(report['name'])
+        metrics.count = report['count']
+        metrics.bytes = report['bytes']
+        metrics.histogram = LatencyHistogram.from_dict(report['histogram'], report['time'], report['latency']['max'])
+        # the threshold was applied when the items were logged
+        metrics.slow = SlowItemLog(0, slow_size)
+        for item_id, seconds in report['slow_items']:
+            metrics.slow.add(seconds, item_id)
+        return metrics
+
+
+class MonitoredQueue(queue.Queue):
+    """Bounded queue that records how full it gets and how long producers and consumers block
+
+    If the consumer is often waiting, the producer side is the bottleneck (I/O bound reading).
+    If the producer is often waiting, the consumer side is the bottleneck (CPU bound processing).
+    """
+
+    def __init__(self, name, maxsize):
+        """
+        Args:
+            name (str): Name of the queue for reporting.
+            maxsize (int): Maximum number of items in the queue.
+        """
+        super().__init__(maxsize)
+        self.name = name
+        self.put_timer = Timer()
+        self.get_timer = Timer()
+        self.max_depth = 0
+        self.total_depth = 0
+        self.num_gets = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.put_timer:
+            super().put(item, block, timeout)
+
+    def get(self, block=True, timeout=None):
+        depth = self.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        self.num_gets += 1
+        with self.get_timer:
+            return super().get(block, timeout)
+
+    @property
+    def report(self):
+        return {
+            'name': self.name,
+            'size': self.maxsize,
+            'max_depth': self.max_depth,
+            'mean_depth': self.total_depth / self.num_gets if self.num_gets else 0,
+            'gets': self.num_gets,
+            'producer_wait': self.put_timer.time,
+            'consumer_wait': self.get_timer.time,
+        }
+
+
+class PrefetchIterator(collections.abc.Iterator):
+    """Reads ahead from an iterator in a thread and buffers the items in a bounded queue
+
+    The thread is started on the first call to next() so that len() does not trigger reading.
+    """
+
+    _STOP = object()
+
+    def __init__(self, iterator, size):
+        """
+        Args:
+            iterator (iterator): Iterator to read from.
+            size (int): Maximum number of items to read ahead.
+        """
+        self.iterator = iterator
+        self.queue = MonitoredQueue('reader', size)
+        self.thread = None
+        self.error = None
+        self.done = False
+
+    @property
+    def time(self):
+        return self.iterator.time
+
+    @property
+    def metrics(self):
+        return self.iterator.metrics
+
+    def __str__(self):
+        return str(self.iterator)
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration()
+        if not self.thread:
+            self.thread = threading.Thread(target=self._read, daemon=True)
+            self.thread.start()
+        item = self.queue.get()
+        if item is self._STOP:
+            self.done = True
+            self.thread.join()
+            if self.error:
+                raise self.error
+            raise StopIteration()
+        return item
+
+    def __len__(self):
+        return len(self.iterator)
+
+    def _read(self):
+        try:
+            for item in self.iterator:
+                self.queue.put(item)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.queue.put(self._STOP)
+
+
 class ChunkedIterator(InputIterator):
-    """Iterate over iterable in chunks of size n"""
+    """Iterate over iterable in chunks of size n or with a byte budget per chunk"""
 
-    def __init__(self, iterable, n):
+    def __init__(self, iterable, n, max_bytes=None):
         """
         Args:
             iterable (iterable)
             n (int): chunk size or None to consume the entire iterable in a single chunk
+            max_bytes (int): optional maximum bytes of text in a chunk (a chunk always has at least one item)
         """
         self.iterable = iterable
-        self.chunked = more_itertools.chunked(iterable, n)
+        self.iterator = iter(iterable)
         self.n = n
-        self.done = False
+        self.max_bytes = max_bytes
+        self.size = 0  # bytes of text in the last chunk
+        self.started = False
 
     def __str__(self):
         return self.iterable.__class__.__name__
 
     def __next__(self):
-        if not self.n:  # single chunk
-            if not self.done:
-                self.done = True
-                return [x for x in self.iterable]
-            else:
-                raise StopIteration()
-        else:
-            return next(self.chunked)
+        chunk = []
+        size = 0
+        for item in self.iterator:
+            chunk.append(item)
+            size += get_item_size(item)
+            if self.n and len(chunk) >= self.n:
+                break
+            if self.max_bytes and size >= self.max_bytes:
+                break
+        # a single chunk of everything is returned even if the iterable is empty
+        if not chunk and (self.n or self.started):
+            raise StopIteration()
+        self.started = True
+        self.size = size
+        return chunk
 
     def __len__(self):
         return len(self.iterable)
@@ -219,6 +532,14 @@ class NoGlobSupport:
     pass
 
 
+class SeekableInput:
+    """Indicate that this iterator can start at a byte offset in its file and read a number of records
+
+    The constructor must accept offset and count keyword arguments.
+    """
+    record_marker = None  # records start on lines that contain this string or on every line if None
+
+
 class GlobIterator(InputIterator):
     """
     You have a callable that returns an iterator over items given a file.
@@ -279,6 +600,11 @@ class GlobIterator(InputIterator):
     def __str__(self):
         return str(self.cls.__name__)
 
+    @property
+    def files(self):
+        """List of the files in the order that they are read"""
+        return [path for pattern in self.original_globs for path in sorted(glob.glob(pattern))]
+
     def skip(self, start):
         # TODO replace the skip to starting position with something more efficient
         if start:
@@ -301,6 +627,157 @@ class GlobIterator(InputIterator):
                 raise ConfigError(f"No files match pattern '{pattern}'")
 
 
+@dataclasses.dataclass
+class Segment:
+    """A run of records in a file"""
+    path: str
+    offset: int  # byte offset of the first record
+    count: int  # number of records
+
+
+class ShardManifest:
+    """Splits the input files into shards where a shard is a list of file segments
+
+    This is created from a pass over the bytes of the files (cached across runs) so that parallel jobs
+    can seek to their shard rather than parsing and discarding the documents before it.
+    Shard boundaries fall on the records in the sparse index of each file
+    so the shards of large files are approximately equal.
+    """
+
+    def __init__(self, shards):
+        """
+        Args:
+            shards (list): List of lists of Segment objects.
+        """
+        self.shards = shards
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __getitem__(self, index):
+        return self.shards[index]
+
+    @property
+    def count(self):
+        """Total number of records"""
+        return sum(segment.count for shard in self.shards for segment in shard)
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.shards, fp, cls=DataclassJSONEncoder)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            shards = json.load(fp)
+        return cls([[Segment(**segment) for segment in shard] for shard in shards])
+
+    @classmethod
+    def create(cls, paths, marker=None, encoding='utf8', num_shards=None, shard_size=None):
+        """Create a manifest with num_shards shards of equal record counts or shards of shard_size bytes
+
+        Args:
+            paths (list): Files in the order they are read.
+            marker (str): Records start on lines containing this string or every line if None.
+            encoding (str): Encoding of the files.
+            num_shards (int): Number of shards.
+            shard_size (int): Bytes per shard (used if num_shards is not set).
+
+        Returns:
+            ShardManifest
+        """
+        files = [(str(path), get_record_index(path, marker, encoding)) for path in paths]
+        if num_shards:
+            threshold = int(math.ceil(sum(index.count for _, index in files) / num_shards))
+        else:
+            threshold = shard_size
+        shards = []
+        shard = []
+        total = 0
+        for path, index in files:
+            start = None
+            count = 0
+            offsets = index.offsets
+            for i, offset in enumerate(offsets):
+                if start is None:
+                    start = offset
+                # each offset in the sparse index starts a block of interval records
+                block_count = min(index.interval, index.count - i * index.interval)
+                count += block_count
+                if num_shards:
+                    total += block_count
+                else:
+                    total += (offsets[i + 1] if i + 1 < len(offsets) else index.end) - offset
+                if total >= threshold:
+                    shard.append(Segment(path, start, count))
+                    shards.append(shard)
+                    shard = []
+                    total = 0
+                    start = None
+                    count = 0
+            if count:
+                shard.append(Segment(path, start, count))
+        if shard:
+            shards.append(shard)
+        return cls(shards)
+
+    @classmethod
+    def from_iterator(cls, iterator, num_shards=None, shard_size=None):
+        """Create a manifest for the input of a pipeline
+
+        Args:
+            iterator (iterator): Input iterator possibly wrapped by the pipeline.
+            num_shards (int): Number of shards.
+            shard_size (int): Bytes per shard (used if num_shards is not set).
+
+        Returns:
+            ShardManifest or None if the input does not support seeking
+        """
+        # remove the wrappers that the job builder and pipeline add
+        while isinstance(iterator, (TimedIterator, PrefetchIterator, SlicedIterator)):
+            iterator = iterator.original_iterator if isinstance(iterator, SlicedIterator) else iterator.iterator
+        if isinstance(iterator, GlobIterator) and issubclass(iterator.cls, SeekableInput):
+            encoding = iterator.args[0] if iterator.args else 'utf8'
+            return cls.create(iterator.files, iterator.cls.record_marker, encoding, num_shards, shard_size)
+        if isinstance(iterator, SeekableInput):
+            return cls.create([iterator.path], iterator.record_marker, iterator.encoding, num_shards, shard_size)
+        return None
+
+
+class ShardIterator(InputIterator):
+    """Iterate over the records in a shard of a ShardManifest"""
+
+    def __init__(self, segments, cls, *args, **kwargs):
+        """
+        Args:
+            segments (list): List of Segment objects.
+            cls (class): InputIterator class that is a SeekableInput.
+            *args: variable length arguments for the iterator class
+            **kwargs: keyword arguments for the iterator class
+        """
+        self.segments = segments
+        self.cls = cls
+        self.args = args
+        self.kwargs = kwargs
+        self.iterators = (cls(segment.path, *args, offset=segment.offset, count=segment.count, **kwargs)
+                          for segment in segments)
+        self.iterator = iter([])
+
+    def __next__(self):
+        while True:
+            try:
+                return next(self.iterator)
+            except StopIteration:
+                # raises StopIteration when the segments are exhausted
+                self.iterator = next(self.iterators)
+
+    def __len__(self):
+        return sum(segment.count for segment in self.segments)
+
+    def __str__(self):
+        return str(self.cls.__name__)
+
+
 class LoggingFilter(logging.Filter):
     """Preprocess some logging messages"""
 
@@ -0,0 +1,198 @@
+import hashlib
+import logging
+import sqlite3
+import time
+
+from .file import get_cache_dir
+
+LOGGER = logging.getLogger(__name__)
+
+
+def take_report(caches):
+    """Get the hits and misses of each cache that was used since the last report"""
+    return [cache.take_stats() for cache in caches if cache.hits or cache.misses]
+
+
+def take_cache_report():
+    """Get the hits and misses of every kind of cache in this process since the last report"""
+    return [stats for kind in CacheStats.kinds for stats in kind.take_report()]
+
+
+class CacheStats:
+    """Hits and misses of a cache for the caches section of timing.json
+
+    The cache sets its name and implements get_size().
+    Each kind of cache has a take_report() class method that take_cache_report() calls.
+    """
+
+    name = None
+    kinds = []  # the subclasses in the order they were defined
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        CacheStats.kinds.append(cls)
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def take_stats(self):
+        """Get the hits and misses since the last call"""
+        total = self.hits + self.misses
+        stats = {
+            'name': self.name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0,
+            'size': self.get_size(),
+        }
+        self.hits = 0
+        self.misses = 0
+        return stats
+
+
+class ProcessedTextCache(CacheStats):
+    """Content-addressed cache of processed documents that is shared across runs
+
+    The key is a hash of the raw text and of the processing settings so a document is only
+    processed again if its text or the processing changes.
+    The least recently used documents are evicted once the text in the cache exceeds a size.
+    Several processes can use the same cache file.
+    The number of documents and bytes of text are kept up to date by triggers so they are never counted.
+    """
+
+    name = 'documents'
+
+    FLUSH_INTERVAL = 1000  # number of new or used documents buffered before writing to the database
+    EVICT_FRACTION = 0.9  # eviction brings the size down to this fraction of the maximum size
+
+    # caches opened in this process for reporting
+    caches = []
+
+    def __init__(self, path, max_size, namespace):
+        """
+        Args:
+            path (Path): Path to the sqlite file or None for the patapsco cache directory.
+            max_size (int): Bytes of text in the cache before the least recently used are evicted.
+            namespace (str): Identifies the processing settings (language, config, and version).
+        """
+        if path is None:
+            cache_dir = get_cache_dir()
+            if cache_dir is None:
+                raise OSError("Unable to create the patapsco cache directory")
+            path = cache_dir / 'documents.sqlite'
+        super().__init__()
+        self.path = path
+        self.max_size = max_size
+        self.namespace = hashlib.sha1(namespace.encode()).hexdigest()
+        self.count = 0
+        self.closed = False
+        self.added = {}  # key -> (original_text, text) not yet written
+        self.used = []
+        self.conn = sqlite3.connect(str(path), timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+        self._evict()
+        self.caches.append(self)
+
+    @classmethod
+    def take_report(cls):
+        """Get the hits and misses of each cache since the last report"""
+        report = take_report(cls.caches)
+        # closed caches are kept until their stats are reported
+        cls.caches[:] = [cache for cache in cls.caches if not cache.closed]
+        return report
+
+    def get_key(self, text):
+        return hashlib.sha1(f"{self.namespace}\0{text}".encode('utf8', 'surrogatepass')).hexdigest()
+
+    def get_many(self, keys):
+        """Look up documents
+
+        Args:
+            keys (list of str): Keys from get_key().
+
+        Returns:
+            dict of key -> (original_text, text) for the documents in the cache
+        """
+        # documents that are repeated within a run are found before they are written
+        found = {key: self.added[key] for key in keys if key in self.added}
+        unique = list(set(keys) - set(found))
+        # stay below the sqlite limit on the number of variables
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f'SELECT key, original_text, text FROM texts WHERE key IN ({placeholders})', chunk)
+            found.update((key, (original_text, text)) for key, original_text, text in rows)
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        self.used.extend(found)
+        self._flush_if_full()
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put(self, key, original_text, text):
+        self.added[key] = (original_text, text)
+        self._flush_if_full()
+
+    def flush(self):
+        """Write the new documents and the access times and evict documents if over the maximum size"""
+        if not self.added and not self.used:
+            return
+        now = time.time()
+        with self.conn:
+            # the key is a hash of the content so a document that another process added is the same
+            self.conn.executemany('INSERT OR IGNORE INTO texts (key, size, accessed, original_text, text) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  [(key, len(original_text) + len(text), now, original_text, text)
+                                   for key, (original_text, text) in self.added.items()])
+            self.conn.executemany('UPDATE texts SET accessed = ? WHERE key = ?', [(now, key) for key in self.used])
+        self.added = {}
+        self.used = []
+        self._evict()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+        self.closed = True
+
+    def get_size(self):
+        """Number of documents in the cache"""
+        return self.count
+
+    def _flush_if_full(self):
+        if len(self.added) + len(self.used) >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def _create_tables(self):
+        with self.conn:
+            # the size is before the text so that reading it does not walk the overflow pages of the text
+            self.conn.execute('CREATE TABLE IF NOT EXISTS texts (key TEXT PRIMARY KEY, size INTEGER, accessed REAL, '
+                              'original_text TEXT, text TEXT)')
+            # covering index so that the eviction only reads the index
+            self.conn.execute('CREATE INDEX IF NOT EXISTS texts_lru ON texts (accessed, size)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                              'count INTEGER, size INTEGER)')
+            self.conn.execute('CREATE TRIGGER IF NOT EXISTS texts_insert AFTER INSERT ON texts BEGIN '
+                              'UPDATE totals SET count = count + 1, size = size + new.size; END')
+            self.conn.execute('CREATE TRIGGER IF NOT EXISTS texts_delete AFTER DELETE ON texts BEGIN '
+                              'UPDATE totals SET count = count - 1, size = size - old.size; END')
+            self.conn.execute('INSERT OR IGNORE INTO totals VALUES (0, 0, 0)')
+
+    def _evict(self):
+        self.count, size = self.conn.execute('SELECT count, size FROM totals').fetchone()
+        if size <= self.max_size:
+            return
+        excess = size - int(self.EVICT_FRACTION * self.max_size)
+        rowids = []
+        for rowid, entry_size in self.conn.execute('SELECT rowid, size FROM texts ORDER BY accessed'):
+            rowids.append((rowid,))
+            excess -= entry_size
+            if excess <= 0:
+                break
+        with self.conn:
+            self.conn.executemany('DELETE FROM texts WHERE rowid = ?', rowids)
+        self.count -= len(rowids)
+        LOGGER.debug("Evicted %d documents from the processed text cache", len(rowids))
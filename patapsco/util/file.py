@@ -1,6 +1,13 @@
+import array
+import dataclasses
 import gzip
+import hashlib
+import io
+import json
+import os
 import pathlib
 import shutil
+from typing import List
 
 from ..error import ConfigError
 
@@ -57,44 +64,155 @@ def is_complete(path):
     return file.exists()
 
 
+def open_output(path, offset=None):
+    """Open a text file for writing
+
+    If an offset from sync_output() is passed, the file is truncated to the offset and opened for appending.
+    This is used for resuming an interrupted run from a checkpoint.
+    """
+    if offset is None:
+        return open(path, 'w')
+    fp = open(path, 'r+')
+    fp.truncate(offset)
+    fp.seek(0, io.SEEK_END)
+    return fp
+
+
+def sync_output(fp):
+    """Flush a file opened with open_output() to disk and return its offset"""
+    fp.flush()
+    os.fsync(fp.fileno())
+    return fp.tell()
+
+
+def get_cache_dir():
+    """Get the directory for caches that are shared across runs
+
+    This is $PATAPSCO_CACHE if set or ~/.cache/patapsco.
+
+    Returns:
+        Path or None if the directory cannot be created
+    """
+    path = pathlib.Path(os.environ.get('PATAPSCO_CACHE', '~/.cache/patapsco')).expanduser()
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return path
+
+
+@dataclasses.dataclass
+class RecordIndex:
+    """Number of records in a file with a sparse index of their byte offsets"""
+    count: int
+    end: int  # size of file (of the uncompressed data for gzip)
+    interval: int  # offsets has the offset of every interval-th record
+    offsets: List[int]
+
+
+def get_record_index(path, marker=None, encoding='utf8'):
+    """Get the record index for a file from the cache or by scanning the file
+
+    The index is stored in the cache directory keyed by the path, size, and modification time of the file.
+
+    Args:
+        path (str or Path): Path to the file.
+        marker (str): Records start on lines containing this string or every line if None.
+        encoding (str): Encoding of the file.
+
+    Returns:
+        RecordIndex
+    """
+    path = pathlib.Path(path).absolute()
+    stat = path.stat()
+    key = {'path': str(path), 'marker': marker, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    cache_dir = get_cache_dir()
+    cache_path = None
+    if cache_dir:
+        name = hashlib.sha1(f"{path}|{marker}".encode('utf8')).hexdigest()
+        cache_path = cache_dir / f"{name}.json"
+        try:
+            with open(cache_path) as fp:
+                data = json.load(fp)
+            if data['key'] == key:
+                return RecordIndex(**data['index'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    offsets, end = scan_records(path, marker, encoding)
+    # keep about a thousand offsets per file (or every offset for small files)
+    interval = max(1, min(1000, len(offsets) // 1000))
+    index = RecordIndex(len(offsets), end, interval, offsets[::interval].tolist())
+    if cache_path:
+        # write and rename so that processes reading the cache never see a partial file
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump({'key': key, 'index': dataclasses.asdict(index)}, fp)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return index
+
+
 def count_lines(path, encoding='utf8'):
-    """Count lines in a text file"""
-    if isinstance(path, pathlib.Path):
-        path = str(path)
-    if path.endswith('.gz'):
-        return gzip_count_lines(path)
-    count = 0
-    with open(path, 'r', encoding=encoding) as fp:
-        for _ in fp:
-            count += 1
-    return count
-
-
-def gzip_count_lines(path):
-    count = 0
-    with gzip.open(path, 'rb') as fp:
-        for _ in fp:
-            count += 1
-    return count
+    """Count lines in a text file (optionally gzipped) using the cache"""
+    return get_record_index(path, None, encoding).count
 
 
 def count_lines_with(string, path, encoding='utf8'):
-    """Count lines in a text file with a particular string"""
-    if path.endswith('.gz'):
-        return gzip_count_lines_with(string, path, encoding)
-    count = 0
-    with open(path, 'r', encoding=encoding) as fp:
-        for line in fp:
-            if string in line:
-                count += 1
-    return count
-
-
-def gzip_count_lines_with(string, path, encoding):
-    bstr = string.encode(encoding)
-    count = 0
-    with gzip.open(path, 'rb') as fp:
-        for line in fp:
-            if bstr in line:
-                count += 1
-    return count
+    """Count lines in a text file (optionally gzipped) with a particular string using the cache"""
+    return get_record_index(path, string, encoding).count
+
+
+def open_text_at(path, encoding='utf8', offset=0):
+    """Open a text file (optionally gzipped) at a byte offset
+
+    For gzipped files, the offset is in the uncompressed data.
+    The offset must be at the start of a character (like the start of a line).
+    """
+    path = str(path)
+    fp = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    if offset:
+        fp.seek(offset)
+    return io.TextIOWrapper(fp, encoding=encoding)
+
+
+def scan_records(path, marker=None, encoding='utf8'):
+    """Find the byte offsets of the records in a text file (optionally gzipped)
+
+    This works on the raw bytes without decoding or splitting the file into line objects.
+
+    Args:
+        path (str or Path): Path to the file.
+        marker (str): Records start on lines containing this string or every line if None.
+        encoding (str): Encoding of the file.
+
+    Returns:
+        tuple of array of offsets and the offset of the end of the file
+    """
+    path = str(path)
+    offsets = array.array('q')
+    offset = 0
+    open_func = gzip.open if path.endswith('.gz') else open
+    with open_func(path, 'rb') as fp:
+        if marker:
+            bmarker = marker.encode(encoding)
+            for line in fp:
+                if bmarker in line:
+                    offsets.append(offset)
+                offset += len(line)
+        else:
+            line_start = True
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                pos = 0
+                size = len(block)
+                while pos < size:
+                    if line_start:
+                        offsets.append(offset + pos)
+                    pos = block.find(b'\n', pos) + 1
+                    line_start = pos > 0
+                    if not line_start:
+                        break
+                offset += size
+    return offsets, offset
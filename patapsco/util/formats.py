@@ -1,7 +1,6 @@
 import collections
 import csv
 import functools
-import gzip
 import itertools
 import json
 import xml.etree.ElementTree as ElementTree
@@ -10,15 +9,19 @@ import bs4
 import numpy as np
 
 from ..error import ParseError
+from .file import open_text_at
 
 
-def parse_sgml_documents(path, encoding='utf8'):
-    """Parse from SGML"""
+def parse_sgml_documents(path, encoding='utf8', offset=None, count=None):
+    """Parse from SGML
+
+    If an offset is passed, parsing starts at that byte offset.
+    If a count is passed, only that many documents (lines with <DOC>) are parsed.
+    """
     doc_text_tags = ["headline", "title", "hl", "head", "ttl", "dd", "date", "lp", "leadpara", "text"]
-    open_func = gzip.open if path.endswith('.gz') else open
-    with open_func(path, 'rt', encoding=encoding) as fp:
+    with open_text_at(path, encoding, offset) as fp:
         try:
-            soup = bs4.BeautifulSoup(fp, 'html.parser')
+            soup = bs4.BeautifulSoup(fp if count is None else _read_sgml_records(fp, count), 'html.parser')
         except UnicodeDecodeError as e:
             raise ParseError(f"Decode error for {path}: {e}")
         for doc in soup.find_all('doc'):
@@ -31,6 +34,19 @@ def parse_sgml_documents(path, encoding='utf8'):
             yield doc_id, ' '.join(text_parts)
 
 
+def _read_sgml_records(fp, count):
+    """Read the text of the next count documents"""
+    lines = []
+    seen = 0
+    for line in fp:
+        if '<DOC>' in line:
+            seen += 1
+            if seen > count:
+                break
+        lines.append(line)
+    return ''.join(lines)
+
+
 def parse_hamshahri_documents(path, encoding='utf8'):
     with open(path, 'r', encoding=encoding) as fp:
         doc_id = None
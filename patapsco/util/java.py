@@ -18,6 +18,16 @@ class Java:
             self.initialize()
         return self.__dict__[attr]
 
+    @staticmethod
+    def detach():
+        """Detach the current thread from the JVM
+
+        Threads other than the main thread that use Java classes must call this before exiting.
+        """
+        if jnius_config.vm_running:
+            import jnius
+            jnius.detach()
+
     def initialize(self):
         self.initialized = True
         if not jnius_config.vm_running:
@@ -0,0 +1,177 @@
+import collections
+import logging
+import sys
+import threading
+import timeit
+
+import psutil
+
+from . import get_human_readable_size
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_process_tree_rss(process=None):
+    """Get the resident memory of a process and all its children in bytes
+
+    The JVM runs inside the python process so it is included.
+    """
+    process = process if process else psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            # the child exited between listing and reading it
+            pass
+    return rss
+
+
+class MemoryMonitor:
+    """Samples the memory of the process tree in a background thread
+
+    Records the peak memory of each stage and of each task while it was running.
+    A timeline of the samples labeled with the stage and running tasks is kept at a bounded size
+    by halving its resolution whenever it is full so that it covers the whole run.
+    With a budget, the pipelines are asked to release memory when the memory is close to the budget
+    and fail once it is over the budget so that the run ends with a clear error rather than an OOM kill.
+    """
+
+    COOLDOWN = 10  # minimum seconds between requests to release memory
+
+    def __init__(self, interval=1.0, budget=None, warning=0.9, timeline=600):
+        """
+        Args:
+            interval (float): Seconds between samples.
+            budget (int): Optional memory budget in bytes.
+            warning (float): Fraction of the budget at which pipelines are asked to release memory.
+            timeline (int): Maximum number of samples in the timeline (0 for no timeline).
+        """
+        self.interval = interval
+        self.budget = budget
+        self.warning = warning
+        self.max_timeline = timeline
+        self.timeline = []
+        self.stride = 1  # every stride-th sample is kept in the timeline
+        self.samples = 0
+        self.peak = 0
+        self.stages = collections.OrderedDict()
+        self.stage = None
+        self.error = None
+        self.pressure = False
+        self.last_pressure = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.start_time = None
+        self.task_codes = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        # imported here to avoid a circular import
+        from ..pipeline import TimedTask
+        self.task_codes = {TimedTask.process.__code__, TimedTask.batch_process.__code__}
+        self.start_time = timeit.default_timer()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        self.sample()
+
+    def set_stage(self, stage):
+        """Label the following samples with a stage name"""
+        self.stage = stage
+        self.sample()
+
+    def take_pressure(self):
+        """Returns true once per request to release memory"""
+        if self.pressure:
+            self.pressure = False
+            return True
+        return False
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        try:
+            rss = get_process_tree_rss()
+        except psutil.Error:
+            return
+        now = timeit.default_timer()
+        sample = {
+            'time': now - self.start_time if self.start_time else 0,
+            'stage': self.stage,
+            'rss': rss,
+            'tasks': self._get_running_tasks(),
+        }
+        self._add_peaks(sample)
+        self._add_to_timeline(sample)
+        if not self.budget:
+            return
+        if rss > self.budget:
+            if not self.error:
+                self.error = (f"Memory use of {get_human_readable_size(rss)} exceeds the budget of "
+                              f"{get_human_readable_size(self.budget)} in {self.stage}. "
+                              f"Reduce the batch size, the number of jobs or workers, or increase the budget.")
+                LOGGER.error(self.error)
+        elif rss > self.warning * self.budget:
+            if self.last_pressure is None or now - self.last_pressure > self.COOLDOWN:
+                LOGGER.warning("Memory use of %s is close to the budget of %s",
+                               get_human_readable_size(rss), get_human_readable_size(self.budget))
+                self.last_pressure = now
+                self.pressure = True
+
+    def _add_peaks(self, sample):
+        self.peak = max(self.peak, sample['rss'])
+        if sample['stage'] is None:
+            return
+        stage = self.stages.setdefault(sample['stage'], {'peak': 0, 'tasks': {}})
+        stage['peak'] = max(stage['peak'], sample['rss'])
+        for task in sample['tasks']:
+            stage['tasks'][task] = max(stage['tasks'].get(task, 0), sample['rss'])
+
+    def _add_to_timeline(self, sample):
+        if not self.max_timeline:
+            return
+        if self.samples % self.stride == 0:
+            self.timeline.append(sample)
+        self.samples += 1
+        if len(self.timeline) > self.max_timeline:
+            # halve the resolution so that a long run still fits
+            self.timeline = self.timeline[::2]
+            self.stride *= 2
+
+    def _get_running_tasks(self):
+        """Get the names of the tasks being run by any thread from their stack frames"""
+        tasks = []
+        for frame in sys._current_frames().values():
+            while frame is not None:
+                if frame.f_code in self.task_codes:
+                    name = str(frame.f_locals['self'])
+                    if name not in tasks:
+                        tasks.append(name)
+                frame = frame.f_back
+        return tasks
+
+    @property
+    def report(self):
+        """Summary with the peaks per stage and task and the timeline"""
+        return {
+            'budget': self.budget,
+            'peak': self.peak,
+            'stages': self.stages,
+            'timeline_interval': self.interval * self.stride,
+            'timeline': self.timeline,
+        }
@@ -154,11 +154,17 @@ There are cases of #2, but they were escaped multiple times.
 
 import collections
 import difflib
+import functools
 import re
 import sys
 import unicodedata
 
 import ftfy
+import ftfy.badness
+
+# ftfy only changes text that its badness heuristic flags (ftfy 6+)
+_is_bad = getattr(ftfy.badness, 'is_bad', None)
+_is_normalized = getattr(unicodedata, 'is_normalized', None)  # python 3.8+
 
 
 def compare_strings(s1, s2):
@@ -202,6 +208,24 @@ class NormalizerFactory:
             return GenericNormalizer(config)
 
 
+class RemovalTable(dict):
+    """Translation table that deletes control and format characters
+
+    A character is classified the first time that it is seen so the table only holds the characters of the corpus.
+    """
+
+    def __init__(self, format_chars):
+        super().__init__()
+        self.format_chars = set(format_chars)
+
+    def __missing__(self, code):
+        char = chr(code)
+        # the newline is kept and spaces have already been replaced
+        removed = char != "\n" and (char in self.format_chars or not char.isprintable())
+        self[code] = None if removed else code
+        return self[code]
+
+
 class Normalizer:
     """Base class of the text normalizers"""
 
@@ -212,10 +236,66 @@ class Normalizer:
         '\u00a0', '\u00ad', '\u200b-\u200d', '\u2060-\u2063',  # Joiners, non-joiners, etc.
     ]
 
+    # a single space is not matched so that clean text has no matches
+    SPACE_PATTERN = re.compile(r'[^\S\n]{2,}|[^\S\n ]')
+
     def __init__(self, config):
         self.config = config
         format_chars = ''.join(self._expand_chars(x) for x in self.FORMAT_RANGE)
         self.format_trans = str.maketrans('', '', format_chars)
+        self.removal_table = RemovalTable(format_chars)
+        # the format characters that are printable are not caught by the isprintable() check
+        printable = ''.join(char for char in format_chars if char.isprintable() and not char.isspace())
+        self.printable_format_pattern = re.compile(f"[{re.escape(printable)}]") if printable else None
+
+    def fast_pre_normalize(self, text, changes=None):
+        """Same output as the individual steps of GenericNormalizer.pre_normalize in fewer passes
+
+        ftfy is skipped for ascii text and text that its badness check considers clean (ftfy does not change it),
+        control and format characters are removed in one translate pass only if there are any,
+        and NFC is skipped for text that is already normalized.
+
+        Args:
+            text (str): Text to normalize.
+            changes (Counter): Optional counter of the character changes made by each step.
+        """
+        is_ascii = text.isascii()
+        if not is_ascii and (_is_bad is None or _is_bad(text)):
+            fixed = self.fix_encoding(text)
+            if changes is not None and fixed != text:
+                changes.update(compare_strings(text, fixed))
+            text = fixed
+        if changes is None:
+            text = self.SPACE_PATTERN.sub(' ', text)
+        else:
+            text = self.SPACE_PATTERN.sub(functools.partial(self._count_spaces, changes), text)
+        if text.replace("\n", " ").isprintable():
+            # format characters like the zero width space are printable but still removed
+            needs_removal = not is_ascii and self.printable_format_pattern and self.printable_format_pattern.search(text)
+        else:
+            needs_removal = True
+        if needs_removal:
+            if changes is not None:
+                # Counter counts the characters in C and only the distinct characters are looked up
+                changes.update({f"del {char}": count for char, count in collections.Counter(text).items()
+                                if self.removal_table[ord(char)] is None})
+            text = text.translate(self.removal_table)
+        if is_ascii or (_is_normalized is not None and _is_normalized('NFC', text)):
+            return text
+        normalized = self.standardize_combining_chars(text)
+        if changes is not None and normalized != text:
+            changes.update(compare_strings(text, normalized))
+        return normalized
+
+    @staticmethod
+    def _count_spaces(changes, match):
+        """Count a run of spaces as a substitution of its first character and deletions of the rest"""
+        run = match.group()
+        if run[0] != ' ':
+            changes[f"{run[0]} →  "] += 1
+        for char in run[1:]:
+            changes[f"del {char}"] += 1
+        return ' '
 
     @staticmethod
     def _expand_chars(chars_range):
@@ -253,8 +333,17 @@ class Normalizer:
 class GenericNormalizer(Normalizer):
     """General text normalizer"""
 
-    def pre_normalize(self, text):
-        """Normalization common to all processing"""
+    def pre_normalize(self, text, changes=None):
+        """Normalization common to all processing
+
+        Args:
+            text (str): Text to normalize.
+            changes (Counter): Optional counter of the character changes.
+        """
+        return self.fast_pre_normalize(text, changes)
+
+    def slow_pre_normalize(self, text):
+        """The individual steps of pre_normalize() that are the reference for fast_pre_normalize()"""
         text = self.fix_encoding(text)
         text = self.update_spaces(text)
         text = self.remove_control_chars(text)
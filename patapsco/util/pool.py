@@ -0,0 +1,256 @@
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Modules imported by the forkserver before it forks any workers.
+# Missing optional modules like stanza are skipped.
+PRELOAD = ['patapsco.job', 'spacy', 'stanza']
+
+_pool = None
+_startup_time = None
+_worker_count = 1  # number of processes that share the CPUs of the machine with this one
+_job_path = None  # file of the stoppable job that this worker is running
+_stop_checked = 0  # when the job last checked whether it was stopped
+STOP_CHECK_INTERVAL = 1  # seconds between checks for a stop request
+
+
+class WorkerPool:
+    """A process pool that is reused for stage 1, stage 2, and optionally later runs in the same process
+
+    The workers are forked from a forkserver that has already imported the heavy modules.
+    The forkserver never starts a JVM so the workers do not inherit one.
+    Anything a worker loads during a job (models, the JVM, PSQ tables) stays loaded for its next jobs.
+    """
+
+    def __init__(self, num_workers, start_method='forkserver', preload=None):
+        """
+        Args:
+            num_workers (int): Number of worker processes.
+            start_method (str): 'forkserver' or 'spawn'. Falls back to spawn if forkserver is not available.
+            preload (list): Names of modules to import before starting the workers.
+        """
+        if start_method not in multiprocessing.get_all_start_methods():
+            LOGGER.debug("Start method %s is not available so using spawn", start_method)
+            start_method = 'spawn'
+        self.num_workers = num_workers
+        self.start_method = start_method
+        self.preload = PRELOAD if preload is None else preload
+        context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            context.set_forkserver_preload(self.preload)
+        self.created = time.time()
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                                               initializer=_initialize_worker,
+                                                               initargs=(self.created, self.preload,
+                                                                         get_worker_count() * num_workers))
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def fits(self, num_workers, num_jobs, start_method):
+        """Whether this pool can run the jobs with the requested number of workers
+
+        A larger pool can be used when there are no more jobs than workers
+        since the extra workers are then left idle.
+        """
+        if start_method != self.start_method and start_method in multiprocessing.get_all_start_methods():
+            return False
+        return self.num_workers == num_workers or (self.num_workers > num_workers and num_jobs <= num_workers)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def terminate(self, pids):
+        """Stop the pool without waiting on the jobs that are running
+
+        Args:
+            pids (list): Process ids of the workers running jobs. These are killed.
+        """
+        # concurrent.futures cannot cancel a call that has started so the processes are killed
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        # the executor stops the other workers when it sees that a worker died so this does not wait on jobs
+        self.executor.shutdown(wait=True)
+
+
+def get_worker_pool(num_workers, num_jobs, start_method='forkserver'):
+    """Get the shared worker pool, creating it if there is not one that fits"""
+    global _pool
+    if _pool is not None and not _pool.fits(num_workers, num_jobs, start_method):
+        shutdown_worker_pool()
+    if _pool is None:
+        LOGGER.debug("Starting a pool of %d workers", num_workers)
+        _pool = WorkerPool(num_workers, start_method)
+    return _pool
+
+
+def shutdown_worker_pool():
+    """Stop the workers of the shared pool if there is one"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def terminate_worker_pool(pids):
+    """Stop the shared pool if there is one without waiting on its jobs
+
+    Args:
+        pids (list): Process ids of the workers running jobs. These are killed.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.terminate(pids)
+        _pool = None
+
+
+def terminate_jobs(jobs, wait=5):
+    """Stop the shared pool without waiting on the running jobs that were started with run_stoppable()
+
+    A job handed to a worker may not have written its process id yet.
+    Killing one worker breaks the pool which then stops the others
+    so this waits up to a few seconds for a process id when none is known.
+
+    Args:
+        jobs (list): Tuples of the future and the path of each job.
+        wait (float): Maximum seconds to wait for the process id of a running job.
+    """
+    running = [(future, path) for future, path in jobs if not future.cancel() and not future.done()]
+    deadline = time.time() + wait
+    while True:
+        running = [(future, path) for future, path in running if not future.done()]
+        pids = [get_job_pid(path) for _, path in running]
+        pids = [pid for pid in pids if pid is not None]
+        if pids or not running or time.time() > deadline:
+            break
+        time.sleep(0.01)
+    terminate_worker_pool(pids)
+
+
+def run_stoppable(path, func, *args, **kwargs):
+    """Run a job in a worker so that the main process can stop it with stop_job()
+
+    Args:
+        path (str): File that identifies the job. It holds the process id of the worker while the job runs.
+        func (callable): The job.
+    """
+    global _job_path, _stop_checked
+    _remove(f"{path}.stop")  # left from an earlier launch of a run
+    _job_path = path
+    _stop_checked = 0
+    try:
+        with open(path, 'w') as fp:
+            fp.write(str(os.getpid()))
+        return func(*args, **kwargs)
+    finally:
+        _job_path = None
+        _remove(path)
+        _remove(f"{path}.stop")
+
+
+def get_job_pid(path):
+    """Get the process id of the worker running a job started with run_stoppable() or None"""
+    try:
+        with open(path) as fp:
+            return int(fp.read())
+    except (OSError, ValueError):
+        return None
+
+
+def stop_job(path):
+    """Ask a job started with run_stoppable() to stop while leaving its worker for the next job
+
+    The pipeline of the job raises JobStoppedError the next time it checks is_job_stopped() between items
+    so that it never stops in the middle of writing its output.
+
+    Returns:
+        bool: Whether the job was running
+    """
+    if get_job_pid(path) is None:
+        return False
+    with open(f"{path}.stop", 'w'):
+        pass
+    return True
+
+
+def is_job_stopped():
+    """Whether the main process asked to stop the job that this worker is running
+
+    This is cheap enough to call between items since the stop file is checked at most once a second.
+    """
+    global _stop_checked
+    if _job_path is None:
+        return False
+    now = time.time()
+    if now - _stop_checked < STOP_CHECK_INTERVAL:
+        return False
+    _stop_checked = now
+    return os.path.exists(f"{_job_path}.stop")
+
+
+def take_startup_time():
+    """Get the seconds it took to start this worker process
+
+    This is only reported by the first job of a worker and is 0 after that.
+    """
+    global _startup_time
+    startup_time = _startup_time or 0
+    _startup_time = 0
+    return startup_time
+
+
+def get_worker_count():
+    """Get the number of processes that share the CPUs with this process"""
+    return _worker_count
+
+
+def set_worker_count(count):
+    """Set the number of processes that share the CPUs with this process
+
+    Worker processes call this so that the threads they start do not oversubscribe the machine.
+    """
+    global _worker_count
+    _worker_count = max(1, count)
+
+
+def get_cpu_count():
+    """Get the number of CPUs that this process can run on"""
+    try:
+        # this respects the CPUs allocated to a job by a scheduler like slurm
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_cpu_share():
+    """Get the number of CPUs for this process when divided evenly among the processes sharing them"""
+    return max(1, get_cpu_count() // _worker_count)
+
+
+def _initialize_worker(created, preload, worker_count=1):
+    set_worker_count(worker_count)
+    # with spawn, this is where the modules are imported
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    global _startup_time
+    _startup_time = max(0, time.time() - created)
+    LOGGER.debug("Worker %d started in %.1f secs", os.getpid(), _startup_time)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,210 @@
+import abc
+import collections
+import contextlib
+import cProfile
+import marshal
+import pathlib
+import pstats
+import sys
+import threading
+import time
+
+from ..error import ConfigError
+
+
+def get_profiler(name, path, interval=0.005):
+    """Get a profiler context manager
+
+    Args:
+        name (str): 'sampling', 'cprofile', or None for no profiling.
+        path (str or Path): Path of the profile artifacts without the extension.
+        interval (float): Seconds between samples for the sampling profiler.
+
+    Returns:
+        Context manager that profiles the code in its block.
+    """
+    if not name:
+        return contextlib.nullcontext()
+    if name == 'sampling':
+        return SamplingProfiler(path, interval)
+    if name == 'cprofile':
+        return CProfiler(path)
+    raise ConfigError(f"Unknown profiler: {name}")
+
+
+class Profiler(abc.ABC):
+    """Profiles a block of code and writes the profile on exit
+
+    Two artifacts are written:
+      * path.pstats that can be loaded with pstats.Stats or viewers like snakeviz
+      * path.collapsed with one stack per line in the collapsed format used by flamegraph.pl and speedscope
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.save()
+
+    def _artifact(self, extension):
+        # not using with_suffix() since the name can have a dot like stage1.part_3
+        return self.path.parent / (self.path.name + extension)
+
+    @abc.abstractmethod
+    def start(self):
+        pass
+
+    @abc.abstractmethod
+    def stop(self):
+        pass
+
+    @abc.abstractmethod
+    def save(self):
+        pass
+
+    def write_collapsed(self, stacks):
+        """Write stacks as a dictionary of tuples of frame names -> weight"""
+        with open(self._artifact('.collapsed'), 'w') as fp:
+            for stack, weight in sorted(stacks.items()):
+                if weight:
+                    fp.write(f"{';'.join(stack)} {weight}\n")
+
+    @staticmethod
+    def format_frame(func):
+        filename, line, name = func
+        return f"{name} ({pathlib.Path(filename).name}:{line})"
+
+
+class CProfiler(Profiler):
+    """Deterministic profiler using cProfile
+
+    This has more overhead than sampling, especially for code with many small function calls.
+    cProfile does not record full stacks so the collapsed stacks are built from the call graph
+    by assuming a function spends its time in the same proportions for all of its callers.
+    """
+
+    MIN_WEIGHT = 1  # microseconds below which a stack is not expanded
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def save(self):
+        self.profiler.dump_stats(str(self._artifact('.pstats')))
+        stats = pstats.Stats(self.profiler).stats
+        callees = collections.defaultdict(list)
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            for caller, edge in callers.items():
+                callees[caller].append((func, edge[3]))
+        stacks = collections.Counter()
+        roots = [func for func, value in stats.items() if not value[4]]
+        for root in roots:
+            self._expand(stats, callees, (root,), stats[root][3], stacks)
+        self.write_collapsed(stacks)
+
+    def _expand(self, stats, callees, stack, time_spent, stacks):
+        func = stack[-1]
+        cc, nc, tt, ct, callers = stats[func]
+        scale = time_spent / ct if ct else 0
+        names = tuple(self.format_frame(f) for f in stack)
+        stacks[names] += int(1e6 * tt * scale)
+        for callee, edge_time in callees[func]:
+            child_time = edge_time * scale
+            # recursion is folded into the first call and tiny stacks are dropped
+            if callee not in stack and 1e6 * child_time >= self.MIN_WEIGHT:
+                self._expand(stats, callees, stack + (callee,), child_time, stacks)
+
+
+class SamplingProfiler(Profiler):
+    """Low overhead profiler that samples the stacks of all threads from a background thread
+
+    The weights in the collapsed stacks are sample counts and the stack of each thread starts with the thread name.
+    The pstats times are the number of samples times the interval.
+    """
+
+    def __init__(self, path, interval=0.005):
+        super().__init__(path)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.thread.join()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while self.running.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                stack.append(('~', 0, names.get(thread_id, str(thread_id))))
+                self.stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def save(self):
+        collapsed = collections.Counter()
+        for stack, count in self.stacks.items():
+            names = (stack[0][2],) + tuple(self.format_frame(func) for func in stack[1:])
+            collapsed[names] += count
+        self.write_collapsed(collapsed)
+        with open(self._artifact('.pstats'), 'wb') as fp:
+            marshal.dump(self._create_stats(), fp)
+
+    def _create_stats(self):
+        """Convert the samples into the dictionary that pstats loads"""
+        # func -> [primitive calls, calls, self time, cumulative time, {caller -> [same 4 values]}]
+        stats = {}
+
+        def get_entry(func):
+            if func not in stats:
+                stats[func] = [0, 0, 0, 0, {}]
+            return stats[func]
+
+        for stack, count in self.stacks.items():
+            seconds = count * self.interval
+            frames = stack[1:]  # the first entry is the thread
+            seen = set()
+            for i, func in enumerate(frames):
+                entry = get_entry(func)
+                if func not in seen:
+                    # recursive functions only count once towards cumulative time
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                    seen.add(func)
+                if i > 0:
+                    caller = entry[4].setdefault(frames[i - 1], [0, 0, 0, 0])
+                    caller[0] += count
+                    caller[1] += count
+                    caller[3] += seconds
+                    if i == len(frames) - 1:
+                        caller[2] += seconds
+            if frames:
+                get_entry(frames[-1])[2] += seconds
+        return {func: (cc, nc, tt, ct, {caller: tuple(value) for caller, value in callers.items()})
+                for func, (cc, nc, tt, ct, callers) in stats.items()}
@@ -23,7 +23,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     license="BSD",
     python_requires=">=3.6.1",
-    packages=setuptools.find_packages(exclude=['tests']),
+    packages=setuptools.find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     install_requires=[
         "beautifulsoup4",
@@ -19,3 +19,12 @@ def pytest_collection_modifyitems(config, items):
     for item in items:
         if "slow" in item.keywords:
             item.add_marker(skip_slow)
+
+
+@pytest.fixture(autouse=True, scope='session')
+def cache_dir(tmp_path_factory):
+    # keep the record index cache out of the user's home directory
+    mp = pytest.MonkeyPatch()
+    mp.setenv('PATAPSCO_CACHE', str(tmp_path_factory.mktemp('cache')))
+    yield
+    mp.undo()
@@ -0,0 +1,51 @@
+import pytest
+
+from benchmarks import corpus
+from benchmarks.run import compare, create_config
+from patapsco.docs import Hc4JsonDocumentReader
+from patapsco.helpers import ConfigHelper
+from patapsco.topics import Hc4JsonTopicReader
+
+
+@pytest.mark.parametrize('lang', sorted(corpus.ALPHABETS))
+def test_generate_collection(tmp_path, lang):
+    collection = corpus.generate(tmp_path, lang, num_docs=50, num_topics=3, doc_length=20, vocab_size=500,
+                                 relevant_per_topic=2)
+    docs = list(Hc4JsonDocumentReader(str(collection.docs_path), 'utf8', lang))
+    assert len(docs) == 50
+    topics = list(Hc4JsonTopicReader(str(collection.topics_path), 'utf8', lang, 'original'))
+    assert len(topics) == 3
+    qrels = [line.split() for line in collection.qrels_path.read_text().splitlines()]
+    assert len(qrels) == 6
+    docs = {doc.id: doc for doc in docs}
+    for topic in topics:
+        relevant = [doc_id for topic_id, _, doc_id, _ in qrels if topic_id == topic.id]
+        for word in topic.title.split():
+            assert all(word in docs[doc_id].text.split() for doc_id in relevant)
+
+
+def test_generate_collection_is_deterministic(tmp_path):
+    collection1 = corpus.generate(tmp_path / '1', num_docs=10, num_topics=2, vocab_size=100)
+    collection2 = corpus.generate(tmp_path / '2', num_docs=10, num_topics=2, vocab_size=100)
+    assert collection1.docs_path.read_text() == collection2.docs_path.read_text()
+
+
+@pytest.mark.parametrize('mode', ['streaming', 'batch', 'mp'])
+def test_create_config(tmp_path, mode):
+    collection = corpus.generate(tmp_path, num_docs=10, num_topics=2, vocab_size=100)
+    conf = ConfigHelper.prepare(create_config(collection, mode, tmp_path / 'run'))
+    assert conf.documents.process.tokenize == 'whitespace'
+    assert conf.retrieve.name == 'bm25'
+    conf = ConfigHelper.prepare(create_config(collection, mode, tmp_path / 'run', retrieval=False))
+    assert not conf.run.stage2
+
+
+def test_compare():
+    baseline = {'benchmarks': {'eng/mp': {'docs_per_sec': 100, 'queries_per_sec': 10, 'peak_rss': 1000}}}
+    results = {'benchmarks': {
+        'eng/mp': {'docs_per_sec': 80, 'queries_per_sec': 10.5, 'peak_rss': 1050},
+        'eng/batch': {'docs_per_sec': 1},
+    }}
+    regressions = compare(results, baseline, tolerance=0.1)
+    assert [(r['benchmark'], r['metric']) for r in regressions] == [('eng/mp', 'docs_per_sec')]
+    assert regressions[0]['change'] == pytest.approx(-0.2)
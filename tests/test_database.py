@@ -3,8 +3,9 @@ import pathlib
 import sqlite3
 import tempfile
 
-from patapsco.database import DocumentDatabase
+from patapsco.database import DatabaseWriter, DocumentDatabase
 from patapsco.docs import Doc
+from patapsco.schema import DatabaseConfig
 from patapsco.util.file import delete_dir
 
 
@@ -34,3 +35,16 @@ class TestDocumentDatabase:
         assert loaded_doc['date'] == doc.date
         assert loaded_doc['lang'] == doc.lang
         assert loaded_doc['text'] == doc.text
+
+    def test_reduce(self):
+        for part, doc_ids in enumerate([['doc1', 'doc2'], ['doc3']]):
+            db = DocumentDatabase(self.temp_dir, f"part_{part}/database")
+            for doc_id in doc_ids:
+                db[doc_id] = Doc(doc_id, lang='eng', text=f"text of {doc_id}", date=None)
+            db.close()
+        writer = DatabaseWriter(self.temp_dir, DatabaseConfig(output='database'), None)
+        writer.run_reduce()
+        writer.db.close()
+        db = DocumentDatabase(self.temp_dir, 'database', readonly=True)
+        assert sorted(db.keys()) == ['doc1', 'doc2', 'doc3']
+        assert db['doc3'].text == 'text of doc3'
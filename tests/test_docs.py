@@ -3,6 +3,10 @@ import pathlib
 import pytest
 
 from patapsco.docs import *
+from patapsco.pipeline import ParallelPipeline
+from patapsco.schema import DocumentCacheConfig, DocumentsConfig, NormalizationConfig, TextProcessorConfig
+from patapsco.util.cache import ProcessedTextCache
+from patapsco.util import file
 
 
 def test_parse_json_documents():
@@ -23,6 +27,21 @@ def test_parse_json_documents():
     assert doc_iter.fp.closed
 
 
+def test_parse_json_documents_with_offset_and_count():
+    directory = pathlib.Path(__file__).parent / 'json_files'
+    path = directory / 'docs.jsonl'
+    offsets, _ = file.scan_records(path)
+    doc_iter = Hc4JsonDocumentReader(str(path.absolute()), 'utf8', 'eng', offset=offsets[1], count=1)
+    assert next(doc_iter).id == 'tuvwxy'
+    with pytest.raises(StopIteration):
+        next(doc_iter)
+    doc_iter = Hc4JsonDocumentReader(str(path.absolute()), 'utf8', 'eng', count=1)
+    assert next(doc_iter).id == 'abcdef'
+    with pytest.raises(StopIteration):
+        next(doc_iter)
+    assert doc_iter.fp.closed
+
+
 def test_parse_json_documents_with_bad_format():
     directory = pathlib.Path(__file__).parent / 'json_files'
     path = directory / 'bad_format.jsonl'
@@ -52,3 +71,102 @@ def test_parse_msmarco_documents():
     with pytest.raises(StopIteration):
         next(doc_iter)
     assert doc_iter.fp.closed
+
+
+def test_parse_msmarco_documents_with_offset_and_count():
+    directory = pathlib.Path(__file__).parent / 'msmarco_files'
+    path = directory / 'collection.tsv'
+    offsets, _ = file.scan_records(path)
+    doc_iter = TsvDocumentReader(str(path.absolute()), 'utf8', 'eng', offset=offsets[1], count=1)
+    assert next(doc_iter).id == '2'
+    with pytest.raises(StopIteration):
+        next(doc_iter)
+
+
+class TestDocumentProcessor:
+    def create_processor(self, tmp_path, cache=None, stem='porter', **normalize):
+        config = DocumentsConfig(input=DocumentsInputConfig(format='jsonl', lang='eng', path=''),
+                                 process=TextProcessorConfig(tokenize='whitespace', stem=stem,
+                                                             normalize=NormalizationConfig(**normalize)),
+                                 cache=cache)
+        processor = DocumentProcessor(tmp_path, config, 'eng')
+        processor.begin()
+        return processor
+
+    def test_batch_process_matches_process(self, tmp_path):
+        processor = self.create_processor(tmp_path)
+        texts = ['The running dogs', 'Wonderful cats']
+        expected = [processor.process(Doc(str(i), 'eng', text, None)) for i, text in enumerate(texts)]
+        results = processor.batch_process([Doc(str(i), 'eng', text, None) for i, text in enumerate(texts)])
+        assert [doc.text for doc in results] == [doc.text for doc in expected] == ['run dog', 'wonder cat']
+        assert [doc.original_text for doc in results] == texts
+
+    def test_batch_process_rejects_long_documents(self, tmp_path):
+        processor = self.create_processor(tmp_path)
+        processor.MAX_TEXT_LEN = 10
+        docs = [Doc('1', 'eng', 'cats', None), Doc('2', 'eng', 'a very long document', None), Doc('3', 'eng', 'dogs', None)]
+        results = processor.batch_process(docs)
+        assert results[1] is None
+        assert [results[0].text, results[2].text] == ['cat', 'dog']
+
+    @pytest.mark.parametrize('mode', ['diff', 'counts'])
+    def test_normalize_report(self, tmp_path, mode):
+        processor = self.create_processor(tmp_path, report=mode)
+        processor.process(Doc('1', 'eng', 'a\tb \u200bc\td', None))
+        processor.end()
+        report = (tmp_path / 'normalize_report.txt').read_text()
+        assert report == "'\\t →  '\t2\n'del \\u200b'\t1\n"
+
+    def test_normalize_report_sample(self, tmp_path):
+        processor = self.create_processor(tmp_path, report='counts', report_sample=0.5)
+        for i in range(100):
+            processor.process(Doc(str(i), 'eng', 'a\tb', None))
+        assert 20 < processor.diffs['\t →  '] < 80
+
+    def test_normalize_report_reduce(self, tmp_path):
+        for part, text in [('part_0', 'a\tb'), ('part_1', 'a\tb\u200b')]:
+            processor = self.create_processor(tmp_path, report='counts', report_output=f"{part}/normalize_report.txt")
+            processor.process(Doc('1', 'eng', text, None))
+            processor.end()
+        processor = self.create_processor(tmp_path, report='counts')
+        processor.run_reduce()
+        assert processor.diffs == {'\t →  ': 2, 'del \u200b': 1}
+        assert (tmp_path / 'normalize_report.txt').read_text() == "'\\t →  '\t2\n'del \\u200b'\t1\n"
+
+    def test_normalize_report_unknown(self, tmp_path):
+        with pytest.raises(ConfigError, match='Unknown normalization report'):
+            self.create_processor(tmp_path, report='all')
+
+    def test_cache(self, tmp_path):
+        cache = DocumentCacheConfig(path=str(tmp_path / 'documents.sqlite'))
+        processor = self.create_processor(tmp_path, cache)
+        processor.batch_process([Doc('1', 'eng', 'The running dogs', None)])
+        processor.end()
+        processor = self.create_processor(tmp_path, cache)
+        processor.tokenizer = None  # cached documents are not processed
+        results = processor.batch_process([Doc('2', 'eng', 'The running dogs', None)])
+        assert (results[0].original_text, results[0].text) == ('The running dogs', 'run dog')
+        processor.end()
+        assert ProcessedTextCache.take_report()[-1]['hits'] == 1
+
+    def test_cache_key_includes_config(self, tmp_path):
+        cache = DocumentCacheConfig(path=str(tmp_path / 'documents.sqlite'))
+        processor = self.create_processor(tmp_path, cache)
+        processor.process(Doc('1', 'eng', 'The running dogs', None))
+        processor.end()
+        processor = self.create_processor(tmp_path, cache, stem=False)
+        assert processor.process(Doc('1', 'eng', 'The running dogs', None)).text == 'running dogs'
+        processor.end()
+        ProcessedTextCache.take_report()
+
+    def test_cache_not_used_with_report(self, tmp_path):
+        cache = DocumentCacheConfig(path=str(tmp_path / 'documents.sqlite'))
+        processor = self.create_processor(tmp_path, cache, report='counts')
+        assert processor.cache is None
+
+    def test_normalize_report_parallel_pipeline(self, tmp_path):
+        processor = self.create_processor(tmp_path, report='counts')
+        docs = [Doc(str(i), 'eng', 'a\tb', None) for i in range(10)]
+        pipeline = ParallelPipeline(iter(docs), [processor], num_workers=2, chunk_size=3)
+        pipeline.run()
+        assert (tmp_path / 'normalize_report.txt').read_text() == "'\\t →  '\t10\n"
@@ -32,6 +32,19 @@ class TestLuceneIndex:
         lang_file = lucene_directory / ".lang"
         assert lang_file.read_text() == "eng"
 
+    def test_resuming_with_no_documents_left(self):
+        conf = IndexConfig(name='lucene', output='testIndex')
+        li = LuceneIndexer(run_path=self.temp_dir, index_config=conf, artifact_config=conf)
+        li.begin()
+        li.process(Doc("1234", "eng", "this is a test", None))
+        state = li.checkpoint()
+        li._close()
+        li = LuceneIndexer(run_path=self.temp_dir, index_config=conf, artifact_config=conf)
+        li.restore(state)
+        li.begin()
+        li.end()
+        assert (self.temp_dir / 'testIndex' / '.lang').read_text() == "eng"
+
     def test_two_indexes(self):
         run_directory = self.temp_dir
         output_directory = run_directory / pathlib.Path('testIndex') / 'part_0'
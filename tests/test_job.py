@@ -1,11 +1,19 @@
+import dataclasses
+import json
+import os
 import pathlib
 import tempfile
+import time
 
 import pytest
 
 from patapsco.index import LuceneIndexer
 from patapsco.job import *
 from patapsco.schema import *
+from patapsco.util import TaskMetrics
+from patapsco.util.cache import take_cache_report
+from patapsco.error import JobStoppedError
+from patapsco.util.pool import is_job_stopped, shutdown_worker_pool
 
 
 class TestJobBuilder:
@@ -390,3 +398,312 @@ class TestJobBuilder:
         builder = JobBuilder(conf)
         with pytest.raises(ConfigError):
             builder.check_text_processing()
+
+
+def test_stage_report_add():
+    queue = {'name': 'reader', 'size': 4, 'max_depth': 2, 'mean_depth': 1, 'gets': 2, 'producer_wait': 1,
+             'consumer_wait': 2}
+    report1 = StageReport(2, [('Reader', 1.0)], [queue], [{'pid': 1, 'jobs': 1, 'time': 1.0}])
+    report2 = StageReport(3, [('Reader', 2.0)], [dict(queue, max_depth=4)], [{'pid': 2, 'jobs': 1, 'time': 2.0}])
+    report = report1 + report2
+    assert report.count == 5
+    assert report.timing == [('Reader', 3.0)]
+    assert report.queues[0]['max_depth'] == 4
+    assert report.queues[0]['gets'] == 4
+    assert report.queues[0]['consumer_wait'] == 4
+    assert [worker['pid'] for worker in report.workers] == [1, 2]
+
+
+def test_stage_report_add_weights_mean_queue_depth_by_gets():
+    queue = {'name': 'reader', 'size': 4, 'max_depth': 4, 'mean_depth': 3, 'gets': 1, 'producer_wait': 0,
+             'consumer_wait': 0}
+    reports = [StageReport(1, queues=[queue]), StageReport(1, queues=[dict(queue, mean_depth=1, gets=3)]),
+               StageReport(1, queues=[dict(queue, mean_depth=0, gets=0)])]
+    report = reports[0] + reports[1] + reports[2]
+    assert report.queues[0]['mean_depth'] == 1.5
+    assert report.queues[0]['gets'] == 4
+
+
+def test_take_caches_folds_the_caches_of_workers():
+    class Pipeline:
+        worker_caches = [[{'name': 'porter:eng', 'hits': 1, 'misses': 3, 'hit_rate': 0.25, 'size': 3}],
+                         [{'name': 'porter:eng', 'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 2}]]
+
+    take_cache_report()  # the stats left by earlier tests
+    assert SerialJob._take_caches(Pipeline()) == [{'name': 'porter:eng', 'hits': 4, 'misses': 4, 'hit_rate': 0.5,
+                                                   'size': 3}]
+
+
+def test_stage_report_add_batching():
+    batching1 = {'name': 'Task', 'batches': 2, 'items': 6, 'chars': 60, 'min_items': 2, 'max_items': 4,
+                 'mean_items': 3, 'budget': 30, 'sizes': {'2': 1, '4': 1}}
+    batching2 = {'name': 'Task', 'batches': 1, 'items': 1, 'chars': 10, 'min_items': 1, 'max_items': 1,
+                 'mean_items': 1, 'budget': 60, 'sizes': {'1': 1}}
+    report = StageReport(6, batching=[batching1]) + StageReport(1, batching=[batching2])
+    assert report.batching[0]['batches'] == 3
+    assert report.batching[0]['min_items'] == 1
+    assert report.batching[0]['budget'] == 40
+    assert report.batching[0]['sizes'] == {'1': 1, '2': 1, '4': 1}
+
+
+def test_stage_report_add_reduce():
+    report = StageReport(reduce=[('DocWriter', 1.0)]) + StageReport(reduce=[('DocWriter', 2.0)])
+    assert report.reduce == [('DocWriter', 3.0)]
+    assert (StageReport() + StageReport(reduce=[('DocWriter', 2.0)])).reduce == [('DocWriter', 2.0)]
+
+
+def test_stage_report_add_caches():
+    cache1 = {'name': 'porter:eng', 'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 1}
+    cache2 = {'name': 'porter:eng', 'hits': 1, 'misses': 3, 'hit_rate': 0.25, 'size': 3}
+    report = StageReport(caches=[cache1]) + StageReport(caches=[cache2])
+    assert report.caches == [{'name': 'porter:eng', 'hits': 4, 'misses': 4, 'hit_rate': 0.5, 'size': 3}]
+    assert cache1['hits'] == 3
+
+
+def test_stage_report_add_task_metrics():
+    metrics1 = TaskMetrics('Reader')
+    metrics1.add(1.0, None)
+    metrics2 = TaskMetrics('Reader')
+    metrics2.add(3.0, None)
+    report1 = StageReport(1, tasks=[metrics1.report], time=1.0)
+    report2 = StageReport(1, tasks=[metrics2.report], time=3.0)
+    report = report1 + report2
+    assert report.tasks[0]['count'] == 2
+    assert report.tasks[0]['latency']['max'] == 3.0
+    assert report.throughput['items_per_sec'] == 0.5
+    report = dataclasses.replace(report, time=1.0)
+    assert report.throughput['items_per_sec'] == 2
+
+
+def test_report_from_dict():
+    report = Report(StageReport(3, [('Reader', 1.0)], time=2.0, reduce=[('DocWriter', 1.0)]))
+    data = json.loads(json.dumps(report, cls=DataclassJSONEncoder))
+    report = Report.from_dict(data)
+    assert report.stage1.count == 3
+    assert report.stage1.throughput['items_per_sec'] == 1.5
+    assert (report + report).stage1.timing == [('Reader', 2.0)]
+
+
+def write_part(job):
+    """Stand in for a sub-job that writes a file with its attempt number in the documents output"""
+    path = pathlib.Path(job.conf.run.path) / job.conf.documents.output
+    path.mkdir(parents=True)
+    (path / 'attempt').write_text(str(job.attempt))
+    return os.getpid(), 0.01, 0, Report(StageReport(1))
+
+
+def fail_first_attempt(job):
+    if job.attempt == 0:
+        raise ValueError('failed')
+    return write_part(job)
+
+
+def always_fail(job):
+    raise ValueError('failed')
+
+
+def process_items(seconds):
+    """Stand in for a pipeline that checks whether its job was stopped between items"""
+    end = time.time() + seconds
+    while time.time() < end:
+        if is_job_stopped():
+            raise JobStoppedError('stopped')
+        time.sleep(0.01)
+
+
+def hang_first_attempt_of_last_job(job):
+    MapScheduler.write_status(job.status_path, {'state': 'running', 'start': time.time()})
+    if job.id == 1 and job.attempt == 0:
+        process_items(60)
+    return write_part(job)
+
+
+def hang_first_attempt_of_last_job_without_stopping(job):
+    MapScheduler.write_status(job.status_path, {'state': 'running', 'start': time.time()})
+    if job.id == 1 and job.attempt == 0:
+        time.sleep(60)
+    return write_part(job)
+
+
+def always_hang(job):
+    MapScheduler.write_status(job.status_path, {'state': 'running', 'start': time.time()})
+    time.sleep(60)
+
+
+def fail_first_job_and_hang_others(job):
+    if job.id == 0:
+        raise ValueError('failed')
+    time.sleep(60)
+
+
+class TestMapScheduler:
+    def setup_method(self):
+        self.temp_dir = pathlib.Path(tempfile.mkdtemp())
+
+    def teardown_method(self):
+        shutdown_worker_pool()
+        delete_dir(self.temp_dir)
+
+    def create_jobs(self, num_jobs=2):
+        conf = RunnerConfig(
+            run=RunConfig(name='test', path=str(self.temp_dir), stage1=StageConfig(), stage2=False),
+            documents=DocumentsConfig(input=DocumentsInputConfig(format='jsonl', lang='eng', path='docs.jsonl'),
+                                      process=TextProcessorConfig(tokenize='whitespace'), output='docs'),
+        )
+        jobs = []
+        for i in range(num_jobs):
+            job_conf = conf.copy(deep=True)
+            job_conf.run.stage1.start = i
+            jobs.append(MultiprocessingJobDef(i, job_conf))
+        return jobs
+
+    def create_scheduler(self, func, **kwargs):
+        parallel_conf = ParallelConfig(name='mp', **kwargs)
+        scheduler = MapScheduler(self.temp_dir, 'stage1', 2, parallel_conf, func,
+                                 MultiprocessingJob._update_stage1_output_paths)
+        scheduler.POLL_INTERVAL = 0.01
+        return scheduler
+
+    def read_attempt(self, job_id):
+        return int((self.temp_dir / f"part_{job_id}" / 'docs' / 'attempt').read_text())
+
+    def test_jobs_are_moved_to_parts(self):
+        report = self.create_scheduler(write_part).run(self.create_jobs())
+        assert report.stage1.count == 2
+        assert self.read_attempt(0) == 0
+        assert self.read_attempt(1) == 0
+        assert not list((self.temp_dir / 'attempts').iterdir())
+        status = MapScheduler.read_status(self.temp_dir / 'status' / 'stage1' / 'part_1.json')
+        assert status['state'] == 'complete'
+
+    def test_failed_jobs_are_retried(self):
+        report = self.create_scheduler(fail_first_attempt).run(self.create_jobs())
+        assert report.stage1.count == 2
+        assert self.read_attempt(0) == 1
+
+    def test_job_fails_after_retries(self):
+        with pytest.raises(PatapscoError):
+            self.create_scheduler(always_fail, retries=1).run(self.create_jobs(1))
+        status = MapScheduler.read_status(self.temp_dir / 'status' / 'stage1' / 'part_0.json')
+        assert status['state'] == 'failed'
+
+    def test_complete_jobs_are_skipped_on_relaunch(self):
+        jobs = self.create_jobs()
+        self.create_scheduler(write_part).run(jobs)
+        report = self.create_scheduler(always_fail).run(jobs)
+        assert report.stage1.count == 2
+
+    def test_changed_jobs_are_not_skipped_on_relaunch(self):
+        jobs = self.create_jobs()
+        self.create_scheduler(write_part).run(jobs)
+        jobs[1].conf.documents.process.tokenize = 'moses'
+        scheduler = self.create_scheduler(fail_first_attempt)
+        report = scheduler.run(jobs)
+        assert report.stage1.count == 2
+        assert scheduler.attempts[1] == 2
+        assert 0 not in scheduler.attempts
+
+    def test_slow_job_is_duplicated(self):
+        start = time.time()
+        scheduler = self.create_scheduler(hang_first_attempt_of_last_job, speculation=3)
+        report = scheduler.run(self.create_jobs())
+        assert time.time() - start < 30
+        assert report.stage1.count == 2
+        assert self.read_attempt(1) == 1
+        # only the slower duplicate is stopped so the pool is kept
+        assert get_worker_pool(2, 2) is scheduler.pool
+        assert scheduler.pool.submit(os.getpid).result()
+
+    def test_duplicate_that_does_not_stop_is_terminated(self):
+        start = time.time()
+        scheduler = self.create_scheduler(hang_first_attempt_of_last_job_without_stopping, speculation=3)
+        scheduler.STOP_WAIT = 0.5
+        report = scheduler.run(self.create_jobs())
+        assert time.time() - start < 30
+        assert report.stage1.count == 2
+        assert self.read_attempt(1) == 1
+        # the worker of the hung duplicate is not reused
+        assert scheduler.pool is None
+
+    def test_hung_job_fails_after_timeout(self):
+        start = time.time()
+        with pytest.raises(PatapscoError, match='TimeoutError'):
+            self.create_scheduler(always_hang, retries=1, speculation=None, timeout=0.5).run(self.create_jobs(1))
+        assert time.time() - start < 30
+
+    def test_failed_job_does_not_wait_on_hung_jobs(self):
+        start = time.time()
+        with pytest.raises(PatapscoError):
+            self.create_scheduler(fail_first_job_and_hang_others, retries=0).run(self.create_jobs())
+        assert time.time() - start < 30
+
+    def test_slow_job_is_not_duplicated_without_speculation(self):
+        scheduler = self.create_scheduler(write_part, speculation=None)
+        scheduler.run(self.create_jobs())
+        assert not scheduler.speculated
+
+
+def fail_first_group_and_hang_others(group, conf, level, debug):
+    if group == 0:
+        raise ValueError('failed')
+    time.sleep(60)
+
+
+def test_failed_reduce_does_not_wait_on_hung_reducers(tmp_path, monkeypatch):
+    for part in range(6):
+        (tmp_path / f"part_{part}").mkdir()
+    conf = RunnerConfig(
+        run=RunConfig(name='test', path=str(tmp_path), stage1=StageConfig(num_jobs=3), stage2=False,
+                      parallel=ParallelConfig(name='mp', fan_in=2)),
+        documents=DocumentsConfig(input=DocumentsInputConfig(format='jsonl', lang='eng', path='docs.jsonl'),
+                                  process=TextProcessorConfig(tokenize='whitespace'), output='docs'),
+    )
+    monkeypatch.setattr(MultiprocessingJob, '_reduce_fork', staticmethod(fail_first_group_and_hang_others))
+    job = MultiprocessingJob.__new__(MultiprocessingJob)
+    job.conf = conf
+    job.run_path = str(tmp_path)
+    job.debug = False
+    start = time.time()
+    try:
+        with pytest.raises(PatapscoError, match='reduce failed'):
+            job._reduce_stage1()
+    finally:
+        shutdown_worker_pool()
+    assert time.time() - start < 30
+
+
+def test_get_reduce_levels():
+    assert get_reduce_levels(100, None) == []
+    assert get_reduce_levels(32, 32) == []
+    assert get_reduce_levels(100, 32) == [4]
+    assert get_reduce_levels(1000, 10) == [100, 10]
+    assert get_reduce_levels(1001, 10) == [101, 11, 2]
+
+
+def test_get_reduce_parts(tmp_path):
+    for name in ['part_0', 'part_1', 'part_10', 'part_2', 'reduce_1/part_0', 'reduce_1/part_1']:
+        (tmp_path / name).mkdir(parents=True)
+    assert [path.name for path in get_reduce_parts(tmp_path, 1)] == ['part_0', 'part_1', 'part_2', 'part_10']
+    assert get_reduce_parts(tmp_path, 2) == [tmp_path / 'reduce_1' / 'part_0', tmp_path / 'reduce_1' / 'part_1']
+    assert get_reduce_parts(tmp_path) == get_reduce_parts(tmp_path, 2)
+
+
+def test_multiprocessing_tree_reduce(tmp_path):
+    path = tmp_path / 'docs.jsonl'
+    with open(path, 'w') as fp:
+        for i in range(100):
+            fp.write(json.dumps({'id': str(i), 'title': '', 'date': None, 'text': 'some words ' * (i % 7 + 1)}) + '\n')
+    conf = RunnerConfig(
+        run=RunConfig(name='test', path=str(tmp_path / 'run'), parallel=ParallelConfig(name='mp', fan_in=2),
+                      stage1=StageConfig(num_jobs=2, shard_size=300), stage2=False),
+        documents=DocumentsConfig(input=DocumentsInputConfig(format='jsonl', lang='eng', path=str(path)),
+                                  process=TextProcessorConfig(tokenize='whitespace', stem=False), output='docs'),
+        database=DatabaseConfig(output='database'),
+    )
+    JobBuilder(conf).build(False).run()
+    with open(tmp_path / 'run' / 'docs' / 'documents.jsonl') as fp:
+        assert [json.loads(line)['id'] for line in fp] == [str(i) for i in range(100)]
+    with open(tmp_path / 'run' / 'timing.json') as fp:
+        reduce_times = json.load(fp)['stage1']['reduce']
+    assert reduce_times[0][0] == 'level_1'
+    assert not list((tmp_path / 'run').glob('reduce_*'))
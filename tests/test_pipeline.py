@@ -1,4 +1,16 @@
+import itertools
+import pathlib
+import threading
+import time
+import weakref
+
+import pytest
+
 from patapsco.pipeline import *
+from patapsco.pipeline import _part_key
+from patapsco.error import JobStoppedError
+from patapsco.util import pool
+from patapsco.util.file import open_output, sync_output
 
 
 class AddTask(Task):
@@ -83,3 +95,390 @@ def test_batch_pipeline_reject_item():
     pipeline.run()
     assert pipeline.count == 4
     assert collector.items == [3, 9, 12, 15]
+
+
+class SinkCollectorTask(CollectorTask):
+    sink = True
+
+
+class FailingSinkTask(Task):
+    sink = True
+
+    def process(self, item):
+        raise ValueError("bad item")
+
+
+def test_streaming_pipeline_with_queues():
+    collector = SinkCollectorTask()
+    pipeline = StreamingPipeline(NumberGenerator(), [AddTask(), RejectorTask(), MultiplyTask(), collector],
+                                 prefetch=2, write_queue=2)
+    pipeline.run()
+    assert pipeline.count == 4
+    assert collector.items == [2, 6, 8, 10]
+    assert [queue['name'] for queue in pipeline.queue_report] == ['reader', 'writer']
+
+
+def test_streaming_pipeline_with_failing_sink():
+    pipeline = StreamingPipeline(NumberGenerator(), [AddTask(), FailingSinkTask()], write_queue=1)
+    with pytest.raises(ValueError):
+        pipeline.run()
+
+
+class StoppingTask(Task):
+    """Asks the job to stop when it sees the item"""
+    def __init__(self, path, item):
+        super().__init__()
+        self.path = path
+        self.item = item
+
+    def process(self, item):
+        if item == self.item:
+            pool.stop_job(self.path)
+        return item
+
+
+class EndedSinkTask(SinkCollectorTask):
+    def __init__(self):
+        super().__init__()
+        self.ended = False
+
+    def end(self):
+        self.ended = True
+
+
+def test_stopped_pipeline_writes_pending_items_and_ends_tasks(tmp_path, monkeypatch):
+    monkeypatch.setattr(pool, 'STOP_CHECK_INTERVAL', 0)
+    path = str(tmp_path / 'job.pid')
+    sink = EndedSinkTask()
+    pipeline = StreamingPipeline(NumberGenerator(), [AddTask(), StoppingTask(path, 2), sink], write_queue=2)
+    with pytest.raises(JobStoppedError):
+        pool.run_stoppable(path, pipeline.run)
+    assert sink.items == [1, 2]
+    assert sink.ended
+    assert not pathlib.Path(path).exists()
+
+
+def test_batch_pipeline_with_queues():
+    collector = SinkCollectorTask()
+    pipeline = BatchPipeline(NumberGenerator(), [AddTask(), RejectorTask(), MultiplyTask(), collector], 2,
+                             prefetch=1, write_queue=1)
+    pipeline.run()
+    assert pipeline.count == 4
+    assert collector.items == [3, 9, 12, 15]
+
+
+class SlowTask(Task):
+    def process(self, item):
+        if item.id == 3:
+            time.sleep(0.05)
+        return item
+
+
+class Item:
+    def __init__(self, id):
+        self.id = id
+        self.text = 'abc'
+
+
+def test_streaming_pipeline_metrics():
+    pipeline = StreamingPipeline(iter([Item(x) for x in range(5)]), [SlowTask(), CollectorTask()], slow_threshold=0.04)
+    pipeline.run()
+    report = pipeline.metrics_report
+    assert [task['count'] for task in report] == [5, 5, 5]
+    assert [task['bytes'] for task in report] == [15, 15, 15]
+    assert report[1]['slow_items'][0][0] == '3'
+    assert report[1]['latency']['max'] >= 0.05
+    assert report[2]['slow_items'] == []
+
+
+def test_batch_pipeline_metrics():
+    pipeline = BatchPipeline(NumberGenerator(), [AddTask(), MultiplyTask()], 2)
+    pipeline.run()
+    report = pipeline.metrics_report
+    assert [task['count'] for task in report] == [5, 5, 5]
+    assert pipeline.tasks[1].time > 0
+
+
+def test_batch_pipeline_metrics_reuse_input_bytes():
+    pipeline = BatchPipeline(iter([Item(x) for x in range(5)]), [PassTask(), CollectorTask()], 2)
+    pipeline.run()
+    report = pipeline.metrics_report
+    assert [task['bytes'] for task in report] == [15, 15, 15]
+
+
+class PassTask(Task):
+    def process(self, item):
+        return item
+
+
+class BatchSizeTask(Task):
+    sink = True
+
+    def __init__(self):
+        super().__init__()
+        self.sizes = []
+
+    def process(self, item):
+        return item
+
+    def batch_process(self, items):
+        self.sizes.append(len(items))
+        return items
+
+
+@pytest.mark.parametrize('write_queue', [None, 1])
+def test_batch_pipeline_releases_batches(write_queue):
+    refs = []
+    # the generator holds the last item and with a writer thread, the previous batch can still be in the writer
+    lag = 4 if write_queue else 1
+
+    def generate():
+        for x in range(12):
+            if x % 3 == 0:
+                # a batch consumed by all the tasks should not be held by anything
+                assert all(ref() is None for ref in refs[:max(0, x - lag)])
+            item = Item(x)
+            refs.append(weakref.ref(item))
+            yield item
+
+    sizer = BatchSizeTask()
+    pipeline = BatchPipeline(generate(), [PassTask(), sizer], None, write_queue=write_queue, batch_bytes=9)
+    pipeline.run()
+    assert sizer.sizes == [3, 3, 3, 3]
+    assert pipeline.count == 12
+
+
+class Text:
+    def __init__(self, text):
+        self.text = text
+
+
+class RecordingBatchTask(Task):
+    def __init__(self, delay=0):
+        super().__init__()
+        self.batches = []
+        self.delay = delay
+
+    def process(self, item):
+        return item
+
+    def batch_process(self, items):
+        self.batches.append([item.text for item in items])
+        time.sleep(self.delay * sum(len(item.text) for item in items))
+        return [Text(item.text.upper()) if item.text != 'bad' else None for item in items]
+
+
+def test_adaptive_batch_task_splits_by_chars():
+    task = RecordingBatchTask()
+    batcher = AdaptiveBatchTask(task, batch_chars=4)
+    results = batcher.batch_process([Text(x) for x in ['ab', 'cd', 'efghij', 'k', 'l']])
+    assert task.batches == [['ab', 'cd'], ['efghij'], ['k', 'l']]
+    assert [item.text for item in results] == ['AB', 'CD', 'EFGHIJ', 'K', 'L']
+    assert batcher.report['sizes'] == {'1': 1, '2': 2}
+
+
+def test_adaptive_batch_task_sorts_within_window_and_restores_order():
+    task = RecordingBatchTask()
+    batcher = AdaptiveBatchTask(task, batch_chars=5, sort_window=4)
+    texts = ['aaaa', 'b', 'bad', 'cc', 'dddd', 'e']
+    results = batcher.batch_process([Text(x) for x in texts])
+    assert task.batches == [['b', 'cc'], ['bad'], ['aaaa', 'e'], ['dddd']]
+    assert [item.text if item else None for item in results] == ['AAAA', 'B', None, 'CC', 'DDDD', 'E']
+
+
+def test_adaptive_batch_task_adjusts_toward_target_latency():
+    task = RecordingBatchTask(delay=0.001)
+    # 100 chars takes about 0.1 seconds so a target of 0.02 seconds should shrink the budget to about 20 chars
+    batcher = AdaptiveBatchTask(task, batch_chars=100, target_latency=0.02)
+    batcher.batch_process([Text('a' * 10) for _ in range(30)])
+    assert 10 <= batcher.budget < 50
+    assert batcher.report['max_items'] == 10
+    assert batcher.report['min_items'] < 5
+
+
+def test_batch_pipeline_with_adaptive_batching():
+    task = RecordingBatchTask()
+    collector = CollectorTask()
+    pipeline = BatchPipeline(iter([Text(x) for x in ['ab', 'cd', 'bad', 'ef']]), [task, collector], None,
+                             batch_chars=4)
+    pipeline.run()
+    assert [item.text for item in collector.items] == ['AB', 'CD', 'EF']
+    assert task.batches == [['ab', 'cd'], ['bad'], ['ef']]
+    assert pipeline.batch_report[0]['name'] == 'RecordingBatchTask'
+    assert pipeline.batch_report[0]['batches'] == 3
+
+
+class ReducingTask(Task):
+    def __init__(self, name, log, barrier=None):
+        super().__init__()
+        self.name = name
+        self.log = log
+        self.barrier = barrier
+        self.independent_reduce = barrier is not None
+
+    def process(self, item):
+        return item
+
+    def run_reduce(self, parts=None, directory=None):
+        if self.barrier:
+            # only passes if the other independent reduce is running at the same time
+            self.barrier.wait()
+        self.log.append(self.name)
+
+    def __str__(self):
+        return self.name
+
+
+class DirsTask(Task):
+    def __init__(self, run_path, base):
+        super().__init__(run_path, base=base)
+        self.dirs = None
+
+    def process(self, item):
+        return item
+
+    def reduce(self, dirs):
+        self.dirs = dirs
+
+
+def test_task_run_reduce_globs_parts(tmp_path):
+    for name in ['part_10', 'part_2', 'reduce_1']:
+        (tmp_path / name).mkdir()
+    task = DirsTask(tmp_path, 'index')
+    task.run_reduce()
+    assert task.dirs == [tmp_path / 'part_2' / 'index', tmp_path / 'part_10' / 'index']
+
+
+def test_task_run_reduce_into_intermediate_part(tmp_path):
+    task = DirsTask(tmp_path, 'reduce_1/part_0/index')
+    task.run_reduce([tmp_path / 'part_0', tmp_path / 'part_1'], 'reduce_1/part_0')
+    assert task.dirs == [tmp_path / 'part_0' / 'index', tmp_path / 'part_1' / 'index']
+
+
+def test_pipeline_reduce_runs_independent_tasks_concurrently():
+    log = []
+    barrier = threading.Barrier(2, timeout=5)
+    tasks = [ReducingTask('a', log), ReducingTask('b', log, barrier), ReducingTask('c', log),
+             ReducingTask('d', log, barrier)]
+    pipeline = StreamingPipeline(NumberGenerator(), tasks)
+    pipeline.reduce()
+    assert sorted(log) == ['a', 'b', 'c', 'd']
+    assert log.index('a') < log.index('c')
+    assert [name for name, _ in pipeline.reduce_report] == ['a', 'b', 'c', 'd']
+
+
+def test_part_key_sorts_numerically():
+    dirs = [pathlib.Path('part_10'), pathlib.Path('part_2'), pathlib.Path('part_1')]
+    assert [d.name for d in sorted(dirs, key=_part_key)] == ['part_1', 'part_2', 'part_10']
+
+
+class FileWriterTask(Task):
+    sink = True
+
+    def __init__(self, path, fail_on=None):
+        super().__init__()
+        self.path = path
+        self.fail_on = fail_on
+        self.offset = None
+        self.file = None
+
+    def begin(self):
+        self.file = open_output(self.path, self.offset)
+
+    def process(self, item):
+        if item == self.fail_on:
+            raise RuntimeError("crash")
+        self.file.write(f"{item}\n")
+        return item
+
+    def checkpoint(self):
+        return {'offset': sync_output(self.file)}
+
+    def restore(self, state):
+        self.offset = state['offset']
+
+    def end(self):
+        self.file.close()
+
+
+@pytest.mark.parametrize('write_queue', [None, 2])
+def test_streaming_pipeline_resume_from_checkpoint(tmp_path, write_queue):
+    path = tmp_path / 'output.txt'
+    checkpoint_path = tmp_path / 'checkpoint.json'
+    writer = FileWriterTask(path, fail_on=6)
+    pipeline = StreamingPipeline(iter(range(10)), [AddTask(), writer], write_queue=write_queue,
+                                 checkpoint=Checkpointer(checkpoint_path, 2, ['test']))
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+    writer.file.close()
+    # items 1 to 4 were checkpointed and 5 was written after the checkpoint
+    assert path.read_text() == '1\n2\n3\n4\n5\n'
+
+    checkpoint = Checkpointer(checkpoint_path, 2, ['test'])
+    assert checkpoint.position == 4
+    iterator = itertools.islice(range(10), checkpoint.position, None)
+    pipeline = StreamingPipeline(iterator, [MultiplyTask(), FileWriterTask(path)], write_queue=write_queue,
+                                 checkpoint=checkpoint)
+    pipeline.run()
+    assert pipeline.count == 10
+    assert path.read_text() == '1\n2\n3\n4\n8\n10\n12\n14\n16\n18\n'
+    assert not checkpoint_path.exists()
+
+
+def test_checkpointer_ignores_different_plan(tmp_path):
+    checkpoint = Checkpointer(tmp_path / 'checkpoint.json', 2, ['documents'])
+    checkpoint.save(2, 2, [AddTask()])
+    assert Checkpointer(tmp_path / 'checkpoint.json', 2, ['documents']).position == 2
+    assert Checkpointer(tmp_path / 'checkpoint.json', 2, ['index']).state is None
+
+
+class ParallelAddTask(AddTask):
+    parallel = True
+
+
+class ParallelMultiplyTask(MultiplyTask):
+    parallel = True
+
+
+class ParallelRejectorTask(RejectorTask):
+    parallel = True
+
+
+class LongNumberGenerator(NumberGenerator):
+    def __init__(self):
+        self.docs = iter(range(1000))
+
+
+def test_parallel_pipeline():
+    collector = CollectorTask()
+    tasks = [ParallelAddTask(), ParallelMultiplyTask(), collector]
+    pipeline = ParallelPipeline(LongNumberGenerator(), tasks, num_workers=2, chunk_size=7)
+    pipeline.run()
+    assert pipeline.count == 1000
+    # the workers use batch_process() which multiplies by 3
+    assert collector.items == [3 * (x + 1) for x in range(1000)]
+
+
+def test_parallel_pipeline_reject_item():
+    collector = CollectorTask()
+    tasks = [ParallelAddTask(), ParallelRejectorTask(), ParallelMultiplyTask(), collector]
+    pipeline = ParallelPipeline(NumberGenerator(), tasks, num_workers=2, chunk_size=2)
+    pipeline.run()
+    assert pipeline.count == 4
+    assert collector.items == [3, 9, 12, 15]
+
+
+def test_parallel_pipeline_split():
+    pipeline = ParallelPipeline(NumberGenerator(), [ParallelAddTask(), CollectorTask(), ParallelMultiplyTask()], 2)
+    assert [str(task) for task in pipeline.worker_tasks] == ['ParallelAddTask']
+    assert [str(task) for task in pipeline.sink_tasks] == ['CollectorTask', 'ParallelMultiplyTask']
+
+
+def test_parallel_pipeline_merges_worker_metrics():
+    tasks = [ParallelAddTask(), ParallelMultiplyTask(), CollectorTask()]
+    pipeline = ParallelPipeline(LongNumberGenerator(), tasks, num_workers=2, chunk_size=7)
+    pipeline.run()
+    report = pipeline.metrics_report
+    assert [task['name'] for task in report] == ['NumberGenerator', 'ParallelAddTask', 'ParallelMultiplyTask',
+                                                 'CollectorTask']
+    assert [task['count'] for task in report] == [1000, 1000, 1000, 1000]
@@ -1,6 +1,7 @@
 import pytest
 
-from patapsco.schema import TextProcessorConfig
+from patapsco.pipeline import ParallelPipeline
+from patapsco.schema import NgramConfig, NormalizationConfig, SpacyConfig, StanzaConfig, TextProcessorConfig
 from patapsco.text import *
 
 
@@ -50,6 +51,110 @@ def test_porter_stemmer_long_token():
     assert tokens == stemmer.stem(tokens)
 
 
+def test_tokens_keep_lemmas():
+    tokens = Tokens(['The', 'dogs'], ['the', 'dog'])
+    assert tokens == ['The', 'dogs']
+    assert tokens.lemmas == ['the', 'dog']
+    assert not hasattr(tokens[1:], 'lemmas')
+
+
+def test_tokenize_batch_default():
+    tokenizer = WhiteSpaceTokenizer('eng', None)
+    assert tokenizer.tokenize_batch(['a b', '', 'c']) == [['a', 'b'], [], ['c']]
+
+
+class PositionStemmer(Stemmer):
+    """Stemmer whose stems depend on the position of the token like a lemmatizer"""
+    contextual = True
+
+    def stem(self, tokens):
+        return [f"{token}{index}" for index, token in enumerate(tokens)]
+
+
+class TestProcessTokens:
+    tokens = ['The', 'clocks', 'WERE', 'striking', '', 'ΟΔΟΣ', 'Σ', "Σ'", 'İstanbul', 'a', 'thirteen', 'An']
+
+    @pytest.mark.parametrize('stopwords', ['lucene', False])
+    @pytest.mark.parametrize('stem', ['porter', False])
+    @pytest.mark.parametrize('lowercase', [True, False])
+    def test_same_as_steps(self, stopwords, stem, lowercase):
+        conf = TextProcessorConfig(tokenize='whitespace', stopwords=stopwords, stem=stem,
+                                   normalize=NormalizationConfig(lowercase=lowercase))
+        processor = TextProcessor(None, conf, 'eng')
+        processor.begin()
+        assert processor.fused
+        assert processor.process_tokens(self.tokens) == processor._process_tokens_in_steps(self.tokens)
+
+    def test_contextual_stemmer_gets_all_tokens(self):
+        processor = TextProcessor(None, TextProcessorConfig(tokenize='whitespace'), 'eng')
+        processor.begin()
+        processor.stemmer = PositionStemmer('eng')
+        assert processor.process_tokens(self.tokens) == processor._process_tokens_in_steps(self.tokens)
+        assert processor.process_tokens(['the', 'dog']) == 'dog1'
+
+
+class CachedStemTask(Task):
+    """Stems a token with its own cache in the workers of a parallel pipeline"""
+    parallel = True
+
+    def process(self, item):
+        cache = StemCache.get_cache('porter', 'eng')
+        if cache.get(item) is None:
+            cache.put(item, item)
+        return item
+
+
+class TestStemCache:
+    def setup_method(self):
+        StemCache.caches = {}
+
+    def test_cached_stemmer_matches_stemmer(self):
+        tokens = ['the', 'clocks', 'were', 'striking', 'clocks', 'the']
+        stemmer = CachedStemmer(PorterStemmer('eng'), StemCache('test', 10))
+        assert stemmer.stem(tokens) == PorterStemmer('eng').stem(tokens)
+        assert (stemmer.cache.hits, stemmer.cache.misses) == (2, 4)
+
+    def test_evicts_least_recently_used(self):
+        cache = StemCache('test', 2)
+        cache.put('a', 'a')
+        cache.put('b', 'b')
+        cache.get('a')
+        cache.put('c', 'c')
+        assert list(cache.stems) == ['a', 'c']
+
+    def test_take_report(self):
+        cache = StemCache.get_cache('porter', 'eng')
+        cache.put('clocks', 'clock')
+        cache.get('clocks')
+        cache.get('days')
+        assert StemCache.take_report() == [{'name': 'porter:eng', 'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'size': 1}]
+        assert StemCache.take_report() == []
+
+    def test_parallel_pipeline_sends_stats_of_workers(self):
+        pipeline = ParallelPipeline(iter(['a', 'b', 'a', 'a']), [CachedStemTask()], num_workers=1, chunk_size=2)
+        pipeline.run()
+        # the tokens were stemmed in the worker process
+        assert StemCache.take_report() == []
+        assert pipeline.worker_caches == [[{'name': 'porter:eng', 'hits': 2, 'misses': 2, 'hit_rate': 0.5,
+                                            'size': 2}]]
+
+    def test_persist(self, tmp_path):
+        path = tmp_path / 'stems.json'
+        cache = StemCache('test', 2, path)
+        cache.put('clocks', 'clock')
+        cache.save()
+        other = StemCache('test', 2, path)
+        other.put('days', 'day')
+        other.put('years', 'year')
+        other.save()
+        # the least recently used are dropped when merging into the file
+        assert list(StemCache('test', 2, path).stems.items()) == [('days', 'day'), ('years', 'year')]
+
+    def test_get_cache_is_shared(self):
+        assert StemCache.get_cache('porter', 'eng') is StemCache.get_cache('porter', 'eng')
+        assert StemCache.get_cache('porter', 'eng') is not StemCache.get_cache('parsivar', 'fas')
+
+
 class TestTokenizerStemmerFactory:
     def setup_method(self):
         TokenizerStemmerFactory.tokenizer_cache = {}
@@ -81,6 +186,15 @@ class TestTokenizerStemmerFactory:
     def test_validate_stanza_porter_en(self):
         TokenizerStemmerFactory.validate(TextProcessorConfig(tokenize="stanza", stem="porter"), "eng")
 
+    def test_validate_ngram_split(self):
+        with pytest.raises(ConfigError, match="Unknown ngram split"):
+            TokenizerStemmerFactory.validate(TextProcessorConfig(tokenize="ngram", ngram=NgramConfig(split="x")), "eng")
+
+    def test_create_tokenizer_ngram_punct(self):
+        conf = TextProcessorConfig(tokenize="ngram", ngram=NgramConfig(n=3, split="punct"))
+        tokenizer = TokenizerStemmerFactory.create_tokenizer(conf, "eng")
+        assert (tokenizer.n, tokenizer.nlp) == (3, None)
+
     def test_validate_parsivar(self):
         TokenizerStemmerFactory.validate(TextProcessorConfig(tokenize="moses", stem="parsivar"), "fas")
         TokenizerStemmerFactory.validate(TextProcessorConfig(tokenize="spacy", stem="parsivar"), "fas")
@@ -115,11 +229,17 @@ class TestTokenizerStemmerFactory:
 
     @pytest.mark.slow(reason="loads spacy model")
     def test_create_tokenizer_spacy_no_stem(self):
-        conf = TextProcessorConfig(tokenize="spacy", stem=False)
+        conf = TextProcessorConfig(tokenize="spacy", stem=False, spacy=SpacyConfig(blank=False))
         tokenizer = TokenizerStemmerFactory.create_tokenizer(conf, "eng")
         assert isinstance(tokenizer, SpacyNLP)
         assert 'tok2vec' in tokenizer.nlp.disabled
 
+    def test_create_tokenizer_spacy_blank(self):
+        conf = TextProcessorConfig(tokenize="spacy", stem=False)
+        tokenizer = TokenizerStemmerFactory.create_tokenizer(conf, "eng")
+        assert isinstance(tokenizer, SpacyNLP)
+        assert tokenizer.nlp.component_names == []
+
     @pytest.mark.slow(reason="loads spacy model")
     def test_create_tokenizer_spacy_with_stem(self):
         conf = TextProcessorConfig(tokenize="spacy", stem="spacy")
@@ -127,9 +247,20 @@ class TestTokenizerStemmerFactory:
         assert isinstance(tokenizer, SpacyNLP)
         assert 'tok2vec' not in tokenizer.nlp.disabled
 
+    def test_create_tokenizer_stanza_cache_key_has_settings(self):
+        conf = TextProcessorConfig(tokenize="stanza", stem=False)
+        TokenizerStemmerFactory.tokenizer_cache[f"stanza:eng:{conf.stanza.json()}"] = 'cached'
+        assert TokenizerStemmerFactory.create_tokenizer(conf, "eng") == 'cached'
+
     def test_create_stemmer_porter(self):
         conf = TextProcessorConfig(tokenize="spacy", stem="porter")
         stemmer = TokenizerStemmerFactory.create_stemmer(conf, "eng")
+        assert isinstance(stemmer, CachedStemmer)
+        assert isinstance(stemmer.stemmer, PorterStemmer)
+
+    def test_create_stemmer_porter_without_cache(self):
+        conf = TextProcessorConfig(tokenize="spacy", stem="porter", stem_cache=None)
+        stemmer = TokenizerStemmerFactory.create_stemmer(conf, "eng")
         assert isinstance(stemmer, PorterStemmer)
 
     @pytest.mark.slow(reason="loads spacy model")
@@ -170,6 +301,14 @@ class TestStanza:
         tokens = tokenizer.tokenize("Mary had a little lamb.")
         assert tokens == ['Mary', 'had', 'a', 'little', 'lamb', '.']
 
+    @pytest.mark.slow
+    def test_stemmer_english_keeps_tokens_aligned(self):
+        # tokens that did not come from tokenize() get a lemma each even if stanza would split them
+        nlp = StanzaNLP(lang='eng', model_path=self.model_path, stem=True)
+        lemmas = nlp.stem(['police', "don't", 'told'])
+        assert len(lemmas) == 3
+        assert lemmas[2] == 'tell'
+
     @pytest.mark.slow
     def test_stemmer_english(self):
         text = 'It\'s fleece was white as snow.'
@@ -178,6 +317,20 @@ class TestStanza:
         tokens = nlp.tokenize(text)
         assert ans == nlp.stem(tokens)
 
+    @pytest.mark.slow
+    def test_stemmer_english_batch(self):
+        texts = ['It\'s fleece was white as snow.', 'Mary had a little lamb.']
+        nlp = StanzaNLP(lang='eng', model_path=self.model_path, stem=True)
+        batch = nlp.tokenize_batch(texts, batch_size=1)
+        assert [nlp.stem(tokens) for tokens in batch] == [nlp.stem(nlp.tokenize(text)) for text in texts]
+
+    @pytest.mark.slow
+    def test_tokenizer_pretokenized(self):
+        config = StanzaConfig(pretokenized=True, threads=1, tokenize_batch_size=1000)
+        tokenizer = StanzaNLP(lang='eng', model_path=self.model_path, stem=False, config=config)
+        tokens = tokenizer.tokenize("Mary had a little-lamb.")
+        assert tokens == ['Mary', 'had', 'a', 'little-lamb.']
+
     @pytest.mark.slow
     def test_tokenizer_farsi(self):
         tokenizer = StanzaNLP(lang='fas', model_path=self.model_path, stem=False)
@@ -209,6 +362,19 @@ class TestStanza:
 
 
 class TestSpacy:
+    def test_blank_tokenizer_english(self):
+        tokenizer = SpacyNLP(lang='eng', model_path=None, stem=False, blank=True)
+        assert tokenizer.tokenize("Mary didn't have a lamb.") == ['Mary', 'did', "n't", 'have', 'a', 'lamb', '.']
+        assert tokenizer.tokenize_batch(["Mary had a lamb.", "It's white."], batch_size=1) == \
+            [['Mary', 'had', 'a', 'lamb', '.'], ['It', "'s", 'white', '.']]
+
+    def test_blank_tokenizer_uses_multi_language_rules_without_model(self):
+        # the languages without a model use the rules of the multi-language model
+        tokenizer = SpacyNLP(lang='fas', model_path=None, stem=False, blank=True)
+        assert tokenizer.nlp.lang == 'xx'
+        assert tokenizer.tokenize("شما بليز رو به فارسی چی میگین؟") == ['شما', 'بليز', 'رو', 'به', 'فارسی', 'چی',
+                                                                        'میگین', '؟']
+
     @pytest.mark.slow
     def test_tokenizer_arabic(self):
         tokenizer = SpacyNLP(lang='ara', model_path=None, stem=False)
@@ -235,6 +401,15 @@ class TestSpacy:
         tokens = nlp.tokenize(text)
         assert ans == nlp.stem(tokens)
 
+    @pytest.mark.slow
+    def test_stemmer_english_batch(self):
+        texts = ['A witness told police.', 'The victim had attacked the suspect.']
+        nlp = SpacyNLP(lang='eng', model_path=None, stem=True)
+        batch = nlp.tokenize_batch(texts, batch_size=1)
+        # the lemmas stay with their document rather than with the last document parsed
+        assert [nlp.stem(tokens) for tokens in batch] == [['a', 'witness', 'tell', 'police', '.'],
+                                                          ['the', 'victim', 'have', 'attack', 'the', 'suspect', '.']]
+
     @pytest.mark.slow
     def test_tokenizer_farsi(self):
         tokenizer = SpacyNLP(lang='fas', model_path=None, stem=False)
@@ -323,6 +498,31 @@ class TestMoses:
 
 
 class TestNgramTokenizer:
+    def test_punct_split(self):
+        text = "Roses are red. Violets are blue."
+        tokenizer = NgramTokenizer(lang='eng', model_path=None, split='punct')
+        assert tokenizer.tokenize(text) == [
+            'Roses', 'oses ', 'ses a', 'es ar', 's are', ' are ', 'are r', 're re', 'e red', ' red.',
+            'Viole', 'iolet', 'olets', 'lets ', 'ets a', 'ts ar', 's are', ' are ', 'are b', 're bl', 'e blu', ' blue', 'blue.'
+        ]
+
+    def test_punct_split_cjk_and_newlines(self):
+        tokenizer = NgramTokenizer(lang='zho', model_path=None, split='punct')
+        assert tokenizer.tokenize("不但要看。而且\n要帮") == ['不但', '但要', '要看', '看。', '而且', '要帮']
+
+    def test_no_split(self):
+        tokenizer = NgramTokenizer(lang='eng', model_path=None, n=3, split='none')
+        assert tokenizer.tokenize("ab. cd") == ['ab.', 'b. ', '. c', ' cd']
+        assert tokenizer.tokenize("ab") == []
+
+    def test_batch(self):
+        tokenizer = NgramTokenizer(lang='eng', model_path=None, n=2, split='punct')
+        assert tokenizer.tokenize_batch(["ab. cd", "", "xyz"]) == [['ab', 'b.', 'cd'], [], ['xy', 'yz']]
+
+    def test_unknown_split(self):
+        with pytest.raises(ConfigError):
+            NgramTokenizer(lang='eng', model_path=None, split='words')
+
     @pytest.mark.slow
     def test_stanza_tokenizer_english(self):
         text = "Roses are red. Violets are blue."
@@ -176,6 +176,15 @@ class TestPSQ:
         query = generator.generate(Query(1, '', '', '', ''), '', ['cat', 'error'])
         assert query.query == "psq AND (gato^0.8421 felino^0.1579)"
 
+    def test_psq_table_is_cached(self):
+        path = pathlib.Path(__file__).parent / 'psq_files' / 'psq.json'
+        processor = TextProcessor(self.temp_dir, TextProcessorConfig(tokenize="whitespace", stem=False), 'eng')
+        generator1 = PSQGenerator(processor, path, 0.97)
+        generator2 = PSQGenerator(processor, path, 0.97)
+        generator3 = PSQGenerator(processor, path, 0.5)
+        assert generator1.psq_table is generator2.psq_table
+        assert generator1.psq_table is not generator3.psq_table
+
 
 def test_lucene_query_transformer():
     text_config = TextProcessorConfig(
@@ -244,3 +253,12 @@ class TestQueryProcessor:
                                parse=True)
         with pytest.raises(ConfigError):
             QueryProcessor('', config, 'eng')
+
+    def test_batch_process_matches_process(self):
+        config = QueriesConfig(process=TextProcessorConfig(tokenize="whitespace", stem="porter"))
+        processor = QueryProcessor('', config, 'eng')
+        processor.begin()
+        queries = [Query('1', 'eng', None, 'The running dogs', None), Query('2', 'eng', None, 'wonderful cats', None)]
+        expected = [processor.process(query) for query in queries]
+        assert processor.batch_process(queries) == expected
+        assert [query.query for query in expected] == ['run dog', 'wonder cat']
@@ -1,4 +1,6 @@
+import itertools
 import pathlib
+import tempfile
 
 import pytest
 
@@ -31,6 +33,183 @@ def test_chunked_iterator_all():
         next(it)
 
 
+def test_chunked_iterator_all_empty():
+    it = ChunkedIterator(iter([]), None)
+    assert next(it) == []
+    with pytest.raises(StopIteration):
+        next(it)
+
+
+class Text:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_chunked_iterator_max_bytes():
+    data = [Text('ab'), Text('cd'), Text('ef'), Text('ghijkl'), Text('m')]
+    it = ChunkedIterator(iter(data), None, max_bytes=4)
+    assert [[x.text for x in chunk] for chunk in it] == [['ab', 'cd'], ['ef', 'ghijkl'], ['m']]
+
+
+def test_chunked_iterator_max_bytes_and_size():
+    data = [Text('a')] * 5
+    it = ChunkedIterator(iter(data), 2, max_bytes=100)
+    assert [len(chunk) for chunk in it] == [2, 2, 1]
+
+
+def test_chunked_iterator_records_size_of_chunk():
+    data = [Text('ab'), Text('ü'), Text('c')]
+    it = ChunkedIterator(iter(data), 2)
+    next(it)
+    assert it.size == 4
+    next(it)
+    assert it.size == 1
+
+
+def test_prefetch_iterator():
+    it = PrefetchIterator(iter(range(10)), 2)
+    assert list(it) == list(range(10))
+    assert it.queue.report['name'] == 'reader'
+    assert it.queue.report['max_depth'] <= 2
+
+
+def test_prefetch_iterator_with_error():
+    def generate():
+        yield 1
+        raise ValueError("bad input")
+
+    it = PrefetchIterator(generate(), 2)
+    assert next(it) == 1
+    with pytest.raises(ValueError):
+        next(it)
+
+
+def test_monitored_queue_report():
+    q = MonitoredQueue('test', 3)
+    q.put(1)
+    q.put(2)
+    assert q.get() == 1
+    assert q.get() == 2
+    report = q.report
+    assert report['size'] == 3
+    assert report['max_depth'] == 2
+    assert report['mean_depth'] == 1.5
+    assert report['gets'] == 2
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for _ in range(90):
+        histogram.add(0.001)
+    for _ in range(10):
+        histogram.add(0.1)
+    assert histogram.count == 100
+    assert histogram.max == 0.1
+    assert 0.001 <= histogram.percentile(50) < 0.0012
+    assert 0.001 <= histogram.percentile(90) < 0.0012
+    assert histogram.percentile(99) == 0.1
+
+
+def test_latency_histogram_merge_round_trip():
+    histogram1 = LatencyHistogram()
+    histogram1.add(0.01, 3)
+    histogram2 = LatencyHistogram()
+    histogram2.add(1.0)
+    histogram1.merge(LatencyHistogram.from_dict(histogram2.to_dict(), histogram2.total, histogram2.max))
+    assert histogram1.count == 4
+    assert histogram1.total == pytest.approx(1.03)
+    assert histogram1.percentile(100) == 1.0
+
+
+def test_slow_item_log_keeps_slowest():
+    log = SlowItemLog(0.5, size=2)
+    log.add(0.1, 'fast')
+    log.add(1.0, 'a')
+    log.add(3.0, 'b')
+    log.add(2.0, 'c')
+    assert log.items == [('b', 3.0), ('c', 2.0)]
+
+
+def test_task_metrics_report_merge():
+    class Item:
+        def __init__(self, id, text):
+            self.id = id
+            self.text = text
+
+    metrics1 = TaskMetrics('task', slow_threshold=1)
+    metrics1.add(2.0, Item('slow', 'ü'), 2)
+    metrics2 = TaskMetrics('task', slow_threshold=1)
+    metrics2.add_batch(1.0, [Item('1', 'ab'), Item('2', 'cd')], 4)
+    metrics = TaskMetrics.from_report(metrics1.report)
+    metrics.merge(TaskMetrics.from_report(metrics2.report))
+    report = metrics.report
+    assert report['count'] == 3
+    assert report['bytes'] == 6
+    assert report['time'] == pytest.approx(3.0)
+    assert report['items_per_sec'] == pytest.approx(1.0)
+    assert report['latency']['max'] == 2.0
+    assert report['slow_items'] == [('slow', 2.0)]
+
+
+class LineReader(InputIterator, SeekableInput):
+    def __init__(self, path, offset=None, count=None):
+        self.path = path
+        self.fp = file.open_text_at(path, offset=offset)
+        self.lines = itertools.islice(self.fp, count)
+
+    def __next__(self):
+        return next(self.lines).strip()
+
+    def __len__(self):
+        return file.count_lines(self.path)
+
+
+class TestShardManifest:
+    def setup_method(self):
+        self.temp_dir = pathlib.Path(tempfile.mkdtemp())
+        self.paths = [self.temp_dir / 'a.txt', self.temp_dir / 'b.txt']
+        self.paths[0].write_text('1\n2\n3\n')
+        self.paths[1].write_text('4\n5555555555\n6\n7')
+
+    def teardown_method(self):
+        file.delete_dir(self.temp_dir)
+
+    def test_create_with_num_shards(self):
+        manifest = ShardManifest.create(self.paths, num_shards=3)
+        assert len(manifest) == 3
+        assert manifest.count == 7
+        assert manifest[0] == [Segment(str(self.paths[0]), 0, 3)]
+        assert manifest[1] == [Segment(str(self.paths[1]), 0, 3)]
+        assert manifest[2] == [Segment(str(self.paths[1]), 15, 1)]
+
+    def test_create_with_shard_size(self):
+        manifest = ShardManifest.create(self.paths, shard_size=8)
+        assert [[segment.count for segment in shard] for shard in manifest.shards] == [[3, 1], [1], [2]]
+
+    def test_save_and_load(self):
+        manifest = ShardManifest.create(self.paths, num_shards=2)
+        path = self.temp_dir / 'manifest.json'
+        manifest.save(path)
+        assert ShardManifest.load(path).shards == manifest.shards
+
+    def test_shard_iterator(self):
+        manifest = ShardManifest.create(self.paths, num_shards=2)
+        items = []
+        for shard in manifest.shards:
+            iterator = ShardIterator(shard, LineReader)
+            assert len(iterator) == sum(segment.count for segment in shard)
+            items.extend(iterator)
+        assert items == ['1', '2', '3', '4', '5555555555', '6', '7']
+
+    def test_from_iterator(self):
+        iterator = SlicedIterator(GlobIterator(str(self.temp_dir / '*.txt'), LineReader), None, None)
+        manifest = ShardManifest.from_iterator(TimedIterator(iterator), num_shards=2)
+        assert manifest.count == 7
+
+    def test_from_iterator_without_seeking(self):
+        assert ShardManifest.from_iterator(TimedIterator(iter([1, 2])), num_shards=2) is None
+
+
 class MockIterator:
     def __init__(self, path):
         self.path = path
@@ -0,0 +1,91 @@
+import pytest
+
+from patapsco.util.cache import *
+
+
+@pytest.fixture(autouse=True)
+def take_report():
+    yield
+    ProcessedTextCache.take_report()
+
+
+def create_cache(tmp_path, max_size=1000, namespace='eng'):
+    return ProcessedTextCache(tmp_path / 'documents.sqlite', max_size, namespace)
+
+
+def test_get_and_put(tmp_path):
+    cache = create_cache(tmp_path)
+    key = cache.get_key('The Cats')
+    assert cache.get(key) is None
+    cache.put(key, 'The Cats', 'cat')
+    cache.flush()
+    assert cache.get(key) == ('The Cats', 'cat')
+    assert cache.take_stats() == {'name': 'documents', 'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'size': 1}
+
+
+def test_get_before_flush(tmp_path):
+    cache = create_cache(tmp_path)
+    key = cache.get_key('dogs')
+    cache.put(key, 'dogs', 'dog')
+    assert cache.get(key) == ('dogs', 'dog')
+
+
+def test_get_many(tmp_path):
+    cache = create_cache(tmp_path)
+    keys = [cache.get_key(text) for text in ['a', 'b', 'c']]
+    cache.put(keys[0], 'a', 'a')
+    cache.put(keys[2], 'c', 'c')
+    cache.flush()
+    assert cache.get_many(keys) == {keys[0]: ('a', 'a'), keys[2]: ('c', 'c')}
+
+
+def test_persists_across_instances(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.put(cache.get_key('dogs'), 'dogs', 'dog')
+    cache.close()
+    cache = create_cache(tmp_path)
+    assert cache.get(cache.get_key('dogs')) == ('dogs', 'dog')
+
+
+def test_namespaces_are_separate(tmp_path):
+    cache = create_cache(tmp_path, namespace='eng porter')
+    cache.put(cache.get_key('dogs'), 'dogs', 'dog')
+    cache.close()
+    cache = create_cache(tmp_path, namespace='eng spacy')
+    assert cache.get(cache.get_key('dogs')) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = create_cache(tmp_path, max_size=100)
+    keys = [cache.get_key(str(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, 'x' * 15, 'x' * 15)
+        cache.flush()
+    cache.get(keys[0])
+    cache.flush()
+    cache.put(cache.get_key('3'), 'x' * 15, 'x' * 15)
+    cache.flush()
+    assert set(cache.get_many(keys)) == {keys[0], keys[2]}
+    assert cache.count == 3
+
+
+def test_take_report_keeps_closed_caches_until_reported(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.get(cache.get_key('dogs'))
+    cache.close()
+    assert ProcessedTextCache.take_report() == [{'name': 'documents', 'hits': 0, 'misses': 1, 'hit_rate': 0,
+                                                 'size': 0}]
+    assert cache not in ProcessedTextCache.caches
+
+
+def test_totals_are_kept_by_every_instance(tmp_path):
+    cache = create_cache(tmp_path)
+    other = create_cache(tmp_path, namespace='spa')
+    cache.put(cache.get_key('dogs'), 'dogs', 'dog')
+    cache.put(cache.get_key('cats'), 'cats', 'cat')
+    cache.flush()
+    other.put(cache.get_key('dogs'), 'dogs', 'dog')
+    other.put(other.get_key('gatos'), 'gatos', 'gato')
+    other.flush()
+    assert other.conn.execute('SELECT count, size FROM totals').fetchone() == (3, 23)
+    assert other.get_size() == 3
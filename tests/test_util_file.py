@@ -1,3 +1,4 @@
+import gzip
 import pathlib
 import tempfile
 
@@ -46,3 +47,61 @@ def test_count_lines_with():
     directory = pathlib.Path(__file__).parent / 'trec_files'
     assert file.count_lines_with('<topic', str(directory / 'topics.xml')) == 3
     assert file.count_lines_with('aaa', str(directory / 'results.txt')) == 2
+
+
+def test_scan_records():
+    directory = pathlib.Path(__file__).parent / 'trec_files'
+    offsets, end = file.scan_records(directory / 'docs1.sgml', '<DOC>')
+    assert len(offsets) == 2
+    assert offsets[0] == 0
+    with file.open_text_at(directory / 'docs1.sgml', offset=offsets[1]) as fp:
+        assert fp.readline() == '<DOC>\n'
+    assert end == (directory / 'docs1.sgml').stat().st_size
+
+
+def test_scan_records_with_gzip():
+    path = pathlib.Path(tempfile.mkdtemp()) / 'lines.txt.gz'
+    with gzip.open(path, 'wt') as fp:
+        fp.write('one\ntwo\nthree')
+    offsets, end = file.scan_records(path)
+    assert list(offsets) == [0, 4, 8]
+    assert end == 13
+    with file.open_text_at(path, offset=offsets[2]) as fp:
+        assert fp.read() == 'three'
+    file.delete_dir(path.parent)
+
+
+def test_get_record_index_uses_cache(monkeypatch):
+    directory = pathlib.Path(tempfile.mkdtemp())
+    monkeypatch.setenv('PATAPSCO_CACHE', str(directory / 'cache'))
+    path = directory / 'lines.txt'
+    path.write_text('one\ntwo\n')
+    index = file.get_record_index(path)
+    assert index.count == 2
+    assert index.offsets == [0, 4]
+    assert len(list((directory / 'cache').glob('*.json'))) == 1
+    # a cache hit does not scan the file
+    monkeypatch.setattr(file, 'scan_records', None)
+    assert file.count_lines(path) == 2
+    file.delete_dir(directory)
+
+
+def test_get_record_index_with_modified_file(monkeypatch):
+    directory = pathlib.Path(tempfile.mkdtemp())
+    monkeypatch.setenv('PATAPSCO_CACHE', str(directory / 'cache'))
+    path = directory / 'lines.txt'
+    path.write_text('one\ntwo\n')
+    assert file.count_lines(path) == 2
+    path.write_text('one\ntwo\nthree\n')
+    assert file.count_lines(path) == 3
+    file.delete_dir(directory)
+
+
+def test_get_record_index_with_sparse_offsets():
+    path = pathlib.Path(tempfile.mkdtemp()) / 'lines.txt'
+    path.write_text('x\n' * 5000)
+    index = file.get_record_index(path)
+    assert index.count == 5000
+    assert index.interval == 5
+    assert index.offsets[:2] == [0, 10]
+    file.delete_dir(path.parent)
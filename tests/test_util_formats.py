@@ -2,6 +2,7 @@ import pathlib
 
 import pytest
 
+from patapsco.util import file
 from patapsco.util.formats import *
 
 
@@ -19,6 +20,20 @@ def test_parse_sgml_documents():
         next(doc_iter)
 
 
+def test_parse_sgml_documents_with_offset_and_count():
+    directory = pathlib.Path(__file__).parent / 'trec_files'
+    path = directory / 'docs1.sgml'
+    offset = file.scan_records(path, '<DOC>')[0][1]
+    doc_iter = parse_sgml_documents(str(path.absolute()), offset=offset, count=1)
+    assert next(doc_iter)[0] == 'TUVXYZ'
+    with pytest.raises(StopIteration):
+        next(doc_iter)
+    doc_iter = parse_sgml_documents(str(path.absolute()), count=1)
+    assert next(doc_iter)[0] == 'ABCDEF'
+    with pytest.raises(StopIteration):
+        next(doc_iter)
+
+
 def test_parse_sgml_documents_with_bad_encoding():
     directory = pathlib.Path(__file__).parent / 'trec_files'
     path = directory / 'not_utf8.txt'
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from patapsco.error import PatapscoError
+from patapsco.pipeline import BatchPipeline, StreamingPipeline, Task
+from patapsco.util.memory import *
+
+
+class SlowTask(Task):
+    def process(self, item):
+        time.sleep(0.01)
+        return item
+
+
+class FlushingSink(Task):
+    sink = True
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def process(self, item):
+        return item
+
+    def checkpoint(self):
+        self.flushes += 1
+
+
+def test_get_process_tree_rss():
+    assert get_process_tree_rss() > 0
+
+
+def test_memory_monitor_records_stages_and_tasks():
+    monitor = MemoryMonitor(interval=0.005)
+    pipeline = StreamingPipeline(iter(range(20)), [SlowTask()])
+    pipeline.monitor = monitor
+    with monitor:
+        monitor.set_stage('stage1')
+        pipeline.run()
+    report = monitor.report
+    assert report['peak'] > 0
+    assert report['budget'] is None
+    assert 'SlowTask' in report['stages']['stage1']['tasks']
+    assert all(sample['stage'] == 'stage1' for sample in report['timeline'])
+
+
+def test_memory_monitor_timeline_is_bounded():
+    monitor = MemoryMonitor(interval=0.5, timeline=4)
+    monitor.set_stage('stage1')
+    for _ in range(20):
+        monitor.sample()
+    report = monitor.report
+    assert len(report['timeline']) <= 4
+    # the resolution was halved rather than dropping the start of the run
+    assert monitor.stride > 1
+    assert report['timeline_interval'] == 0.5 * monitor.stride
+    assert report['stages']['stage1']['peak'] == report['peak'] > 0
+
+
+def test_memory_monitor_without_timeline():
+    monitor = MemoryMonitor(timeline=0)
+    monitor.set_stage('stage1')
+    assert monitor.report['timeline'] == []
+    assert monitor.peak > 0
+
+
+def test_memory_monitor_fails_pipeline_over_budget():
+    monitor = MemoryMonitor(interval=10, budget=1)
+    pipeline = StreamingPipeline(iter(range(5)), [FlushingSink()])
+    pipeline.monitor = monitor
+    with monitor:
+        monitor.set_stage('stage1')
+        with pytest.raises(PatapscoError, match='exceeds the budget'):
+            pipeline.run()
+
+
+def test_memory_monitor_pressure_flushes_and_shrinks_batches():
+    monitor = MemoryMonitor(interval=10, budget=2 * get_process_tree_rss(), warning=0.01)
+    sink = FlushingSink()
+    pipeline = BatchPipeline(iter(range(10)), [sink], 4, batch_bytes=1000)
+    pipeline.monitor = monitor
+    with monitor:
+        monitor.set_stage('stage1')
+        pipeline.run()
+    assert sink.flushes == 1
+    assert pipeline.chunker.max_bytes == 500
+    assert pipeline.chunker.n == 2
+    assert not monitor.take_pressure()
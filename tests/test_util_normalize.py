@@ -1,3 +1,8 @@
+import collections
+import random
+
+import pytest
+
 from patapsco.schema import NormalizationConfig
 from patapsco.util.normalize import *
 
@@ -67,3 +72,51 @@ class TestNormalizer:
         assert r2[0] == '\u2000'
         assert r2[1] == '\u2001'
         assert r2[-1] == '\u2009'
+
+
+class TestFastPreNormalize:
+    corpus = [
+        "",
+        "plain ascii text",
+        "line1\nline2\r\nline3\n\n",
+        "tabs\tand  double   spaces \x0b\x0c\x1c\x1f end",
+        "ascii controls \x00\x07\x1b\x7f removed",
+        "But we\u00e2\u0080\u0099ve come out the other side of it",
+        "s\u00c3\u00b3 and voil\u00c3 le travail",
+        "C1 control \u0085 and \u0096 chars",
+        "\u0043\u0327 combining and \u2160 and \uff0c",
+        "no\u00a0break and soft\u00adhyphen",
+        "a \u200b b\t\u200b\tc",
+        "rtl \u200e\u200f\u202a\u202e\u2066\u2069 marks",
+        "variation\ufe0f selector \u2764\ufe0f",
+        "\ufeffbyte order mark",
+        "شما بليز رو به فارسی چی میگین؟ می\u200cتوان",
+        "فيلم جاذبية يتصدر ترشيحات\u061c جوائز",
+        "Новые расходы финансируются благодаря крупным суммам",
+        "Р\u045eРѕРІС‹Рµ mojibake cyrillic",
+        "不但要看\u3000而且要帮。",
+        "private use \ue000 and unassigned \u0378 and \U000e0001 tag",
+        "spaces \u2000\u2001\u2009\u200a\u2028\u2029\u202f\u205f\u3000 end",
+        "\u1e9b\u0323 and \u0071\u0307\u0323",
+    ]
+
+    @staticmethod
+    def random_corpus(count=500, seed=13):
+        rng = random.Random(seed)
+        pool = ("abc XYZ 123 .,!\n\t\r\x00\x1b\x7f\x85\x96\xa0\xad\xe2\x80\x99\xc3\xa9"
+                "\u0301\u0327\u0645\u0650\u200b\u200c\u200d\u200e\u2028\u2060\u2063\u3000"
+                "\ufe0f\ufeff\ue000\u0378\u0420\u0421\u0451\u4e0d\uff0c")
+        return [''.join(rng.choice(pool) for _ in range(rng.randint(0, 40))) for _ in range(count)]
+
+    @pytest.mark.parametrize('lang', list(NormalizerFactory.classes) + ['xyz'])
+    def test_same_as_individual_steps(self, lang):
+        normalizer = NormalizerFactory.create(lang, NormalizationConfig())
+        for text in self.corpus + self.random_corpus():
+            assert normalizer.pre_normalize(text) == normalizer.slow_pre_normalize(text), repr(text)
+
+    def test_count_changes(self):
+        normalizer = GenericNormalizer(NormalizationConfig())
+        changes = collections.Counter()
+        text = normalizer.pre_normalize("a\t\tb  c\u200bd \u0043\u0327", changes)
+        assert text == "a b cd \u00c7"
+        assert changes == {'\t →  ': 1, 'del \t': 1, 'del  ': 1, 'del \u200b': 1, '\u0043\u0327 → \u00c7': 1}
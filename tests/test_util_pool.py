@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+from patapsco.util.pool import *
+from patapsco.util import pool as pool_module
+
+
+def get_pid():
+    return os.getpid()
+
+
+def get_startup():
+    return take_startup_time(), take_startup_time()
+
+
+def has_module(name):
+    return name in sys.modules
+
+
+@pytest.fixture(autouse=True)
+def shutdown():
+    yield
+    shutdown_worker_pool()
+
+
+def test_worker_pool_is_reused():
+    pool = get_worker_pool(1, 1)
+    pid = pool.submit(get_pid).result()
+    assert get_worker_pool(1, 2) is pool
+    assert pool.submit(get_pid).result() == pid
+
+
+def test_worker_pool_reused_when_larger_and_few_jobs():
+    pool = get_worker_pool(2, 5)
+    assert get_worker_pool(1, 1) is pool
+
+
+def test_worker_pool_replaced_when_too_small():
+    pool = get_worker_pool(1, 1)
+    assert get_worker_pool(2, 2) is not pool
+    assert pool_module._pool.num_workers == 2
+
+
+def test_worker_pool_replaced_when_too_large_for_jobs():
+    pool = get_worker_pool(2, 2)
+    assert get_worker_pool(1, 4) is not pool
+
+
+def test_worker_pool_replaced_with_different_start_method():
+    pool = get_worker_pool(1, 1, 'forkserver')
+    assert get_worker_pool(1, 1, 'spawn') is not pool
+
+
+def test_worker_pool_preloads_modules():
+    pool = WorkerPool(1, 'spawn', preload=['json', 'no_such_module'])
+    try:
+        assert pool.submit(has_module, 'json').result()
+    finally:
+        pool.shutdown()
+
+
+def test_take_startup_time_is_only_reported_once():
+    pool = get_worker_pool(1, 1)
+    first, second = pool.submit(get_startup).result()
+    assert first > 0
+    assert second == 0
+    assert pool.submit(get_startup).result() == (0, 0)
+
+
+def test_shutdown_worker_pool():
+    get_worker_pool(1, 1)
+    shutdown_worker_pool()
+    assert pool_module._pool is None
+
+
+def test_workers_know_how_many_share_the_cpus():
+    pool = get_worker_pool(2, 2)
+    assert pool.submit(get_worker_count).result() == 2
+
+
+def test_get_cpu_share():
+    try:
+        set_worker_count(get_cpu_count() + 1)
+        assert get_cpu_share() == 1
+        set_worker_count(1)
+        assert get_cpu_share() == get_cpu_count()
+    finally:
+        set_worker_count(1)
@@ -0,0 +1,57 @@
+import pstats
+
+import pytest
+
+from patapsco.error import ConfigError
+from patapsco.util.profiler import *
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def outer():
+    total = 0
+    for _ in range(20):
+        total += busy(20000)
+    return total
+
+
+def test_cprofile_writes_pstats_and_collapsed(tmp_path):
+    with get_profiler('cprofile', tmp_path / 'profile' / 'stage1'):
+        outer()
+    stats = pstats.Stats(str(tmp_path / 'profile' / 'stage1.pstats'))
+    assert any(func[2] == 'busy' for func in stats.stats)
+    lines = (tmp_path / 'profile' / 'stage1.collapsed').read_text().splitlines()
+    assert any('outer (test_util_profiler.py:13);busy (test_util_profiler.py:9)' in line for line in lines)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+
+
+def test_sampling_profiler_writes_pstats_and_collapsed(tmp_path):
+    with get_profiler('sampling', tmp_path / 'stage2', interval=0.001):
+        for _ in range(10):
+            outer()
+    stats = pstats.Stats(str(tmp_path / 'stage2.pstats'))
+    busy_stats = [value for func, value in stats.stats.items() if func[2] == 'busy']
+    assert busy_stats and busy_stats[0][3] > 0
+    outer_func = next(func for func in stats.stats if func[2] == 'outer')
+    assert outer_func in stats.stats[next(func for func in stats.stats if func[2] == 'busy')][4]
+    lines = (tmp_path / 'stage2.collapsed').read_text().splitlines()
+    assert any(line.startswith('MainThread;') and 'outer (test_util_profiler.py:13)' in line for line in lines)
+
+
+def test_profiler_name_with_part(tmp_path):
+    with get_profiler('sampling', tmp_path / 'stage1.part_3'):
+        outer()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['stage1.part_3.collapsed', 'stage1.part_3.pstats']
+
+
+def test_get_profiler_none(tmp_path):
+    with get_profiler(None, tmp_path / 'stage1'):
+        pass
+    assert not list(tmp_path.iterdir())
+
+
+def test_get_profiler_unknown(tmp_path):
+    with pytest.raises(ConfigError):
+        get_profiler('yappi', tmp_path / 'stage1')